@@ -0,0 +1,183 @@
+from datetime import date, datetime, time as dt_time, timedelta
+import time
+
+from sqlalchemy import delete, func, insert, or_, select, text, update
+
+from inventory import RESERVATION_TTL
+from models import AnalyticsWatermark, DailyPayments, DailySales, Order, Payment, Produce
+from payments import CALLBACK_WINDOW
+
+# Rows younger than this may still be in uncommitted transactions, leave them for the next run
+REFRESH_LAG = timedelta(minutes=5)
+# A Pending order drops out of the sales once its reservation runs out and the reaper gets to it,
+# so days that recent are rebuilt on every run even after they're closed
+EXPIRY_SLACK = timedelta(hours=1)
+WATERMARK = "daily"
+EXCLUDED_ORDER_STATUSES = ("Expired",)
+ANALYTICS_LOCK_KEY = 72163401
+
+daily_sales = DailySales.__table__
+daily_payments = DailyPayments.__table__
+watermarks = AnalyticsWatermark.__table__
+
+
+def as_date(value):
+    # func.date() comes back as a string on SQLite
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+
+def rebuild_daily_sales(session, start_day, until):
+    day = func.date(Order.created_at)
+    category = func.coalesce(Produce.category, "")
+    rows = session.execute(
+        select(
+            day, Order.farmer_id, category,
+            func.count(), func.sum(Order.quantity), func.sum(Order.total_price)
+        )
+        .join(Produce, Order.produce_id == Produce.id)
+        .where(Order.created_at >= datetime.combine(start_day, dt_time.min))
+        .where(Order.created_at < until)
+        .where(or_(Order.order_status.is_(None), Order.order_status.notin_(EXCLUDED_ORDER_STATUSES)))
+        .group_by(day, Order.farmer_id, category)
+    ).all()
+
+    session.execute(delete(daily_sales).where(daily_sales.c.day >= start_day))
+    if rows:
+        session.execute(insert(daily_sales), [{
+            "day": as_date(row_day),
+            "farmer_id": farmer_id,
+            "category": row_category,
+            "order_count": count,
+            "quantity": quantity,
+            "gmv": gmv,
+        } for row_day, farmer_id, row_category, count, quantity, gmv in rows])
+
+
+def rebuild_daily_payments(session, start_day, until):
+    day = func.date(Payment.created_at)
+    status = func.coalesce(Payment.payment_status, "")
+    rows = session.execute(
+        select(day, status, func.count(), func.sum(Payment.amount))
+        .where(Payment.created_at >= datetime.combine(start_day, dt_time.min))
+        .where(Payment.created_at < until)
+        .group_by(day, status)
+    ).all()
+
+    session.execute(delete(daily_payments).where(daily_payments.c.day >= start_day))
+    if rows:
+        session.execute(insert(daily_payments), [{
+            "day": as_date(row_day),
+            "payment_status": row_status,
+            "payment_count": count,
+            "amount": amount,
+        } for row_day, row_status, count, amount in rows])
+
+
+def refresh_analytics(session, now=None, lag=REFRESH_LAG, reservation_ttl=RESERVATION_TTL):
+    until = (now or datetime.utcnow()) - lag
+
+    if session.get_bind().dialect.name == "postgresql":
+        # One refresher at a time, a second one waits and then finds little to do
+        session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": ANALYTICS_LOCK_KEY})
+
+    high_water = session.execute(
+        select(watermarks.c.high_water).where(watermarks.c.name == WATERMARK)
+    ).scalar()
+
+    if high_water is None:
+        earliest = [
+            session.execute(select(func.min(Order.created_at))).scalar(),
+            session.execute(select(func.min(Payment.created_at))).scalar(),
+        ]
+        sales_start = payments_start = min([e for e in earliest if e is not None] or [until]).date()
+    else:
+        # Days from the watermark onwards are rebuilt whole, which keeps reruns idempotent. So are
+        # the days whose rows can still change status: orders until their reservation expires,
+        # payments until callbacks stop being applied to them.
+        sales_start = min(high_water, until - reservation_ttl - EXPIRY_SLACK).date()
+        payments_start = min(high_water, until - CALLBACK_WINDOW).date()
+
+    rebuild_daily_sales(session, sales_start, until)
+    rebuild_daily_payments(session, payments_start, until)
+
+    if high_water is None:
+        session.execute(insert(watermarks).values(name=WATERMARK, high_water=until))
+    else:
+        session.execute(update(watermarks).where(watermarks.c.name == WATERMARK).values(high_water=until))
+    session.commit()
+    return min(sales_start, payments_start), until
+
+
+def run_analytics_refresher(session, interval=300.0, reservation_ttl=RESERVATION_TTL):
+    while True:
+        refresh_analytics(session, reservation_ttl=reservation_ttl)
+        time.sleep(interval)
+
+
+def sales_by_day(session, start, end, farmer_id=None):
+    query = (
+        select(
+            daily_sales.c.day,
+            func.sum(daily_sales.c.order_count),
+            func.sum(daily_sales.c.quantity),
+            func.sum(daily_sales.c.gmv),
+        )
+        .where(daily_sales.c.day.between(start, end))
+        .group_by(daily_sales.c.day)
+        .order_by(daily_sales.c.day)
+    )
+    if farmer_id is not None:
+        query = query.where(daily_sales.c.farmer_id == farmer_id)
+    return [{
+        "day": day.isoformat(),
+        "orders": orders,
+        "quantity": quantity,
+        "gmv": float(gmv),
+    } for day, orders, quantity, gmv in session.execute(query)]
+
+
+def sales_by_category(session, start, end):
+    gmv = func.sum(daily_sales.c.gmv)
+    rows = session.execute(
+        select(daily_sales.c.category, func.sum(daily_sales.c.order_count), func.sum(daily_sales.c.quantity), gmv)
+        .where(daily_sales.c.day.between(start, end))
+        .group_by(daily_sales.c.category)
+        .order_by(gmv.desc())
+    )
+    return [{
+        "category": category or None,
+        "orders": orders,
+        "quantity": quantity,
+        "gmv": float(total),
+    } for category, orders, quantity, total in rows]
+
+
+def revenue_by_farmer(session, start, end, limit):
+    revenue = func.sum(daily_sales.c.gmv)
+    rows = session.execute(
+        select(daily_sales.c.farmer_id, func.sum(daily_sales.c.order_count), revenue)
+        .where(daily_sales.c.day.between(start, end))
+        .group_by(daily_sales.c.farmer_id)
+        .order_by(revenue.desc())
+        .limit(limit)
+    )
+    return [{
+        "farmer_id": farmer_id,
+        "orders": orders,
+        "revenue": float(total),
+    } for farmer_id, orders, total in rows]
+
+
+def payments_by_day(session, start, end):
+    rows = session.execute(
+        select(daily_payments.c.day, daily_payments.c.payment_status,
+               daily_payments.c.payment_count, daily_payments.c.amount)
+        .where(daily_payments.c.day.between(start, end))
+        .order_by(daily_payments.c.day, daily_payments.c.payment_status)
+    )
+    return [{
+        "day": day.isoformat(),
+        "status": status or None,
+        "payments": count,
+        "amount": float(amount),
+    } for day, status, count, amount in rows]
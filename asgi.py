@@ -0,0 +1,388 @@
+"""Async serving mode: the I/O-bound routes on Quart over asyncpg/aiosqlite, the rest of the API
+through the regular Flask app in a thread pool, under the same URLs and JSON contracts.
+Needs quart, uvicorn or hypercorn, httpx, and asyncpg (Postgres) or aiosqlite (SQLite).
+
+    uvicorn --factory asgi:create_asgi_app --port 5000
+    hypercorn "asgi:create_asgi_app()" --bind 127.0.0.1:5000
+    python asgi.py
+"""
+import asyncio
+from functools import wraps
+import math
+import time
+
+from flask_jwt_extended import decode_token
+from hypercorn.middleware import AsyncioWSGIMiddleware, ProxyFixMiddleware
+from jwt import ExpiredSignatureError
+from quart import Blueprint, Quart, Response, abort, current_app, g, jsonify, request
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from werkzeug.exceptions import HTTPException
+
+from app import (
+    ORDER_PAGE_DEFAULT, ORDER_PAGE_MAX, PRODUCE_ID_MAX, PRODUCE_PAGE_DEFAULT, PRODUCE_PAGE_MAX, cache_validators,
+    conditional, create_app, decode_cursor, existing_produce_query, known_detail_versions, minted_detail_versions,
+    next_cursor_headers, not_modified, order_stream_topics, page_limit, parse_order_filters, parse_produce_ids,
+    produce_detail_validators, produce_details_query, produce_listing_cache, produce_listing_page,
+    produce_listing_query, unversioned, vendor_orders_query,
+)
+from cache import PRODUCE_CATALOGUE, cache, produce_detail_namespace
+from jobs import enqueue, queued_jobs
+from metrics import metrics
+from events import changes, produce_event, produce_topic, sse_stream_async, stock_query
+from models import Farmer, Produce, Vendor, db as sync_db
+from mpesa import AsyncDarajaClient, DarajaError
+from payments import queue_payment, record_payment
+from ratelimit import SERVER_BUSY, STREAM_PREFIX, TOO_MANY_REQUESTS, rate_limiter
+from replicas import engine_options, last_write, replica_caught_up
+from schemas import PRODUCE_DETAIL, VENDOR_ORDER, FastJSONProvider, dumps
+
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+WSGI_MAX_BODY = 16 * 1024 * 1024  # bulk uploads go through the sync app, which buffers the body first
+
+aio = Blueprint("api", __name__)
+
+
+def async_database_url(uri):
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver for {backend} databases")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+class AsyncDatabase:
+    # Async engines for the primary and, when configured, the replica
+    def __init__(self, config):
+        uri = config["SQLALCHEMY_DATABASE_URI"]
+        self.primary = create_async_engine(async_database_url(uri), **engine_options(uri, config))
+        self.replica = None
+        if config.get("DATABASE_REPLICA_URL"):
+            replica_uri = config["DATABASE_REPLICA_URL"]
+            self.replica = create_async_engine(async_database_url(replica_uri), **engine_options(replica_uri, config))
+        self.max_lag = config["REPLICA_MAX_LAG"]
+        # Rows are used after commit, expiring them would mean a lazy load outside the greenlet
+        self.sessions = async_sessionmaker(self.primary, expire_on_commit=False)
+        self.replica_sessions = async_sessionmaker(self.replica, expire_on_commit=False) if self.replica else None
+
+    def session(self):
+        return self.sessions()
+
+    def reader(self, written_at=None):
+        # Same rule as use_replica(): the replica only once it can have seen written_at
+        if self.replica_sessions is not None and replica_caught_up(written_at, self.max_lag):
+            return self.replica_sessions()
+        return self.sessions()
+
+    async def dispose(self):
+        await self.primary.dispose()
+        if self.replica is not None:
+            await self.replica.dispose()
+
+
+def db():
+    return current_app.extensions["async_db"]
+
+
+def jwt_claims(token):
+    # Checked by flask_jwt_extended against the sync app's JWT settings
+    with current_app.extensions["sync_app"].app_context():
+        return decode_token(token)
+
+
+def jwt_required(view):
+    # The error bodies follow flask_jwt_extended's defaults
+    @wraps(view)
+    async def wrapper(*args, **kwargs):
+        authorization = request.headers.get("Authorization")
+        if not authorization:
+            return {"msg": "Missing Authorization Header"}, 401
+        scheme, _, token = authorization.partition(" ")
+        if scheme != "Bearer" or not token:
+            return {"msg": "Missing 'Bearer' type in 'Authorization' header. Expected 'Authorization: Bearer <JWT>'"}, 401
+        try:
+            claims = jwt_claims(token)
+        except ExpiredSignatureError:
+            return {"msg": "Token has expired"}, 401
+        except Exception as exc:
+            return {"msg": str(exc)}, 422
+        if claims.get("type") != "access":
+            return {"msg": "Only non-refresh tokens are allowed"}, 422
+        g.jwt_identity = claims[current_app.config["JWT_IDENTITY_CLAIM"]]
+        g.jwt_claims = claims
+        return await view(*args, **kwargs)
+    return wrapper
+
+
+def vendor_identity():
+    # asyncpg wants the integer, not the string the token carries
+    return int(g.jwt_identity)
+
+
+@aio.before_app_request
+async def limit_request():
+    g.request_started = time.perf_counter()
+    if current_app.config["RATELIMIT_ENABLED"]:
+        identity = rate_limiter.token_identity(request.headers.get("Authorization", ""), jwt_claims)
+        retry_after = rate_limiter.retry_after(request.remote_addr, identity, request.endpoint)
+        if retry_after is not None:
+            return TOO_MANY_REQUESTS, 429, {"Retry-After": str(max(1, math.ceil(retry_after)))}
+
+    # Admission control, as in the sync app: shed load before the pool queue grows
+    slots = current_app.extensions.get("admission")
+    if slots is not None and not request.path.startswith(STREAM_PREFIX):
+        try:
+            await asyncio.wait_for(slots.acquire(), current_app.config["ADMISSION_TIMEOUT"])
+        except asyncio.TimeoutError:
+            return SERVER_BUSY, 503, {"Retry-After": "1"}
+        g.admitted = True
+    return None
+
+
+@aio.after_app_request
+async def observe_request(response):
+    started = g.get("request_started")
+    if started is not None and current_app.config["METRICS_ENABLED"]:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.request_latency.observe((request.method, route, response.status_code), time.perf_counter() - started)
+    return response
+
+
+@aio.teardown_app_request
+async def release_slot(exc):
+    if g.pop("admitted", False):
+        current_app.extensions["admission"].release()
+
+
+@aio.route("/api/produce", methods=["GET"])
+async def get_produce():
+    if request.args.get("ids"):
+        return await get_produce_batch()
+
+    category = request.args.get("category")
+    cursor = request.args.get("cursor")
+    limit = page_limit(PRODUCE_PAGE_DEFAULT, PRODUCE_PAGE_MAX, request.args)
+    try:
+        position = decode_cursor(cursor) if cursor else None
+    except (ValueError, UnicodeDecodeError):
+        return jsonify({"message": "Invalid cursor"}), 400
+
+    namespace, key = produce_listing_cache(category, cursor, limit)
+    etag, last_modified = cache_validators(cache.version(namespace), key)
+    if not_modified(etag, last_modified, request):
+        return conditional(Response(status=304), etag, last_modified)
+
+    async def load_page():
+        async with db().reader(max(cache.version(namespace), cache.version(PRODUCE_CATALOGUE))) as session:
+            rows = (await session.execute(produce_listing_query(category, position, limit))).all()
+        return produce_listing_page(rows, limit)
+
+    page, version = await cache.cached_async(namespace, key, load_page)
+    etag, last_modified = cache_validators(version, key)
+
+    response = Response(dumps(page["items"]), mimetype="application/json")
+    if page["next_cursor"]:
+        response.headers["X-Next-Cursor"] = page["next_cursor"]
+    return conditional(response, etag, last_modified), 200
+
+
+async def produce_detail_versions(produce_ids):
+    # As the sync app's: versions are only minted for listings that exist
+    known = known_detail_versions(produce_ids)
+    missing = unversioned(known)
+    found = set()
+    if missing:
+        async with db().session() as session:
+            found = set((await session.execute(existing_produce_query(missing))).scalars())
+    return minted_detail_versions(known, found)
+
+
+async def cached_produce_details(versions):
+    async def load(namespaces):
+        async with db().reader(max(versions[namespace] for namespace in namespaces)) as session:
+            produce_ids = [int(namespace.rsplit(":", 1)[1]) for namespace in namespaces]
+            rows = (await session.execute(produce_details_query(produce_ids))).all()
+        return {produce_detail_namespace(item["id"]): item for item in PRODUCE_DETAIL.dump_all(rows)}
+
+    items, _ = await cache.cached_many_async(list(versions), "detail", load, versions)
+    return [items[namespace] for namespace in versions if namespace in items]
+
+
+async def get_produce_batch():
+    try:
+        produce_ids = parse_produce_ids(request.args["ids"])
+    except ValueError as exc:
+        return jsonify({"message": str(exc)}), 400
+
+    versions = await produce_detail_versions(produce_ids)
+    if not versions:
+        return jsonify([]), 200
+    etag, last_modified = produce_detail_validators(versions)
+    if not_modified(etag, last_modified, request):
+        return conditional(Response(status=304), etag, last_modified)
+    return conditional(jsonify(await cached_produce_details(versions)), etag, last_modified), 200
+
+
+@aio.route("/api/produce/<int:produce_id>", methods=["GET"])
+async def get_produce_details(produce_id):
+    versions = await produce_detail_versions([produce_id]) if produce_id <= PRODUCE_ID_MAX else {}
+    if not versions:
+        return jsonify({"message": "Produce not found"}), 404
+    etag, last_modified = produce_detail_validators(versions)
+    if not_modified(etag, last_modified, request):
+        return conditional(Response(status=304), etag, last_modified)
+
+    items = await cached_produce_details(versions)
+    if not items:
+        return jsonify({"message": "Produce not found"}), 404
+    return conditional(jsonify(items[0]), etag, last_modified), 200
+
+
+@aio.route("/api/orders", methods=["GET"])
+@jwt_required
+async def get_orders():
+    vendor_id = vendor_identity()
+    limit = page_limit(ORDER_PAGE_DEFAULT, ORDER_PAGE_MAX, request.args)
+    try:
+        filters = parse_order_filters(request.args)
+    except ValueError as exc:
+        return jsonify({"message": str(exc)}), 400
+
+    async with db().reader(last_write(f"vendor:{vendor_id}")) as session:
+        orders = (await session.execute(vendor_orders_query(vendor_id, limit, **filters))).all()
+    return Response(dumps(VENDOR_ORDER.dump_all(orders)), mimetype="application/json",
+                    headers=next_cursor_headers(orders, limit)), 200
+
+
+def event_stream_response(body):
+    response = Response(body, mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    response.timeout = None  # Quart cuts streamed bodies off after RESPONSE_TIMEOUT otherwise
+    return response
+
+
+@aio.route("/api/stream/orders", methods=["GET"])
+@jwt_required
+async def stream_orders():
+    if changes.full():
+        return SERVER_BUSY, 503, {"Retry-After": "5"}
+    topics = order_stream_topics(g.jwt_claims)
+    return event_stream_response(sse_stream_async(changes, current_app.extensions["changes_engine"], topics))
+
+
+@aio.route("/api/stream/produce/<int:produce_id>", methods=["GET"])
+async def stream_produce(produce_id):
+    # The body runs after the app context is gone, so the database is bound here
+    database = db()
+
+    async def snapshot():
+        async with database.session() as session:
+            return [produce_event(row) for row in (await session.execute(stock_query([produce_id]))).mappings()]
+
+    async with database.session() as session:
+        if await session.get(Produce, produce_id) is None:
+            return jsonify({"message": "Produce not found"}), 404
+    if changes.full():
+        return SERVER_BUSY, 503, {"Retry-After": "5"}
+    return event_stream_response(sse_stream_async(changes, current_app.extensions["changes_engine"],
+                                                  [produce_topic(produce_id)], snapshot))
+
+
+@aio.route("/api/payment/mpesa", methods=["POST"])
+@jwt_required
+async def mpesa_payment():
+    data = await request.get_json()
+    amount = data["amount"]
+
+    async with db().session() as session:
+        vendor = await session.get(Vendor, vendor_identity())
+        farmer = await session.get(Farmer, data["farmer_id"])
+        if vendor is None or farmer is None:
+            abort(404)
+
+        if current_app.config["MPESA_ASYNC"]:
+            if await session.run_sync(queued_jobs, "payments") >= current_app.config["MPESA_QUEUE_SIZE"]:
+                return jsonify({"message": "Payment queue is full, try again shortly"}), 503
+            payment = await session.run_sync(queue_payment, vendor.id, farmer.id, data.get("order_id"), amount)
+            job_id = await session.run_sync(enqueue, "stk_push", {
+                "payment_id": payment.id,
+                "amount": amount,
+                "phone_number": vendor.phone,
+                "farmer_number": farmer.phone,
+            })
+            await session.commit()
+            return jsonify({"message": "Payment queued", "job_id": job_id, "payment_id": payment.id}), 202
+
+    # No connection is held while Daraja answers, and the worker serves other requests meanwhile
+    try:
+        response = await current_app.extensions["daraja"].stk_push(vendor.phone, amount, farmer.phone)
+    except DarajaError:
+        current_app.logger.exception("STK push failed")
+        return jsonify({"message": "M-Pesa is unavailable, try again shortly"}), 502
+
+    if response.get("ResponseCode") != "0":
+        return jsonify({"message": "Payment initiation failed", "response": response}), 400
+    async with db().session() as session:
+        payment = await session.run_sync(record_payment, vendor.id, farmer.id, data.get("order_id"), amount, response)
+    return jsonify({"message": "Payment initiated successfully", "payment_id": payment.id, "response": response}), 200
+
+
+class Dispatcher:
+    # ASGI entry point: requests the async app has a route for go there, everything else to the sync app
+    def __init__(self, async_app, sync_app):
+        self.async_app = async_app
+        self.sync_app = AsyncioWSGIMiddleware(sync_app, sync_app.config.get("MAX_CONTENT_LENGTH") or WSGI_MAX_BODY)
+        self.routes = async_app.url_map.bind("")
+
+    def serves(self, scope):
+        if scope["type"] != "http":
+            return scope["type"] == "lifespan"
+        try:
+            self.routes.match(scope["path"], method=scope["method"])
+        except HTTPException:
+            return False
+        return True
+
+    async def __call__(self, scope, receive, send):
+        app = self.async_app if self.serves(scope) else self.sync_app
+        await app(scope, receive, send)
+
+
+def create_asgi_app(config=None):
+    sync_app = create_app(config)
+
+    app = Quart(__name__)
+    app.config.update(sync_app.config)
+    app.json = FastJSONProvider(app)
+    app.extensions["sync_app"] = sync_app
+    app.register_blueprint(aio)
+
+    @app.before_serving
+    async def start():
+        # Engines, the semaphore and the HTTP pool belong to the serving loop
+        app.extensions["async_db"] = AsyncDatabase(app.config)
+        app.extensions["daraja"] = AsyncDarajaClient()
+        # The change feed listens (or polls) through a sync engine on its own thread
+        with sync_app.app_context():
+            app.extensions["changes_engine"] = sync_db.engine
+        if app.config.get("MAX_IN_FLIGHT"):
+            app.extensions["admission"] = asyncio.Semaphore(app.config["MAX_IN_FLIGHT"])
+
+    @app.after_serving
+    async def stop():
+        await app.extensions["daraja"].aclose()
+        await app.extensions["async_db"].dispose()
+
+    dispatcher = Dispatcher(app, sync_app)
+    if app.config["PROXY_FIX_X_FOR"]:
+        # The sync app applies the same X-Forwarded-For rule through its own ProxyFix
+        return ProxyFixMiddleware(dispatcher, trusted_hops=app.config["PROXY_FIX_X_FOR"])
+    return dispatcher
+
+
+if __name__ == "__main__":
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    asyncio.run(serve(create_asgi_app(), Config()))
@@ -0,0 +1,1132 @@
+"""Seed a synthetic SokoHub dataset and benchmark the API routes.
+
+    python bench.py --database-url sqlite:////tmp/sokohub-bench.db --reset-database --scale 10000 --out before.json
+    python bench.py --database-url postgresql://localhost/sokohub_bench --skip-seed --compare before.json
+    python bench.py --serialization 50000
+    python bench.py --skip-seed --ratelimit overhead --compare before.json
+    python bench.py --skip-seed --metrics off --out bare.json
+    python bench.py --skip-seed --compare bare.json
+    python bench.py --limiter 200000
+    python bench.py --skip-seed --serving --concurrency 64 --daraja-latency 0.2
+    python bench.py --database-url postgresql://localhost/sokohub_bench --partitions 50000000
+    python bench.py --skip-seed --export 1000000
+    python bench.py --database-url postgresql://localhost/sokohub_bench --skip-seed --search 1000000
+
+The database comes from --database-url or BENCH_DATABASE_URL, never from the
+app's DATABASE_URL. Seeding drops every table first, so it only runs with
+--reset-database; --skip-seed reuses what is there. A Postgres database is
+rebuilt with the Alembic migrations, so it has the production partitions,
+triggers and search indexes; SQLite is built from the models, as in the tests.
+
+--scale is the number of orders, the other tables are sized from it. Every
+scenario runs through the Flask test client and a threaded WSGI server, and
+the report (throughput, p50/p99 latency, SQL statements per request) is JSON
+so runs from different commits can be diffed with --compare. Rate limiting is
+off unless --ratelimit overhead is given, which keeps every check running but
+with limits no benchmark reaches, so the difference is the limiter's cost.
+Request and SQL instrumentation is on as in production; a --metrics off run
+compared against a default one gives its cost.
+
+order_hot_row sends every order for the same produce, so all the workers queue
+on one stock row; it is restocked first so no order runs short. Its orders/sec
+are reported next to order_create, whose orders are spread over the catalogue.
+
+login_mix times GET /api/produce alone, then again while --login-concurrency
+more clients keep signing in to an account hashed at --login-rounds, so it
+shows whether bcrypt in the hashing pool still slows the catalogue down.
+
+--serving starts the app in its own process twice, the threaded WSGI server
+and the ASGI mode (asgi.py under uvicorn), against a fake Daraja that answers
+after --daraja-latency seconds. It reports throughput and peak RSS per mode,
+and requests/sec per MB of RSS.
+
+--partitions loads the given number of orders into a plain table and into one
+partitioned by month the way migration b5d1e8c3f970 does it, then times the
+date-range queries behind GET /api/orders and the analytics rollups on both.
+
+--export adds the given number of orders for vendor 1 and a tenth of that for
+vendor 2, then streams GET /api/orders/export for each from the WSGI server in
+its own process, sampling its RSS. A streaming export keeps the peak the same
+for both vendors, one that buffers grows with the row count.
+
+--search tops the catalogue up to the given number of listings, then times
+search_produce() for a set of queries (whole words, prefixes, a typo that only
+the trigram fallback finds, a deep page, no match) next to the ILIKE scan over
+the same fields that searching without the index amounts to.
+"""
+from datetime import datetime, timedelta
+import argparse
+import http.client
+import http.server
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import zlib
+
+CHUNK_SIZE = 10000
+CATEGORIES = ["vegetables", "fruit", "cereals", "legumes", "tubers", "dairy", "poultry", "herbs"]
+PRODUCE_NAMES = ["Sukuma wiki", "Tomatoes", "Avocado", "Maize", "Beans", "Potatoes", "Mangoes",
+                 "Cabbage", "Onions", "Kale", "Bananas", "Milk", "Eggs", "Spinach", "Carrots"]
+LOCATIONS = ["Nakuru", "Kiambu", "Meru", "Eldoret", "Kisumu", "Nyeri", "Machakos", "Embu"]
+BENCH_PASSWORD = "bench-password"
+NDJSON = "application/x-ndjson"
+HOT_PRODUCE_ID = 1
+HOT_PRODUCE_STOCK = 10 ** 9  # order_hot_row takes one at a time, far more than any run orders
+LOGIN_MIX_EMAIL = "login-mix@bench.sokohub"
+
+
+def table_sizes(scale):
+    return {
+        "farmers": max(scale // 100, 1),
+        "vendors": max(scale // 50, 1),
+        "produce": max(scale // 10, 1),
+        "orders": scale,
+        "reviews": max(scale // 5, 1),
+    }
+
+
+def insert_chunked(session, table, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            session.execute(table.insert(), chunk)
+            session.commit()
+            chunk = []
+    if chunk:
+        session.execute(table.insert(), chunk)
+        session.commit()
+
+
+def migrate(database_url):
+    # Like the tests, no alembic.ini: its logging setup would silence the app's loggers
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config()
+    config.set_main_option("script_location", os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations"))
+    config.set_main_option("sqlalchemy.url", database_url.replace("%", "%%"))
+    command.upgrade(config, "head")
+
+
+def build_schema(session, history_months=13):
+    # Postgres gets the production schema from the migrations: the partitions, the triggers
+    # behind search_vector and the payment checks, pg_trgm and the GIN indexes. create_all()
+    # knows none of those. SQLite, like the test suite, is built from the models.
+    from sqlalchemy import text
+    from models import db
+    from partitions import PARTITIONED_TABLES, add_months, create_partition, monthly_tables
+
+    engine = session.get_bind()
+    if engine.dialect.name != "postgresql":
+        db.drop_all()
+        db.create_all()
+        return
+
+    session.close()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("DROP SCHEMA public CASCADE"))
+        connection.execute(text("CREATE SCHEMA public"))
+    migrate(engine.url.render_as_string(hide_password=False))
+
+    # The migration only makes the months from now on, the seeded history would all land in the
+    # default partition and no query would be pruned the way production's are
+    this_month = datetime.utcnow().date().replace(day=1)
+    with engine.connect() as connection:
+        for table in PARTITIONED_TABLES:
+            existing = monthly_tables(connection, table)
+            for count in range(-history_months, 0):
+                month = add_months(this_month, count)
+                if month not in existing:
+                    create_partition(connection, table, month)
+        connection.commit()
+
+
+def seed(session, scale, seed_value=42):
+    from models import db, Farmer, Vendor, Produce, Order, Review
+    from geo import PLACES, encode_geohash
+    from passwords import hasher
+    from ratings import reconcile_ratings
+
+    rng = random.Random(seed_value)
+    sizes = table_sizes(scale)
+    now = datetime.utcnow()
+    # One hash shared by every account, hashing per row would dominate seeding
+    password = hasher.hash(BENCH_PASSWORD)
+
+    def when():
+        return now - timedelta(seconds=rng.randrange(365 * 24 * 3600))
+
+    build_schema(session)
+
+    def farmer_rows():
+        for i in range(1, sizes["farmers"] + 1):
+            location = rng.choice(LOCATIONS)
+            # Scatter farms up to ~30km around their town
+            town_lat, town_lng = PLACES[location.lower()]
+            lat, lng = town_lat + rng.uniform(-0.27, 0.27), town_lng + rng.uniform(-0.27, 0.27)
+            yield {
+                "id": i, "name": f"Farmer {i}", "email": f"farmer{i}@bench.sokohub", "password": password,
+                "phone": f"2547{i:08d}", "mpesa": f"2547{i:08d}", "location": location,
+                "latitude": lat, "longitude": lng, "geohash": encode_geohash(lat, lng),
+                "kephis_certified": rng.random() < 0.3, "created_at": when(),
+            }
+
+    insert_chunked(session, Farmer.__table__, farmer_rows())
+
+    insert_chunked(session, Vendor.__table__, ({
+        "id": i, "name": f"Vendor {i}", "email": f"vendor{i}@bench.sokohub", "password": password,
+        "phone": f"2541{i:08d}", "location": rng.choice(LOCATIONS), "created_at": when(),
+    } for i in range(1, sizes["vendors"] + 1)))
+
+    produce_farmers = {}
+
+    def produce_rows():
+        for i in range(1, sizes["produce"] + 1):
+            farmer_id = rng.randint(1, sizes["farmers"])
+            produce_farmers[i] = farmer_id
+            name = rng.choice(PRODUCE_NAMES)
+            yield {
+                "id": i, "name": name, "description": f"Fresh {name.lower()} from the farm",
+                "category": rng.choice(CATEGORIES), "unit_price": round(rng.uniform(10, 500), 2),
+                "quantity": rng.randint(0, 1000), "quality": rng.choice(["A", "B", "C"]),
+                "farmer_id": farmer_id, "created_at": when(),
+            }
+
+    insert_chunked(session, Produce.__table__, produce_rows())
+
+    def order_rows():
+        for i in range(1, sizes["orders"] + 1):
+            produce_id = rng.randint(1, sizes["produce"])
+            quantity = rng.randint(1, 50)
+            yield {
+                "id": i, "vendor_id": rng.randint(1, sizes["vendors"]), "farmer_id": produce_farmers[produce_id],
+                "produce_id": produce_id, "quantity": quantity, "total_price": round(quantity * rng.uniform(10, 500), 2),
+                "deposit_paid": rng.random() < 0.6, "order_status": rng.choice(["Pending", "Paid", "Delivered"]),
+                "created_at": when(),
+            }
+
+    insert_chunked(session, Order.__table__, order_rows())
+
+    insert_chunked(session, Review.__table__, ({
+        "id": i, "vendor_id": rng.randint(1, sizes["vendors"]), "farmer_id": rng.randint(1, sizes["farmers"]),
+        "rating": rng.randint(1, 5), "comment": "Bench review", "created_at": when(),
+    } for i in range(1, sizes["reviews"] + 1)))
+
+    reconcile_ratings(session)
+
+    if session.get_bind().dialect.name == "postgresql":
+        # Sequences don't move for explicit ids, line them up for the write scenarios
+        for table in ("farmers", "vendors", "produce", "orders", "reviews"):
+            session.execute(db.text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))"))
+        session.execute(db.text("ANALYZE"))
+        session.commit()
+    return sizes
+
+
+def produce_row(rng):
+    return {"name": rng.choice(PRODUCE_NAMES), "category": rng.choice(CATEGORIES), "quantity": rng.randint(10, 500),
+            "price": rng.randint(20, 300), "quality": rng.choice("ABC")}
+
+
+def scenarios(sizes, rng, cart_size=10, bulk_rows=100):
+    from geo import PLACES
+
+    # (name, method, path factory, body factory, role whose token is sent or None)
+    return [
+        ("produce_list", "GET", lambda: "/api/produce?limit=100", None, None),
+        ("produce_by_category", "GET", lambda: f"/api/produce?category={rng.choice(CATEGORIES)}&limit=100", None, None),
+        ("produce_categories", "GET", lambda: "/api/produce/categories", None, None),
+        ("produce_details", "GET", lambda: f"/api/produce/{rng.randint(1, sizes['produce'])}", None, None),
+        ("produce_search", "GET", lambda: f"/api/produce/search?q={rng.choice(PRODUCE_NAMES).split()[0].lower()}", None, None),
+        ("produce_nearby", "GET", lambda: "/api/produce/nearby?lat={:.4f}&lng={:.4f}&radius=20".format(
+            *PLACES[rng.choice(LOCATIONS).lower()]), None, None),
+        ("produce_top_rated", "GET", lambda: "/api/produce/top-rated", None, None),
+        ("farmer_rating", "GET", lambda: f"/api/farmers/{rng.randint(1, sizes['farmers'])}/rating", None, None),
+        ("orders_list", "GET", lambda: "/api/orders?limit=100", None, "vendor"),
+        ("orders_by_status", "GET", lambda: "/api/orders?status=pending&limit=100", None, "vendor"),
+        ("order_create", "POST", lambda: "/api/orders",
+         lambda: {"produce_id": rng.randint(1, sizes["produce"]), "quantity": 1}, "vendor"),
+        ("order_hot_row", "POST", lambda: "/api/orders", lambda: {"produce_id": HOT_PRODUCE_ID, "quantity": 1}, "vendor"),
+        ("order_checkout", "POST", lambda: "/api/orders/batch",
+         lambda: {"items": [{"produce_id": produce_id, "quantity": 1}
+                            for produce_id in rng.sample(range(1, sizes["produce"] + 1), min(cart_size, sizes["produce"]))]},
+         "vendor"),
+        ("produce_post", "POST", lambda: "/api/farmer/produce", lambda: produce_row(rng), "farmer"),
+        # bytes bodies go out as NDJSON
+        ("produce_bulk", "POST", lambda: "/api/farmer/produce/bulk",
+         lambda: "".join(json.dumps(produce_row(rng)) + "\n" for _ in range(bulk_rows)).encode(), "farmer"),
+        ("vendor_login", "POST", lambda: "/api/auth/login",
+         lambda: {"email": f"vendor{rng.randint(1, sizes['vendors'])}@bench.sokohub", "password": BENCH_PASSWORD}, None),
+    ]
+
+
+class StatementCounter:
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, "after_cursor_execute", self._count)
+
+    def _count(self, *args):
+        with self._lock:
+            self.count += 1
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def run_scenario(send, requests, concurrency, counter):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    per_client = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+
+    def client(n):
+        local = []
+        failed = 0
+        for _ in range(n):
+            started = time.perf_counter()
+            status = send()
+            local.append(time.perf_counter() - started)
+            if status >= 400:
+                failed += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    statements_before = counter.count
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(n,)) for n in per_client]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors[0],
+        "throughput_rps": round(requests / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "sql_per_request": round((counter.count - statements_before) / requests, 2),
+    }
+
+
+def run_with_background(send, background, requests, concurrency, background_concurrency, counter):
+    # run_scenario() for send while background_concurrency more clients call background nonstop
+    stop = threading.Event()
+    counts = [0, 0]  # background requests, failed ones
+    lock = threading.Lock()
+
+    def keep_sending():
+        sent = failed = 0
+        while not stop.is_set():
+            if background() >= 400:
+                failed += 1
+            sent += 1
+        with lock:
+            counts[0] += sent
+            counts[1] += failed
+
+    threads = [threading.Thread(target=keep_sending) for _ in range(background_concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    try:
+        result = run_scenario(send, requests, concurrency, counter)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - started
+    # Statements from the background requests are in the count too
+    result.pop("sql_per_request")
+    result.update(background_requests=counts[0], background_errors=counts[1],
+                  background_rps=round(counts[0] / elapsed, 2))
+    return result
+
+
+def test_client_sender(app, method, path, body, headers):
+    local = threading.local()
+
+    def send():
+        if not hasattr(local, "client"):
+            local.client = app.test_client()
+        payload = body() if body else None
+        if isinstance(payload, bytes):
+            response = local.client.open(path(), method=method, data=payload, content_type=NDJSON, headers=headers)
+        else:
+            response = local.client.open(path(), method=method, json=payload, headers=headers)
+        response.get_data()
+        return response.status_code
+
+    return send
+
+
+def wsgi_sender(port, method, path, body, headers):
+    def send():
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        payload = body() if body else None
+        request_headers = dict(headers)
+        if isinstance(payload, bytes):
+            request_headers["Content-Type"] = NDJSON
+        elif payload is not None:
+            payload = json.dumps(payload)
+            request_headers["Content-Type"] = "application/json"
+        connection.request(method, path(), body=payload, headers=request_headers)
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        return response.status
+
+    return send
+
+
+def start_wsgi_server(app):
+    from werkzeug.serving import make_server
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    previous = {(r["scenario"], r["mode"]): r for r in baseline["results"]}
+    lines = [f"{'scenario':<22} {'mode':<12} {'rps':>10} {'p50':>9} {'p99':>9} {'sql/req':>8}"]
+    for result in report["results"]:
+        before = previous.get((result["scenario"], result["mode"]))
+        if before is None:
+            continue
+
+        def change(key):
+            if not before[key]:
+                return "n/a"
+            return f"{(result[key] - before[key]) / before[key] * 100:+.1f}%"
+
+        lines.append(f"{result['scenario']:<22} {result['mode']:<12} {change('throughput_rps'):>10} "
+                     f"{change('p50_ms'):>9} {change('p99_ms'):>9} {change('sql_per_request'):>8}")
+    return "\n".join(lines)
+
+
+def serialization_benchmark(count, repeat=5):
+    # Old per-row dict building plus json.dumps against the compiled schema encoders
+    from collections import namedtuple
+    from decimal import Decimal
+    import schemas
+
+    Row = namedtuple("Row", "id produce_name quantity total_price deposit_paid order_status mpesa_code created_at")
+    now = datetime.utcnow()
+    rows = [Row(i, "Tomatoes", i % 50 + 1, Decimal("1234.50"), bool(i % 2), "Pending", None, now - timedelta(minutes=i))
+            for i in range(count)]
+
+    def handwritten():
+        return "[" + ",".join(json.dumps({
+            "id": o.id,
+            "produce": o.produce_name if o.produce_name else "Unknown",
+            "quantity": o.quantity,
+            "total_price": float(o.total_price),
+            "deposit_paid": o.deposit_paid,
+            "order_status": o.order_status,
+            "mpesa_code": o.mpesa_code,
+            "created_at": o.created_at.isoformat(),
+        }) for o in rows) + "]"
+
+    def schema_stdlib():
+        return json.dumps(schemas.VENDOR_ORDER.dump_all(rows), default=schemas.default, separators=(",", ":"))
+
+    def schema_fast():
+        return schemas.dumps(schemas.VENDOR_ORDER.dump_all(rows))
+
+    encoders = {"handwritten_json": handwritten, "schema_stdlib": schema_stdlib}
+    if schemas.orjson is not None:
+        encoders["schema_orjson"] = schema_fast
+
+    results = []
+    for name, encode in encoders.items():
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            encode()
+            timings.append(time.perf_counter() - started)
+        best = min(timings)
+        results.append({"encoder": name, "rows": count, "best_ms": round(best * 1000, 3),
+                        "rows_per_second": round(count / best)})
+        print(f"{name:<18} {best * 1000:9.2f}ms  {count / best:12,.0f} rows/s", file=sys.stderr)
+    return results
+
+
+def limiter_benchmark(count, threads=8, keys=1000):
+    # Raw take() throughput of the in-process bucket store, contended across threads
+    from ratelimit import MemoryBucketStore
+
+    store = MemoryBucketStore()
+    per_thread = count // threads
+
+    def worker(offset):
+        for i in range(per_thread):
+            store.take(f"ip:10.0.{offset}.{i % keys}", 20, 60)
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    total = per_thread * threads
+    print(f"memory store       {elapsed * 1000:9.2f}ms  {total / elapsed:12,.0f} takes/s  "
+          f"{elapsed / total * 1e6:.2f}us/take", file=sys.stderr)
+    return {"store": "memory", "takes": total, "threads": threads,
+            "takes_per_second": round(total / elapsed), "us_per_take": round(elapsed / total * 1e6, 3)}
+
+
+PARTITION_QUERIES = {
+    # GET /api/orders with a date range, and without one (every partition has to be looked at)
+    "vendor_month": """SELECT id, created_at FROM {table} WHERE vendor_id = :vendor
+                       AND created_at >= :start AND created_at <= :start + interval '30 days'
+                       ORDER BY created_at DESC, id DESC LIMIT 50""",
+    "vendor_latest": """SELECT id, created_at FROM {table} WHERE vendor_id = :vendor
+                        ORDER BY created_at DESC, id DESC LIMIT 50""",
+    # The analytics rollup rebuilding a day, and a week
+    "day_rollup": """SELECT farmer_id, count(*), sum(total_price) FROM {table}
+                     WHERE created_at >= :start AND created_at < :start + interval '1 day' GROUP BY farmer_id""",
+    "week_rollup": """SELECT date(created_at), count(*), sum(total_price) FROM {table}
+                      WHERE created_at >= :start AND created_at < :start + interval '7 days' GROUP BY 1""",
+}
+
+
+def partition_benchmark(database_url, rows, months=36, repeat=50, seed_value=42):
+    # Postgres only: the same orders in a plain table and in monthly partitions, with the
+    # orders indexes on both, and the date-range queries above timed against each
+    from sqlalchemy import create_engine, text
+    from partitions import add_months, partition_name
+
+    engine = create_engine(database_url)
+    if engine.dialect.name != "postgresql":
+        raise SystemExit("--partitions needs a Postgres --database-url")
+    vendors = max(rows // 5000, 1)
+    today = datetime.utcnow().date()
+    first = add_months(today.replace(day=1), -months + 1)
+    tables = {"plain": "bench_orders_plain", "partitioned": "bench_orders_partitioned"}
+
+    with engine.connect() as connection:
+        started = time.perf_counter()
+        for table in tables.values():
+            connection.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        columns = """(id bigint NOT NULL, vendor_id integer NOT NULL, farmer_id integer NOT NULL,
+                      produce_id integer NOT NULL, quantity integer NOT NULL, total_price numeric(10,2) NOT NULL,
+                      deposit_paid boolean, order_status varchar(20), reserved_until timestamp,
+                      created_at timestamp NOT NULL)"""
+        connection.execute(text(f"CREATE TABLE {tables['plain']} {columns}"))
+        connection.execute(text(f"CREATE TABLE {tables['partitioned']} {columns} PARTITION BY RANGE (created_at)"))
+        for count in range(months + 1):
+            month = add_months(first, count)
+            connection.execute(text(
+                f"CREATE TABLE {partition_name(tables['partitioned'], month)} PARTITION OF {tables['partitioned']} "
+                f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"))
+        connection.execute(text(f"CREATE TABLE {tables['partitioned']}_default PARTITION OF {tables['partitioned']} DEFAULT"))
+
+        connection.execute(text("SELECT setseed(:seed)"), {"seed": seed_value / 100})
+        connection.execute(text(f"""
+            INSERT INTO {tables['plain']}
+            SELECT i, 1 + (random() * :vendors)::int % :vendors, 1 + (random() * 500)::int, 1 + (random() * 5000)::int,
+                   1 + (random() * 49)::int, round((random() * 10000)::numeric, 2), random() < 0.6,
+                   (ARRAY['Pending', 'Paid', 'Delivered'])[1 + (random() * 2)::int], NULL,
+                   :first + random() * (:today - :first) * interval '1 day'
+            FROM generate_series(1, :rows) AS i
+        """), {"vendors": vendors, "rows": rows, "first": first, "today": today})
+        connection.execute(text(f"INSERT INTO {tables['partitioned']} SELECT * FROM {tables['plain']}"))
+        for table in tables.values():
+            connection.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY (id, created_at)"))
+            connection.execute(text(f"CREATE INDEX ON {table} (vendor_id, created_at DESC, id DESC)"))
+            connection.execute(text(f"CREATE INDEX ON {table} (vendor_id, lower(order_status), created_at DESC)"))
+            connection.execute(text(f"CREATE INDEX ON {table} (created_at) WHERE order_status = 'Pending'"))
+        connection.commit()
+        print(f"Loaded {rows:,} orders over {months} months into both tables in {time.perf_counter() - started:.0f}s",
+              file=sys.stderr)
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for table in tables.values():
+            connection.execute(text(f"VACUUM ANALYZE {table}"))
+
+    rng = random.Random(seed_value)
+    span = (today - first).days - 30
+    params = [{"vendor": rng.randint(1, vendors), "start": first + timedelta(days=rng.randrange(span))}
+              for _ in range(repeat)]
+    results = []
+    with engine.connect() as connection:
+        for query_name, query in PARTITION_QUERIES.items():
+            result = {"query": query_name, "rows": rows}
+            for kind, table in tables.items():
+                statement = text(query.format(table=table))
+                connection.execute(statement, params[0]).all()  # warm the cache and the plan
+                timings = []
+                for values in params:
+                    started = time.perf_counter()
+                    connection.execute(statement, values).all()
+                    timings.append(time.perf_counter() - started)
+                timings.sort()
+                result[kind] = {"p50_ms": round(percentile(timings, 0.5) * 1000, 3),
+                                "p95_ms": round(percentile(timings, 0.95) * 1000, 3)}
+            result["p50_speedup"] = round(result["plain"]["p50_ms"] / max(result["partitioned"]["p50_ms"], 1e-6), 2)
+            print(f"{query_name:<14} plain {result['plain']['p50_ms']:9.2f}ms  "
+                  f"partitioned {result['partitioned']['p50_ms']:9.2f}ms  x{result['p50_speedup']}", file=sys.stderr)
+            results.append(result)
+        for table in tables.values():
+            connection.execute(text(f"DROP TABLE {table}"))
+        connection.commit()
+    return results
+
+
+class FakeDarajaHandler(http.server.BaseHTTPRequestHandler):
+    latency = 0.2
+
+    def do_GET(self):
+        self.answer({"access_token": "bench-token", "expires_in": "3599"})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.answer({"MerchantRequestID": f"bench-{random.getrandbits(48):x}", "CheckoutRequestID": "bench",
+                     "ResponseCode": "0", "ResponseDescription": "Success. Request accepted for processing"})
+
+    def answer(self, body):
+        time.sleep(self.latency)
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_fake_daraja(latency):
+    FakeDarajaHandler.latency = latency
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeDarajaHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def serve(mode, port, database_url):
+    # Child process for --serving, limiter and admission off so only the serving stack differs
+    config = {"SQLALCHEMY_DATABASE_URI": database_url, "RATELIMIT_ENABLED": False, "MAX_IN_FLIGHT": 0}
+    logging.getLogger("sokohub.metrics").setLevel(logging.ERROR)
+    if mode == "asgi":
+        import uvicorn
+        from asgi import create_asgi_app
+        uvicorn.run(create_asgi_app(config), host="127.0.0.1", port=port, log_level="warning")
+    else:
+        from werkzeug.serving import make_server
+        from app import create_app
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        make_server("127.0.0.1", port, create_app(config), threaded=True).serve_forever()
+
+
+def rss_mb(pid, field="VmRSS"):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            http.client.HTTPConnection("127.0.0.1", port, timeout=1).connect()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+def serving_benchmark(args, sizes, token):
+    import socket
+    from types import SimpleNamespace
+
+    daraja = start_fake_daraja(args.daraja_latency)
+    headers = {"Authorization": f"Bearer {token}"}
+    rng = random.Random(7)
+    checks = [
+        ("produce_list", "GET", lambda: "/api/produce?limit=100", None, {}),
+        ("orders_list", "GET", lambda: "/api/orders?limit=100", None, headers),
+        ("mpesa_payment", "POST", lambda: "/api/payment/mpesa",
+         lambda: {"farmer_id": rng.randint(1, sizes["farmers"]), "amount": 100}, headers),
+    ]
+    if args.only:
+        checks = [check for check in checks if check[0] in args.only.split(",")]
+
+    results = []
+    for mode in ("wsgi", "asgi"):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        env = dict(os.environ, DARAJA_BASE_URL=f"http://127.0.0.1:{daraja.server_port}")
+        child = subprocess.Popen([sys.executable, "-W", "ignore", __file__, "--serve", mode, "--port", str(port),
+                                  "--database-url", args.database_url], env=env)
+        try:
+            wait_for_port(port)
+            idle = rss_mb(child.pid)
+            for name, method, path, body, request_headers in checks:
+                send = wsgi_sender(port, method, path, body, request_headers)
+                result = run_scenario(send, args.requests, args.concurrency, SimpleNamespace(count=0))
+                result.pop("sql_per_request")
+                peak = rss_mb(child.pid, "VmHWM")
+                result.update(scenario=name, mode=mode, idle_rss_mb=round(idle, 1), peak_rss_mb=round(peak, 1),
+                              rps_per_mb=round(result["throughput_rps"] / peak, 2))
+                results.append(result)
+                print(f"{name:<16} {mode:<5} {result['throughput_rps']:>9.1f} rps  p50 {result['p50_ms']:>8.2f}ms  "
+                      f"p99 {result['p99_ms']:>8.2f}ms  peak {peak:7.1f}MB  {result['rps_per_mb']:>7.2f} rps/MB  "
+                      f"{result['errors']} errors", file=sys.stderr)
+        finally:
+            child.terminate()
+            child.wait()
+    daraja.shutdown()
+    return results
+
+
+SEARCH_QUERIES = [
+    # (name, q, offset)
+    ("word", "tomatoes", 0),
+    ("prefix", "tom", 0),
+    ("two_words", "sukuma wiki", 0),
+    ("location", "nakuru", 0),
+    ("typo", "avocdo", 0),
+    ("deep_page", "maize", 200),
+    ("no_match", "xylophone", 0),
+]
+
+
+def search_benchmark(session, listings, sizes, repeat=20, limit=20):
+    from sqlalchemy import or_, select
+    from models import db, Farmer, Produce
+    from search import RESULT_COLUMNS, search_produce, tokenize
+
+    rng = random.Random(13)
+    first_id = (session.query(db.func.max(Produce.id)).scalar() or 0) + 1
+    now = datetime.utcnow()
+
+    def produce_rows():
+        for i in range(first_id, listings + 1):
+            name = rng.choice(PRODUCE_NAMES)
+            yield {
+                "id": i, "name": name, "description": f"Fresh {name.lower()} from the farm",
+                "category": rng.choice(CATEGORIES), "unit_price": round(rng.uniform(10, 500), 2),
+                "quantity": rng.randint(0, 1000), "quality": rng.choice(["A", "B", "C"]),
+                "farmer_id": rng.randint(1, sizes["farmers"]),
+                "created_at": now - timedelta(seconds=rng.randrange(365 * 24 * 3600)),
+            }
+
+    started = time.perf_counter()
+    insert_chunked(session, Produce.__table__, produce_rows())
+    if session.get_bind().dialect.name == "postgresql":
+        session.execute(db.text("SELECT setval(pg_get_serial_sequence('produce', 'id'), (SELECT max(id) FROM produce))"))
+        session.execute(db.text("ANALYZE produce"))
+        session.commit()
+    print(f"Catalogue at {max(listings, first_id - 1):,} listings after {time.perf_counter() - started:.0f}s",
+          file=sys.stderr)
+
+    def scan(q, offset):
+        # Every word somewhere in the searchable fields, the way a search without the index would
+        words = [or_(*(column.ilike(f"%{word}%")
+                       for column in (Produce.name, Produce.description, Produce.category, Farmer.location)))
+                 for word in tokenize(q)]
+        return session.execute(
+            select(*RESULT_COLUMNS).join(Farmer, Produce.farmer_id == Farmer.id).where(*words)
+            .order_by(Produce.id.desc()).limit(limit).offset(offset)
+        ).all()
+
+    def timed(run):
+        run()  # warm up, which on SQLite also builds the in-memory index
+        latencies = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            rows = run()
+            latencies.append((time.perf_counter() - started) * 1000)
+        latencies.sort()
+        return {"rows": len(rows), "p50_ms": round(percentile(latencies, 0.5), 2),
+                "p99_ms": round(percentile(latencies, 0.99), 2)}
+
+    results = []
+    for name, q, offset in SEARCH_QUERIES:
+        indexed = timed(lambda: search_produce(session, q, limit, offset))
+        scanned = timed(lambda: scan(q, offset))
+        session.rollback()
+        results.append({"query": name, "q": q, "offset": offset, "search": indexed, "ilike_scan": scanned})
+        print(f"search {name:<10} {q!r:<14} p50 {indexed['p50_ms']:>8.2f}ms p99 {indexed['p99_ms']:>8.2f}ms "
+              f"({indexed['rows']} rows)  scan p50 {scanned['p50_ms']:>8.2f}ms p99 {scanned['p99_ms']:>8.2f}ms "
+              f"({scanned['rows']} rows)", file=sys.stderr)
+    return results
+
+
+def export_benchmark(args, session, sizes, sample_interval=0.05):
+    import socket
+    from flask_jwt_extended import create_access_token
+    from models import db, Order
+
+    if sizes["vendors"] < 2:
+        raise SystemExit("--export needs at least two vendors, seed a larger --scale")
+    rng = random.Random(11)
+    now = datetime.utcnow()
+    first_id = (session.query(db.func.max(Order.id)).scalar() or 0) + 1
+    counts = {1: args.export, 2: max(args.export // 10, 1)}
+
+    def order_rows():
+        next_id = first_id
+        for vendor_id, count in counts.items():
+            for _ in range(count):
+                quantity = rng.randint(1, 50)
+                yield {
+                    "id": next_id, "vendor_id": vendor_id, "farmer_id": 1, "produce_id": rng.randint(1, sizes["produce"]),
+                    "quantity": quantity, "total_price": round(quantity * rng.uniform(10, 500), 2),
+                    "deposit_paid": rng.random() < 0.6, "order_status": rng.choice(["Pending", "Paid", "Delivered"]),
+                    "created_at": now - timedelta(seconds=rng.randrange(365 * 24 * 3600)),
+                }
+                next_id += 1
+
+    started = time.perf_counter()
+    insert_chunked(session, Order.__table__, order_rows())
+    if session.get_bind().dialect.name == "postgresql":
+        session.execute(db.text("SELECT setval(pg_get_serial_sequence('orders', 'id'), (SELECT max(id) FROM orders))"))
+        session.execute(db.text("ANALYZE orders"))
+        session.commit()
+    print(f"Added {sum(counts.values()):,} orders in {time.perf_counter() - started:.0f}s", file=sys.stderr)
+    tokens = {vendor_id: create_access_token(identity=str(vendor_id)) for vendor_id in counts}
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    child = subprocess.Popen([sys.executable, "-W", "ignore", __file__, "--serve", "wsgi", "--port", str(port),
+                              "--database-url", args.database_url])
+    results = []
+    try:
+        wait_for_port(port)
+        idle = rss_mb(child.pid)
+        # Smallest export first, so a peak that grows with the rows shows up against it
+        for vendor_id in sorted(counts, key=counts.get):
+            for export_format, encoding in (("csv", "identity"), ("ndjson", "gzip")):
+                peak = [rss_mb(child.pid)]
+                done = threading.Event()
+
+                def sample():
+                    while not done.wait(sample_interval):
+                        peak[0] = max(peak[0], rss_mb(child.pid))
+
+                sampler = threading.Thread(target=sample, daemon=True)
+                sampler.start()
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+                started = time.perf_counter()
+                connection.request("GET", f"/api/orders/export?format={export_format}", headers={
+                    "Authorization": f"Bearer {tokens[vendor_id]}", "Accept-Encoding": encoding})
+                response = connection.getresponse()
+                size = lines = 0
+                decompress = zlib.decompressobj(31) if encoding == "gzip" else None
+                while True:
+                    chunk = response.read(1 << 16)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    lines += (decompress.decompress(chunk) if decompress else chunk).count(b"\n")
+                seconds = time.perf_counter() - started
+                connection.close()
+                done.set()
+                sampler.join()
+                rows = lines - (export_format == "csv")
+                result = {"vendor_id": vendor_id, "format": export_format, "encoding": encoding,
+                          "status": response.status, "rows": rows, "bytes": size, "seconds": round(seconds, 2),
+                          "rows_per_second": round(rows / seconds), "idle_rss_mb": round(idle, 1),
+                          "peak_rss_mb": round(peak[0], 1)}
+                results.append(result)
+                print(f"export vendor {vendor_id} {export_format:<6} {encoding:<8} {rows:>10,} rows "
+                      f"{size / 1e6:9.1f}MB in {seconds:6.1f}s  peak {peak[0]:7.1f}MB", file=sys.stderr)
+    finally:
+        child.terminate()
+        child.wait()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Seed synthetic data and benchmark the SokoHub API.")
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL", "sqlite:////tmp/sokohub-bench.db"))
+    parser.add_argument("--replica-url", default=os.getenv("BENCH_DATABASE_REPLICA_URL"),
+                        help="Replica for the read routes, it must already hold a copy of the seeded data.")
+    parser.add_argument("--scale", type=int, default=10000, help="Number of orders to seed.")
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse the data already in the database.")
+    parser.add_argument("--reset-database", action="store_true",
+                        help="Allow seeding, which drops every table in --database-url first.")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario and mode.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--modes", default="test_client,wsgi")
+    parser.add_argument("--only", help="Comma separated scenario names.")
+    parser.add_argument("--out", help="Write the JSON report here as well as to stdout.")
+    parser.add_argument("--compare", help="Earlier JSON report to print relative changes against.")
+    parser.add_argument("--serialization", type=int, metavar="ROWS",
+                        help="Only time the JSON encoders over this many synthetic order rows.")
+    parser.add_argument("--cart-size", type=int, default=10,
+                        help="Lines per order_checkout cart, compared against that many order_create calls.")
+    parser.add_argument("--bulk-rows", type=int, default=100,
+                        help="Rows per produce_bulk upload, compared against that many produce_post calls.")
+    parser.add_argument("--login-rounds", type=int, default=12, help="bcrypt cost of the login_mix account.")
+    parser.add_argument("--login-concurrency", type=int, default=8,
+                        help="Clients signing in throughout login_mix, on top of --concurrency catalogue readers.")
+    parser.add_argument("--limiter", type=int, metavar="TAKES",
+                        help="Only time this many token bucket takes against the in-process store.")
+    parser.add_argument("--ratelimit", choices=("off", "overhead"), default="off",
+                        help="overhead runs every rate limit check with limits set out of reach.")
+    parser.add_argument("--metrics", choices=("on", "off"), default="on",
+                        help="off runs without the request and SQL instrumentation, to compare against.")
+    parser.add_argument("--serving", action="store_true",
+                        help="Compare the threaded WSGI server with the ASGI mode, each in its own process.")
+    parser.add_argument("--daraja-latency", type=float, default=0.2, help="Seconds the fake Daraja takes to answer.")
+    parser.add_argument("--partitions", type=int, metavar="ROWS",
+                        help="Only compare date-range queries on a plain and a month-partitioned copy of this "
+                             "many orders (Postgres).")
+    parser.add_argument("--partition-months", type=int, default=36, help="Months of history for --partitions.")
+    parser.add_argument("--export", type=int, metavar="ROWS",
+                        help="Add this many orders for one vendor and stream its export, reporting peak RSS.")
+    parser.add_argument("--search", type=int, metavar="LISTINGS",
+                        help="Top the catalogue up to this many listings and time the search queries.")
+    parser.add_argument("--search-repeat", type=int, default=20, help="Runs of each query for --search.")
+    parser.add_argument("--serve", choices=("wsgi", "asgi"), help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.serve, args.port, args.database_url)
+        return
+
+    if args.serialization:
+        print(json.dumps({"commit": git_commit(), "serialization": serialization_benchmark(args.serialization)}, indent=2))
+        return
+    if args.limiter:
+        print(json.dumps({"commit": git_commit(), "limiter": limiter_benchmark(args.limiter)}, indent=2))
+        return
+    if args.partitions:
+        report = {"commit": git_commit(), "months": args.partition_months,
+                  "partitions": partition_benchmark(args.database_url, args.partitions, args.partition_months)}
+        print(json.dumps(report, indent=2))
+        return
+
+    from app import create_app
+    from ratelimit import DEFAULT_LIMITS, ROUTE_LIMITS, Limit
+    unlimited = Limit(1e9, 1e9)
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": args.database_url,
+        "DATABASE_REPLICA_URL": args.replica_url,
+        "REPLICA_SINGLE_PROCESS": True,  # every request is served in this process
+        "BCRYPT_LOG_ROUNDS": 4,
+        "RATELIMIT_ENABLED": args.ratelimit == "overhead",
+        "METRICS_ENABLED": args.metrics == "on",
+        "RATE_LIMITS": {name: unlimited for name in DEFAULT_LIMITS},
+        "ROUTE_LIMITS": {name: unlimited for name in ROUTE_LIMITS},
+    })
+    from models import db
+
+    with app.app_context():
+        if args.skip_seed:
+            from models import Farmer, Produce, Vendor
+            sizes = {
+                "farmers": db.session.query(db.func.max(Farmer.id)).scalar() or 1,
+                "vendors": db.session.query(db.func.max(Vendor.id)).scalar() or 1,
+                "produce": db.session.query(db.func.max(Produce.id)).scalar() or 1,
+            }
+        else:
+            if not args.reset_database:
+                raise SystemExit(f"Seeding drops every table in {db.engine.url!r}, pass --reset-database "
+                                 "to go ahead or --skip-seed to reuse its data")
+            started = time.perf_counter()
+            sizes = seed(db.session, args.scale)
+            print(f"Seeded {sizes} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        # Signed in the way clients are, so the tokens are exactly what login issues
+        login = app.test_client().post("/api/auth/login", json={"email": "vendor1@bench.sokohub",
+                                                                "password": BENCH_PASSWORD})
+        token = login.get_json()["access_token"]
+        farmer_login = app.test_client().post("/api/farmer/login", json={"email": "farmer1@bench.sokohub",
+                                                                         "password": BENCH_PASSWORD})
+        auth = {"vendor": {"Authorization": f"Bearer {token}"},
+                "farmer": {"Authorization": f"Bearer {farmer_login.get_json()['access_token']}"}}
+        counter = StatementCounter(db.engine)
+
+    if args.export:
+        with app.app_context():
+            report = {"commit": git_commit(), "database": args.database_url.split("://", 1)[0],
+                      "export": export_benchmark(args, db.session, sizes)}
+        print(json.dumps(report, indent=2))
+        return
+
+    if args.search:
+        with app.app_context():
+            report = {"commit": git_commit(), "database": args.database_url.split("://", 1)[0],
+                      "listings": args.search,
+                      "search": search_benchmark(db.session, args.search, sizes, args.search_repeat)}
+        output = json.dumps(report, indent=2)
+        print(output)
+        if args.out:
+            with open(args.out, "w") as f:
+                f.write(output + "\n")
+        return
+
+    if args.serving:
+        report = {"commit": git_commit(), "database": args.database_url.split("://", 1)[0],
+                  "concurrency": args.concurrency, "daraja_latency": args.daraja_latency,
+                  "serving": serving_benchmark(args, sizes, token)}
+        output = json.dumps(report, indent=2)
+        print(output)
+        if args.out:
+            with open(args.out, "w") as f:
+                f.write(output + "\n")
+        return
+
+    rng = random.Random(7)
+    wanted = set(args.only.split(",")) if args.only else None
+    modes = args.modes.split(",")
+    server = start_wsgi_server(app) if "wsgi" in modes else None
+    if not wanted or "order_hot_row" in wanted:
+        with app.app_context():
+            from models import Produce
+            db.session.execute(db.update(Produce).where(Produce.id == HOT_PRODUCE_ID).values(quantity=HOT_PRODUCE_STOCK))
+            db.session.commit()
+
+    if not wanted or "login_mix" in wanted:
+        from models import Vendor
+        from passwords import _hash
+        # Hashed at the production cost, the seeded accounts use the cheapest one to seed quickly
+        password = _hash(BENCH_PASSWORD.encode(), args.login_rounds)
+        with app.app_context():
+            vendor = Vendor.query.filter_by(email=LOGIN_MIX_EMAIL).first()
+            if vendor is None:
+                db.session.add(Vendor(name="Login mix", email=LOGIN_MIX_EMAIL, password=password, phone="254100000000"))
+            else:
+                vendor.password = password
+            db.session.commit()
+
+    def sender(mode, method, path, body, headers):
+        if mode == "wsgi":
+            return wsgi_sender(server.server_port, method, path, body, headers)
+        return test_client_sender(app, method, path, body, headers)
+
+    results = []
+    for name, method, path, body, role in scenarios(sizes, rng, args.cart_size, args.bulk_rows):
+        if wanted and name not in wanted:
+            continue
+        headers = auth[role] if role else {}
+        for mode in modes:
+            send = sender(mode, method, path, body, headers)
+            result = run_scenario(send, args.requests, args.concurrency, counter)
+            results.append({"scenario": name, "mode": mode, **result})
+            print(f"{name:<22} {mode:<12} {result['throughput_rps']:>9.1f} rps  "
+                  f"p50 {result['p50_ms']:>8.2f}ms  p99 {result['p99_ms']:>8.2f}ms  "
+                  f"{result['sql_per_request']:>5} sql/req  {result['errors']} errors", file=sys.stderr)
+
+    # Catalogue latency on its own and while logins keep the hashing pool busy
+    login_mix = []
+    if not wanted or "login_mix" in wanted:
+        for mode in modes:
+            catalogue = sender(mode, "GET", lambda: "/api/produce?limit=100", None, {})
+            login = sender(mode, "POST", lambda: "/api/auth/login", lambda: {"email": LOGIN_MIX_EMAIL,
+                                                                              "password": BENCH_PASSWORD}, {})
+            alone = run_scenario(catalogue, args.requests, args.concurrency, counter)
+            alone.pop("sql_per_request")
+            mixed = run_with_background(catalogue, login, args.requests, args.concurrency,
+                                        args.login_concurrency, counter)
+            login_mix.append({"mode": mode, "login_rounds": args.login_rounds,
+                              "login_concurrency": args.login_concurrency,
+                              "catalogue_alone": alone, "catalogue_with_logins": mixed})
+            print(f"login mix {mode:<11} catalogue p50 {alone['p50_ms']:>8.2f}ms p99 {alone['p99_ms']:>8.2f}ms alone, "
+                  f"p50 {mixed['p50_ms']:>8.2f}ms p99 {mixed['p99_ms']:>8.2f}ms with {mixed['background_rps']:.1f} "
+                  f"logins/s ({mixed['background_errors']} failed)", file=sys.stderr)
+
+    if server is not None:
+        server.shutdown()
+
+    # Orders per second when every worker wants the same row, against orders spread over the catalogue
+    hot_row = []
+    for mode in modes:
+        spread = next((r for r in results if r["scenario"] == "order_create" and r["mode"] == mode), None)
+        hot = next((r for r in results if r["scenario"] == "order_hot_row" and r["mode"] == mode), None)
+        if hot:
+            hot_row.append({"mode": mode, "concurrency": args.concurrency, "produce_id": HOT_PRODUCE_ID,
+                            "hot_orders_per_second": hot["throughput_rps"],
+                            "spread_orders_per_second": spread["throughput_rps"] if spread else None})
+            print(f"hot row  {mode:<12} {hot['throughput_rps']:9.1f} orders/s on produce {HOT_PRODUCE_ID}"
+                  + (f" vs {spread['throughput_rps']:9.1f} spread over the catalogue" if spread else ""),
+                  file=sys.stderr)
+
+    # Lines ordered per second through one cart POST against one POST per line
+    checkout = []
+    for mode in modes:
+        single = next((r for r in results if r["scenario"] == "order_create" and r["mode"] == mode), None)
+        cart = next((r for r in results if r["scenario"] == "order_checkout" and r["mode"] == mode), None)
+        if single and cart:
+            lines_per_second = cart["throughput_rps"] * args.cart_size
+            checkout.append({"mode": mode, "cart_size": args.cart_size,
+                             "single_lines_per_second": single["throughput_rps"],
+                             "cart_lines_per_second": round(lines_per_second, 2),
+                             "speedup": round(lines_per_second / single["throughput_rps"], 2)})
+            print(f"checkout {mode:<12} {args.cart_size} line cart {lines_per_second:9.1f} lines/s vs "
+                  f"{single['throughput_rps']:9.1f} single orders/s", file=sys.stderr)
+
+    # Listings posted per second through one bulk upload against one POST per listing
+    bulk = []
+    for mode in modes:
+        single = next((r for r in results if r["scenario"] == "produce_post" and r["mode"] == mode), None)
+        upload = next((r for r in results if r["scenario"] == "produce_bulk" and r["mode"] == mode), None)
+        if single and upload:
+            rows_per_second = upload["throughput_rps"] * args.bulk_rows
+            bulk.append({"mode": mode, "bulk_rows": args.bulk_rows,
+                         "single_rows_per_second": single["throughput_rps"],
+                         "bulk_rows_per_second": round(rows_per_second, 2),
+                         "speedup": round(rows_per_second / single["throughput_rps"], 2)})
+            print(f"produce  {mode:<12} {args.bulk_rows} row upload {rows_per_second:9.1f} rows/s vs "
+                  f"{single['throughput_rps']:9.1f} single posts/s", file=sys.stderr)
+
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.utcnow().isoformat(),
+        "database": args.database_url.split("://", 1)[0],
+        "scale": args.scale,
+        "ratelimit": args.ratelimit,
+        "metrics": args.metrics,
+        "results": results,
+        "hot_row": hot_row,
+        "login_mix": login_mix,
+        "checkout": checkout,
+        "bulk": bulk,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(report, json.load(f)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
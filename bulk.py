@@ -0,0 +1,180 @@
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+import csv
+import io
+import json
+
+from sqlalchemy import insert
+
+from cache import PRODUCE_CATALOGUE, cache
+from models import Produce
+from search import SEARCH_NAMESPACE
+
+BULK_CHUNK_SIZE = 1000
+BULK_MAX_ROWS = 10000
+DESCRIPTION_MAX_LENGTH = 5000
+# Largest Numeric(10,2) takes
+PRICE_MAX = Decimal("99999999.99")
+# Largest Integer takes
+QUANTITY_MAX = 2147483647
+
+produce = Produce.__table__
+
+
+class BulkFormatError(ValueError):
+    pass
+
+
+def detect_format(content_type, requested=None):
+    fmt = (requested or "").lower()
+    if not fmt:
+        content_type = (content_type or "").lower()
+        if "csv" in content_type:
+            fmt = "csv"
+        elif "ndjson" in content_type or "jsonl" in content_type:
+            fmt = "ndjson"
+    if fmt not in ("csv", "ndjson"):
+        raise BulkFormatError("Send text/csv or application/x-ndjson")
+    return fmt
+
+
+def iter_rows(stream, fmt):
+    # Read the body line by line so a large upload never sits in memory whole
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    if fmt == "csv":
+        for line_no, row in enumerate(csv.DictReader(text), start=1):
+            yield line_no, row
+        return
+
+    for line_no, line in enumerate(text, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_no, None
+            continue
+        yield line_no, row if isinstance(row, dict) else None
+
+
+def whole_number(value):
+    # int() would turn 1.5 into 1 and JSON true into 1, both are errors here
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lstrip("+-").isdigit():
+        return int(value)
+    raise ValueError(f"{value!r} is not a whole number")
+
+
+def optional_text(raw, field, max_length, errors):
+    # Rejected rather than cut short, and never anything but a string so Postgres doesn't fail the chunk
+    value = raw.get(field)
+    if value in (None, ""):
+        return None
+    if not isinstance(value, str):
+        errors.append(f"{field} must be text")
+    elif len(value) > max_length:
+        errors.append(f"{field} can't be longer than {max_length} characters")
+    return value
+
+
+def validate_produce_row(raw, farmer_id, created_at):
+    if raw is None:
+        return None, ["Row is not a valid object"]
+
+    errors = []
+    for field in ("name", "quantity", "price", "quality"):
+        if raw.get(field) in (None, ""):
+            errors.append(f"Missing {field}")
+    if errors:
+        return None, errors
+
+    try:
+        quantity = whole_number(raw["quantity"])
+        if quantity < 0:
+            errors.append("quantity can't be negative")
+        elif quantity > QUANTITY_MAX:
+            errors.append(f"quantity can't be more than {QUANTITY_MAX}")
+    except ValueError:
+        errors.append("quantity must be a whole number")
+
+    try:
+        unit_price = Decimal(str(raw["price"]))
+        if not unit_price.is_finite():
+            errors.append("price must be a number")
+        elif unit_price < 0:
+            errors.append("price can't be negative")
+        elif unit_price > PRICE_MAX:
+            errors.append(f"price can't be more than {PRICE_MAX}")
+    except InvalidOperation:
+        errors.append("price must be a number")
+
+    # name and quality are known to be there, they get the same checks as the optional text
+    name = optional_text(raw, "name", produce.c.name.type.length, errors)
+    quality = optional_text(raw, "quality", produce.c.quality.type.length, errors)
+    description = optional_text(raw, "description", DESCRIPTION_MAX_LENGTH, errors)
+    category = optional_text(raw, "category", produce.c.category.type.length, errors)
+    if errors:
+        return None, errors
+
+    return {
+        "name": name,
+        "description": description,
+        "category": category,
+        "unit_price": unit_price,
+        "quantity": quantity,
+        "quality": quality,
+        "farmer_id": farmer_id,
+        "created_at": created_at,
+    }, []
+
+
+def insert_produce_chunk(session, rows):
+    # Executemany with RETURNING, batched into multi-row INSERTs by the dialect
+    ids = session.execute(
+        insert(produce).returning(produce.c.id, sort_by_parameter_order=True),
+        rows
+    ).scalars().all()
+    cache.invalidate_after_commit(session, "produce")
+    cache.invalidate_after_commit(session, PRODUCE_CATALOGUE)
+    cache.invalidate_after_commit(session, SEARCH_NAMESPACE)
+    session.commit()
+    return ids
+
+
+def bulk_insert_produce(session, stream, fmt, farmer_id, chunk_size=BULK_CHUNK_SIZE, max_rows=BULK_MAX_ROWS):
+    results = []
+    pending = []  # (result, row) waiting for the next chunk insert
+    created_at = datetime.utcnow()
+
+    def flush():
+        ids = insert_produce_chunk(session, [row for _, row in pending])
+        for (result, _), produce_id in zip(pending, ids):
+            result["id"] = produce_id
+        pending.clear()
+
+    line_no = 0
+    try:
+        for count, (line_no, raw) in enumerate(iter_rows(stream, fmt), start=1):
+            if count > max_rows:
+                results.append({"row": line_no, "errors": [f"Uploads are limited to {max_rows} rows"]})
+                break
+
+            row, errors = validate_produce_row(raw, farmer_id, created_at)
+            result = {"row": line_no}
+            results.append(result)
+            if errors:
+                result["errors"] = errors
+                continue
+
+            pending.append((result, row))
+            if len(pending) >= chunk_size:
+                flush()
+    except UnicodeDecodeError:
+        # The body is decoded a block at a time, so nothing past the last good row can be trusted
+        results.append({"row": line_no + 1, "errors": ["Upload is not valid UTF-8, stopped here"]})
+
+    if pending:
+        flush()
+    return results
@@ -0,0 +1,255 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+# A namespace nobody touched for a day starts a fresh version, which keeps
+# per-id namespaces from piling up. Versions are timestamps so they still only grow.
+VERSION_TTL = 86400
+
+
+class MemoryBackend:
+    # Per-process LRU with a TTL on every entry, ttl=None keeps an entry until evicted.
+    # max_entries=None never evicts, expired entries are swept out as the store grows instead.
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._swept_size = 1024
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=-1):
+        ttl = self.ttl if ttl == -1 else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            self._trim()
+
+    def incr(self, key, ttl):
+        # Counts up from 1 with the TTL set on the first increment, like Redis INCR + EXPIRE NX
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry[1] is not None and entry[1] <= now):
+                entry = (0, now + ttl)
+            value = entry[0] + 1
+            self._entries[key] = (value, entry[1])
+            self._entries.move_to_end(key)
+            self._trim()
+            return value
+
+    def _trim(self):
+        if self.max_entries is not None:
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        elif len(self._entries) > self._swept_size * 2:
+            # Only once the store has doubled, so the sweep costs O(1) per write on average
+            now = time.monotonic()
+            for key in [key for key, (_, expires_at) in self._entries.items()
+                        if expires_at is not None and expires_at <= now]:
+                del self._entries[key]
+            self._swept_size = max(len(self._entries), 1024)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisBackend:
+    # Works with redis.Redis or anything exposing get/set(ex=)/delete/pipeline, e.g. a local fake
+    def __init__(self, client, prefix="sokohub:", ttl=300):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        return json.loads(raw)
+
+    def set(self, key, value, ttl=-1):
+        ttl = self.ttl if ttl == -1 else ttl
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl)
+
+    def incr(self, key, ttl):
+        # One round trip, and the window starts at the first increment instead of sliding
+        pipe = self.client.pipeline()
+        pipe.incr(self.prefix + key)
+        pipe.expire(self.prefix + key, ttl, nx=True)
+        return pipe.execute()[0]
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+
+class Cache:
+    # Entries live under a namespace version, bumping the version orphans every
+    # entry in the namespace at once. The version is a millisecond timestamp so
+    # it doubles as the Last-Modified time of whatever was cached under it.
+    #
+    # state holds what must not be evicted to make room for cached pages: failed login
+    # counts and recent-write markers. Its entries only leave when their TTL runs out.
+    def __init__(self, backend=None, state=None):
+        self.backend = backend or MemoryBackend()
+        self.state = state or MemoryBackend(max_entries=None, ttl=None)
+        self._listening = False
+
+    def init_app(self, app):
+        ttl = app.config.get("CACHE_TTL", 300)
+        redis_url = app.config.get("CACHE_REDIS_URL")
+        if redis_url:
+            import redis
+            client = redis.Redis.from_url(redis_url)
+            self.backend = RedisBackend(client, ttl=ttl)
+            # Outside the cache's prefix, so clearing the cache leaves it alone
+            self.state = RedisBackend(client, prefix="sokohub-state:", ttl=None)
+        else:
+            self.backend = MemoryBackend(app.config.get("CACHE_MAX_ENTRIES", 1024), ttl=ttl)
+            self.state = MemoryBackend(max_entries=None, ttl=None)
+        app.extensions["cache"] = self
+
+    def version(self, namespace):
+        version = self.backend.get(f"{namespace}:version")
+        if version is None:
+            version = self.bump(namespace)
+        return version
+
+    def current_version(self, namespace):
+        # None when the namespace has no version yet, instead of starting one
+        return self.backend.get(f"{namespace}:version")
+
+    def bump(self, namespace):
+        current = self.backend.get(f"{namespace}:version") or 0
+        version = max(int(time.time() * 1000), current + 1)
+        self.backend.set(f"{namespace}:version", version, ttl=VERSION_TTL)
+        return version
+
+    def cached(self, namespace, key, loader):
+        # Read the version before loading so a concurrent bump can only orphan
+        # what we store, never leave stale data under the new version
+        version = self.version(namespace)
+        full_key = f"{namespace}:{version}:{key}"
+        value = self.backend.get(full_key)
+        if value is None:
+            value = loader()
+            self.backend.set(full_key, value)
+        return value, version
+
+    def cached_many(self, namespaces, key, loader, versions=None):
+        # cached() over several namespaces, loader gets the misses and returns {namespace: value}.
+        # Pass versions read earlier, e.g. for validators, to skip reading them again.
+        versions = versions or {namespace: self.version(namespace) for namespace in namespaces}
+        values = {}
+        missing = []
+        for namespace, version in versions.items():
+            value = self.backend.get(f"{namespace}:{version}:{key}")
+            if value is None:
+                missing.append(namespace)
+            else:
+                values[namespace] = value
+        if missing:
+            for namespace, value in loader(missing).items():
+                self.backend.set(f"{namespace}:{versions[namespace]}:{key}", value)
+                values[namespace] = value
+        return values, versions
+
+    # Async twins of cached() and cached_many() for the ASGI app, loader is a coroutine function.
+    # Backend calls stay blocking, each is in-process or one Redis round trip.
+    async def cached_async(self, namespace, key, loader):
+        version = self.version(namespace)
+        full_key = f"{namespace}:{version}:{key}"
+        value = self.backend.get(full_key)
+        if value is None:
+            value = await loader()
+            self.backend.set(full_key, value)
+        return value, version
+
+    async def cached_many_async(self, namespaces, key, loader, versions=None):
+        versions = versions or {namespace: self.version(namespace) for namespace in namespaces}
+        values = {}
+        missing = []
+        for namespace, version in versions.items():
+            value = self.backend.get(f"{namespace}:{version}:{key}")
+            if value is None:
+                missing.append(namespace)
+            else:
+                values[namespace] = value
+        if missing:
+            for namespace, value in (await loader(missing)).items():
+                self.backend.set(f"{namespace}:{versions[namespace]}:{key}", value)
+                values[namespace] = value
+        return values, versions
+
+    def invalidate_on_change(self, model, namespace):
+        # Flag the namespace while the session flushes, bump it once the commit lands.
+        # namespace can be a function of (target, connection) returning several.
+        def mark(mapper, connection, target):
+            session = object_session(target)
+            if session is None:
+                return
+            if callable(namespace):
+                for name in namespace(target, connection):
+                    self.invalidate_after_commit(session, name)
+            else:
+                self.invalidate_after_commit(session, namespace)
+
+        for name in ("after_insert", "after_update", "after_delete"):
+            event.listen(model, name, mark)
+
+        if not self._listening:
+            event.listen(Session, "after_commit", self._after_commit)
+            event.listen(Session, "after_rollback", self._after_rollback)
+            self._listening = True
+
+    def invalidate_after_commit(self, session, namespace):
+        # For Core UPDATEs and other writes the mapper events never see
+        session.info.setdefault("cache_invalidate", set()).add(namespace)
+
+    def _after_commit(self, session):
+        for namespace in session.info.pop("cache_invalidate", ()):
+            self.bump(namespace)
+
+    def _after_rollback(self, session):
+        session.info.pop("cache_invalidate", None)
+
+
+def produce_detail_namespace(produce_id):
+    # Each produce card is cached under its own namespace so a sale only evicts that card
+    return f"produce-detail:{produce_id}"
+
+
+# Edits to the catalogue itself, as opposed to "produce" which every sale also moves
+PRODUCE_CATALOGUE = "produce-catalogue"
+
+
+def produce_list_namespace(category):
+    # One category's listing pages, so a sale leaves the other categories cached
+    return f"produce-list:{category}"
+
+
+cache = Cache()
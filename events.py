@@ -0,0 +1,344 @@
+import asyncio
+from collections import defaultdict
+import json
+import logging
+import queue
+from select import select as wait_readable
+import threading
+
+from sqlalchemy import create_engine, or_, select
+from sqlalchemy.pool import NullPool
+
+from metrics import Gauge, metrics
+from models import Order, Produce
+
+logger = logging.getLogger("sokohub.events")
+
+# NOTIFY channels, raised by the triggers from migration 9e3f6b1d2a47
+ORDERS_CHANNEL = "sokohub_orders"
+PRODUCE_CHANNEL = "sokohub_produce"
+
+STREAM_HEARTBEAT = 15  # seconds between keep-alive comments, also how soon a gone client is noticed
+STREAM_QUEUE_SIZE = 100  # events a slow subscriber may fall behind before it's told to resync
+STREAM_RETRY_MS = 3000
+RESYNC = {"event": "resync"}
+
+
+def order_topics(vendor_id=None, farmer_id=None):
+    topics = []
+    if vendor_id is not None:
+        topics.append(f"orders:vendor:{vendor_id}")
+    if farmer_id is not None:
+        topics.append(f"orders:farmer:{farmer_id}")
+    return topics
+
+
+def produce_topic(produce_id):
+    return f"produce:{produce_id}"
+
+
+def order_event(row):
+    return {"event": "order", "id": row["id"], "vendor_id": row["vendor_id"], "farmer_id": row["farmer_id"],
+            "order_status": row["order_status"], "deposit_paid": row["deposit_paid"]}
+
+
+def produce_event(row):
+    return {"event": "produce", "id": row["id"], "quantity": row["quantity"]}
+
+
+def event_topics(event):
+    if event["event"] == "order":
+        return order_topics(event["vendor_id"], event["farmer_id"])
+    return [produce_topic(event["id"])]
+
+
+class Subscription:
+    # deliver() runs on the listener thread and never blocks, a full queue marks the subscriber lagged
+    def __init__(self, topics, maxsize=STREAM_QUEUE_SIZE):
+        self.topics = topics
+        self.events = queue.Queue(maxsize)
+        self.lagged = False
+
+    def deliver(self, event):
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.lagged = True
+
+
+class AsyncSubscription(Subscription):
+    # For the ASGI app, events are handed to the subscriber's event loop
+    def __init__(self, topics, maxsize=STREAM_QUEUE_SIZE):
+        self.topics = topics
+        self.loop = asyncio.get_running_loop()
+        self.events = asyncio.Queue(maxsize)
+        self.lagged = False
+
+    def deliver(self, event):
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        try:
+            self.events.put_nowait(event)
+        except asyncio.QueueFull:
+            self.lagged = True
+
+
+class Hub:
+    # Fans one listener's events out to every subscription on the event's topics
+    def __init__(self):
+        self._topics = defaultdict(set)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def subscribe(self, subscription):
+        with self._lock:
+            for topic in subscription.topics:
+                self._topics[topic].add(subscription)
+            self._count += 1
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for topic in subscription.topics:
+                subscribers = self._topics.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._topics[topic]
+            self._count -= 1
+
+    def topics(self):
+        with self._lock:
+            return list(self._topics)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = set()
+            for topic in event_topics(event):
+                subscribers.update(self._topics.get(topic, ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+    def broadcast(self, event):
+        with self._lock:
+            subscribers = set().union(*self._topics.values())
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+
+class PostgresListener(threading.Thread):
+    # One LISTEN connection per process, outside the pool, feeding the hub
+    def __init__(self, hub, url, reconnect_delay=1.0):
+        super().__init__(name="sokohub-listener", daemon=True)
+        self.hub = hub
+        self.engine = create_engine(url, poolclass=NullPool)
+        self.reconnect_delay = reconnect_delay
+        self.stopping = threading.Event()
+
+    def run(self):
+        connected_before = False
+        while not self.stopping.is_set():
+            try:
+                connection = self.engine.raw_connection()
+            except Exception:
+                logger.exception("Change feed can't reach Postgres, retrying")
+                self.stopping.wait(self.reconnect_delay)
+                continue
+            try:
+                driver = connection.driver_connection
+                driver.autocommit = True
+                with driver.cursor() as cursor:
+                    cursor.execute(f"LISTEN {ORDERS_CHANNEL}; LISTEN {PRODUCE_CHANNEL}")
+                # Anything sent while we were away is gone, subscribers refetch instead
+                if connected_before:
+                    self.hub.broadcast(RESYNC)
+                connected_before = True
+                self.listen(driver)
+            except Exception:
+                logger.exception("Change feed connection failed, reconnecting")
+                self.stopping.wait(self.reconnect_delay)
+            finally:
+                connection.close()
+
+    def listen(self, driver):
+        while not self.stopping.is_set():
+            if not wait_readable([driver], [], [], STREAM_HEARTBEAT)[0]:
+                # A quiet spell, make sure the connection is still there and not silently dropped
+                with driver.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                continue
+            driver.poll()
+            while driver.notifies:
+                notify = driver.notifies.pop(0)
+                row = json.loads(notify.payload)
+                self.hub.publish(order_event(row) if notify.channel == ORDERS_CHANNEL else produce_event(row))
+
+    def stop(self):
+        self.stopping.set()
+
+
+class PollingListener(threading.Thread):
+    # Fallback for databases without LISTEN/NOTIFY (SQLite test runs): re-reads the rows
+    # behind the subscribed topics every interval and publishes what changed
+    def __init__(self, hub, engine, interval=1.0):
+        super().__init__(name="sokohub-poller", daemon=True)
+        self.hub = hub
+        self.engine = engine
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.known = set()
+        self.orders = {}
+        self.produce = {}
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Change feed poll failed")
+
+    def poll(self):
+        topics = set(self.hub.topics())
+        vendor_ids, farmer_ids, produce_ids = set(), set(), set()
+        for topic in topics:
+            kind, _, key = topic.rpartition(":")
+            {"orders:vendor": vendor_ids, "orders:farmer": farmer_ids, "produce": produce_ids}[kind].add(int(key))
+
+        # Rows first seen under a topic that was only just subscribed are the baseline, rows
+        # new to a topic that was already watched have been inserted since the last poll
+        watched = topics & self.known
+        self.known = topics
+        with self.engine.connect() as connection:
+            if vendor_ids or farmer_ids:
+                rows = connection.execute(
+                    select(Order.id, Order.vendor_id, Order.farmer_id, Order.order_status, Order.deposit_paid)
+                    .where(or_(Order.vendor_id.in_(vendor_ids), Order.farmer_id.in_(farmer_ids)))
+                ).mappings()
+                self.orders = self.diff(self.orders, rows, order_event, watched)
+            if produce_ids:
+                rows = connection.execute(stock_query(produce_ids)).mappings()
+                self.produce = self.diff(self.produce, rows, produce_event, watched)
+
+    def diff(self, previous, rows, to_event, watched):
+        current = {}
+        for row in rows:
+            event = to_event(row)
+            current[event["id"]] = event
+            before = previous.get(event["id"])
+            if before is None:
+                if watched.intersection(event_topics(event)):
+                    self.hub.publish(event)
+            elif before != event:
+                self.hub.publish(event)
+        return current
+
+    def stop(self):
+        self.stopping.set()
+
+
+class ChangeFeed:
+    # Per-process hub plus the listener feeding it, started by the first subscriber so
+    # CLI commands and job workers never open a LISTEN connection
+    def __init__(self):
+        self.hub = Hub()
+        self.listener = None
+        self.poll_interval = 1.0
+        self.max_subscribers = 1000
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.poll_interval = app.config.get("STREAM_POLL_INTERVAL", 1.0)
+        self.max_subscribers = app.config.get("STREAM_MAX_SUBSCRIBERS", 1000)
+        app.extensions["changes"] = self
+
+    def start(self, engine):
+        with self._lock:
+            if self.listener is not None and self.listener.is_alive():
+                return
+            if engine.dialect.name == "postgresql":
+                self.listener = PostgresListener(self.hub, engine.url)
+            else:
+                self.listener = PollingListener(self.hub, engine, self.poll_interval)
+            self.listener.start()
+
+    def full(self):
+        return len(self.hub) >= self.max_subscribers
+
+    def subscribe(self, engine, subscription):
+        # engine is the primary, NOTIFY isn't replicated to standbys
+        self.start(engine)
+        self.hub.subscribe(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.hub.unsubscribe(subscription)
+
+
+def stock_query(produce_ids):
+    return select(Produce.id, Produce.quantity).where(Produce.id.in_(produce_ids))
+
+
+def current_stock(engine, produce_id):
+    with engine.connect() as connection:
+        return [produce_event(row) for row in connection.execute(stock_query([produce_id])).mappings()]
+
+
+def sse(event):
+    return f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+
+def drained(subscription):
+    # The subscriber missed events, drop the backlog and have it refetch
+    while True:
+        try:
+            subscription.events.get_nowait()
+        except (queue.Empty, asyncio.QueueEmpty):
+            break
+    subscription.lagged = False
+    return sse(RESYNC)
+
+
+def sse_stream(feed, engine, topics, snapshot=None):
+    # A plain generator: the request context, its DB session and admission slot are gone
+    # before the first chunk is sent. Subscribing here rather than in the view means a
+    # client that leaves before the body starts never leaves a subscription behind, and
+    # the snapshot is read after subscribing so no change falls in between.
+    subscription = feed.subscribe(engine, Subscription(topics))
+    try:
+        yield f"retry: {STREAM_RETRY_MS}\n\n"
+        for event in snapshot() if snapshot else ():
+            yield sse(event)
+        while True:
+            try:
+                event = subscription.events.get(timeout=STREAM_HEARTBEAT)
+            except queue.Empty:
+                yield ": ping\n\n"
+                continue
+            yield drained(subscription) if subscription.lagged else sse(event)
+    finally:
+        feed.unsubscribe(subscription)
+
+
+async def sse_stream_async(feed, engine, topics, snapshot=None):
+    subscription = feed.subscribe(engine, AsyncSubscription(topics))
+    try:
+        yield f"retry: {STREAM_RETRY_MS}\n\n".encode()
+        for event in await snapshot() if snapshot else ():
+            yield sse(event).encode()
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.events.get(), STREAM_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield b": ping\n\n"
+                continue
+            yield (drained(subscription) if subscription.lagged else sse(event)).encode()
+    finally:
+        feed.unsubscribe(subscription)
+
+
+changes = ChangeFeed()
+metrics.register(Gauge(
+    "sokohub_stream_subscribers", "Event streams open in this process.", lambda: {(): len(changes.hub)}))
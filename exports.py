@@ -0,0 +1,48 @@
+import csv
+from datetime import date, datetime
+import io
+import zlib
+
+from schemas import dumps
+
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+EXPORT_BATCH_SIZE = 1000  # rows fetched from the cursor, encoded and sent at a time
+
+
+def csv_value(value):
+    # Same text as the JSON routes for dates, booleans as true/false
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return value
+
+
+def export_rows(result, schema, export_format):
+    # result comes from an execute() with yield_per, so only a batch of rows is held at once
+    encode = schema.encoder(tuple(result.keys()))
+    if export_format == "ndjson":
+        for batch in result.partitions():
+            yield b"".join(dumps(encode(row)) + b"\n" for row in batch)
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([field.key for field in schema.fields])
+    for batch in result.partitions():
+        writer.writerows([csv_value(value) for value in encode(row).values()] for row in batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def gzipped(chunks, level=6):
+    # One gzip stream over the chunks, compressed as they go
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,209 @@
+from math import cos, radians
+
+from sqlalchemy import and_, event, func, literal_column, or_, select, text
+
+from models import Farmer, Produce
+
+NEARBY_RADIUS_DEFAULT = 25  # km
+NEARBY_RADIUS_MAX = 200  # km
+NEARBY_PAGE_DEFAULT = 50
+NEARBY_PAGE_MAX = 200
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+GEOHASH_PRECISION = 7  # cells of roughly 150m x 150m
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+# Upper bound on the index range scans one lookup may take
+MAX_COVERING_CELLS = 16
+
+# County towns for farmers who give a location but no coordinates
+PLACES = {
+    "nairobi": (-1.2864, 36.8172),
+    "mombasa": (-4.0435, 39.6682),
+    "kisumu": (-0.0917, 34.7680),
+    "nakuru": (-0.3031, 36.0800),
+    "eldoret": (0.5143, 35.2698),
+    "thika": (-1.0333, 37.0693),
+    "nyeri": (-0.4201, 36.9476),
+    "meru": (0.0470, 37.6498),
+    "embu": (-0.5310, 37.4506),
+    "machakos": (-1.5177, 37.2634),
+    "kiambu": (-1.1714, 36.8356),
+    "limuru": (-1.1136, 36.6422),
+    "kericho": (-0.3677, 35.2831),
+    "kakamega": (0.2827, 34.7519),
+    "kisii": (-0.6817, 34.7667),
+    "naivasha": (-0.7167, 36.4333),
+    "nanyuki": (0.0167, 37.0667),
+    "nyahururu": (0.0333, 36.3667),
+    "kitale": (1.0157, 35.0062),
+    "bungoma": (0.5635, 34.5606),
+    "busia": (0.4608, 34.1115),
+    "narok": (-1.0833, 35.8667),
+    "kitui": (-1.3667, 38.0106),
+    "muranga": (-0.7210, 37.1526),
+    "kerugoya": (-0.4989, 37.2803),
+    "isiolo": (0.3546, 37.5822),
+    "garissa": (-0.4532, 39.6461),
+    "malindi": (-3.2192, 40.1169),
+    "voi": (-3.3961, 38.5561),
+    "lamu": (-2.2717, 40.9020),
+}
+
+NEARBY_COLUMNS = (
+    Produce.id,
+    Produce.name,
+    Produce.unit_price,
+    Produce.quantity,
+    Produce.category,
+    Produce.farmer_id,
+    Farmer.location,
+)
+
+
+def geocode(location):
+    if not location:
+        return None
+    words = location.lower().replace("'", "").replace(",", " ").split()
+    for word in words:
+        if word in PLACES:
+            return PLACES[word]
+    return None
+
+
+def valid_coordinates(lat, lng):
+    return -90 <= lat <= 90 and -180 <= lng <= 180
+
+
+def encode_geohash(lat, lng, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    value = 0
+    bits = 0
+    even = True  # geohash interleaves bits starting with longitude
+    while len(chars) < precision:
+        span, coordinate = (lng_range, lng) if even else (lat_range, lat)
+        middle = (span[0] + span[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            span[0] = middle
+        else:
+            span[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            value = 0
+            bits = 0
+    return "".join(chars)
+
+
+def cell_size(precision):
+    # (height, width) in degrees of one geohash cell
+    total = precision * 5
+    return 180.0 / 2 ** (total // 2), 360.0 / 2 ** (total - total // 2)
+
+
+def covering_cells(lat, lng, radius_km):
+    # The finest geohash cells that cover the circle's bounding box in at most MAX_COVERING_CELLS prefixes
+    lat_delta = radius_km / KM_PER_DEGREE
+    lng_delta = radius_km / (KM_PER_DEGREE * max(cos(radians(lat)), 0.01))
+    south, north = max(lat - lat_delta, -90.0), min(lat + lat_delta, 90.0)
+    west, east = max(lng - lng_delta, -180.0), min(lng + lng_delta, 180.0)
+
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        last_row, last_column = round(180 / height) - 1, round(360 / width) - 1
+        rows = range(int((south + 90) // height), min(int((north + 90) // height), last_row) + 1)
+        columns = range(int((west + 180) // width), min(int((east + 180) // width), last_column) + 1)
+        if len(rows) * len(columns) <= MAX_COVERING_CELLS:
+            break
+
+    return sorted({
+        encode_geohash(-90 + (row + 0.5) * height, -180 + (column + 0.5) * width, precision)
+        for row in rows for column in columns
+    })
+
+
+def distance_km(lat, lng, farm_lat, farm_lng):
+    # Haversine as a SQL expression from a fixed point to the farm's columns
+    a = (func.power(func.sin(func.radians(farm_lat - lat) / 2), 2)
+         + cos(radians(lat)) * func.cos(func.radians(farm_lat)) * func.power(func.sin(func.radians(farm_lng - lng) / 2), 2))
+    return 2 * EARTH_RADIUS_KM * func.asin(func.sqrt(a))
+
+
+def track_geohash(model):
+    # Keeps the geohash column in step with the coordinates on every ORM write
+    def update(mapper, connection, target):
+        if target.latitude is None or target.longitude is None:
+            target.geohash = None
+        else:
+            target.geohash = encode_geohash(target.latitude, target.longitude)
+
+    event.listen(model, "before_insert", update)
+    event.listen(model, "before_update", update)
+
+
+def point(lng, lat):
+    # Written exactly like the ix_farmers_geography expression so the planner can use it
+    return func.geography(func.ST_SetSRID(func.ST_MakePoint(lng, lat), literal_column("4326")))
+
+
+class PostgisNearby:
+    # ST_DWithin over the GiST index on the farmers' geography points
+
+    def search(self, session, lat, lng, radius_km, limit, offset):
+        farm = point(Farmer.longitude, Farmer.latitude)
+        here = point(lng, lat)
+        distance = (func.ST_Distance(farm, here) / 1000).label("distance_km")
+        return session.execute(
+            select(*NEARBY_COLUMNS, distance)
+            .join(Farmer, Produce.farmer_id == Farmer.id)
+            .where(func.ST_DWithin(farm, here, radius_km * 1000))
+            .order_by(distance, Produce.id)
+            .limit(limit)
+            .offset(offset)
+        ).all()
+
+
+class GeohashNearby:
+    # Range scans on farmers.geohash are the bounding box, the exact distance is worked out
+    # in SQL for the farms inside it. Postgres and SQLite (3.35+) both have the math functions.
+
+    def search(self, session, lat, lng, radius_km, limit, offset):
+        cells = covering_cells(lat, lng, radius_km)
+        distance = distance_km(lat, lng, Farmer.latitude, Farmer.longitude)
+        return session.execute(
+            select(*NEARBY_COLUMNS, distance.label("distance_km"))
+            .join(Farmer, Produce.farmer_id == Farmer.id)
+            .where(or_(*[and_(Farmer.geohash >= cell, Farmer.geohash < cell + "~") for cell in cells]))
+            .where(distance <= radius_km)
+            .order_by(distance, Produce.id)
+            .limit(limit)
+            .offset(offset)
+        ).all()
+
+
+postgis_nearby = PostgisNearby()
+geohash_nearby = GeohashNearby()
+_postgis_installed = {}
+
+
+def has_postgis(session):
+    bind = session.get_bind()
+    if bind.dialect.name != "postgresql":
+        return False
+    key = str(bind.url)
+    if key not in _postgis_installed:
+        _postgis_installed[key] = session.execute(
+            text("SELECT 1 FROM pg_extension WHERE extname = 'postgis'")
+        ).first() is not None
+    return _postgis_installed[key]
+
+
+def nearby_produce(session, lat, lng, radius_km=NEARBY_RADIUS_DEFAULT, limit=NEARBY_PAGE_DEFAULT, offset=0):
+    if has_postgis(session):
+        return postgis_nearby.search(session, lat, lng, radius_km, limit, offset)
+    return geohash_nearby.search(session, lat, lng, radius_km, limit, offset)
@@ -0,0 +1,134 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+import time
+
+from sqlalchemy import bindparam, or_, select, update
+
+from cache import cache, produce_detail_namespace, produce_list_namespace
+from models import Order, Produce
+
+RESERVATION_TTL = timedelta(minutes=30)
+RELEASE_BATCH_SIZE = 500
+
+orders = Order.__table__
+produce = Produce.__table__
+
+
+def invalidate_stock(session, produce_ids, categories):
+    # Stock shows on the produce cards, the full listing and the listings of those categories only
+    cache.invalidate_after_commit(session, "produce")
+    for category in categories:
+        if category:
+            cache.invalidate_after_commit(session, produce_list_namespace(category))
+    for produce_id in produce_ids:
+        cache.invalidate_after_commit(session, produce_detail_namespace(produce_id))
+
+
+def reserve_stock(session, produce_id, quantity):
+    # Decrement only if enough stock is left, the row lock lasts until the caller commits
+    row = session.execute(
+        update(produce)
+        .where(produce.c.id == produce_id)
+        .where(produce.c.quantity >= quantity)
+        .values(quantity=produce.c.quantity - quantity)
+        .returning(produce.c.farmer_id, produce.c.unit_price, produce.c.category)
+    ).first()
+    if row is not None:
+        invalidate_stock(session, [produce_id], [row.category])
+    return row
+
+
+class StockError(Exception):
+    def __init__(self, missing=(), short=()):
+        super().__init__(f"missing produce {list(missing)}, not enough stock for {list(short)}")
+        self.missing = list(missing)
+        self.short = list(short)
+
+
+def reserve_stock_many(session, quantities):
+    # All or nothing over {produce_id: quantity}: one IN query locks the rows in id order,
+    # so two carts sharing produce queue behind each other instead of deadlocking
+    produce_ids = sorted(quantities)
+    query = (
+        select(produce.c.id, produce.c.farmer_id, produce.c.unit_price, produce.c.quantity, produce.c.category)
+        .where(produce.c.id.in_(produce_ids))
+        .order_by(produce.c.id)
+    )
+    dialect = session.get_bind().dialect
+    if dialect.name == "postgresql":
+        query = query.with_for_update()
+    rows = {row.id: row for row in session.execute(query)}
+
+    missing = [produce_id for produce_id in produce_ids if produce_id not in rows]
+    short = [produce_id for produce_id in produce_ids
+             if produce_id in rows and rows[produce_id].quantity < quantities[produce_id]]
+    if missing or short:
+        raise StockError(missing, short)
+
+    # Still guarded on the stock left, databases without row locks can race between the read and here
+    result = session.execute(
+        update(produce)
+        .where(produce.c.id == bindparam("r_produce_id"))
+        .where(produce.c.quantity >= bindparam("r_quantity"))
+        .values(quantity=produce.c.quantity - bindparam("r_quantity")),
+        [{"r_produce_id": produce_id, "r_quantity": quantities[produce_id]} for produce_id in produce_ids]
+    )
+    if dialect.supports_sane_multi_rowcount and result.rowcount != len(produce_ids):
+        raise StockError(short=produce_ids)
+
+    invalidate_stock(session, produce_ids, {row.category for row in rows.values()})
+    return rows
+
+
+def reservation_expiry(ttl=RESERVATION_TTL):
+    return datetime.utcnow() + ttl
+
+
+def release_expired_reservations(session, now=None, batch_size=RELEASE_BATCH_SIZE):
+    now = now or datetime.utcnow()
+
+    expired_ids = (
+        select(orders.c.id)
+        .where(orders.c.order_status == "Pending")
+        .where(or_(orders.c.deposit_paid.is_(False), orders.c.deposit_paid.is_(None)))
+        .where(orders.c.reserved_until < now)
+        .limit(batch_size)
+    )
+    if session.get_bind().dialect.name == "postgresql":
+        expired_ids = expired_ids.with_for_update(skip_locked=True)
+
+    # The status check is repeated so an order paid in the meantime keeps its stock
+    released = session.execute(
+        update(orders)
+        .where(orders.c.id.in_(expired_ids.scalar_subquery()))
+        .where(orders.c.order_status == "Pending")
+        .values(order_status="Expired")
+        .returning(orders.c.produce_id, orders.c.quantity)
+    ).all()
+    if not released:
+        session.commit()
+        return 0
+
+    restock = defaultdict(int)
+    for produce_id, quantity in released:
+        restock[produce_id] += quantity
+
+    session.execute(
+        update(produce)
+        .where(produce.c.id == bindparam("r_produce_id"))
+        .values(quantity=produce.c.quantity + bindparam("r_quantity")),
+        [{"r_produce_id": produce_id, "r_quantity": quantity} for produce_id, quantity in restock.items()]
+    )
+    categories = session.execute(
+        select(produce.c.category).where(produce.c.id.in_(list(restock))).distinct()
+    ).scalars()
+    invalidate_stock(session, restock, categories)
+    session.commit()
+    return len(released)
+
+
+def run_reservation_reaper(session, batch_size=RELEASE_BATCH_SIZE, interval=30.0):
+    while True:
+        released = release_expired_reservations(session, batch_size=batch_size)
+        if released < batch_size:
+            time.sleep(interval)
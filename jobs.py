@@ -0,0 +1,402 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from wsgiref.simple_server import WSGIRequestHandler, make_server
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import threading
+import time
+import zlib
+
+from sqlalchemy import bindparam, case, delete, func, insert, or_, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from metrics import Gauge, Histogram, metrics
+from models import Job, JobSchedule, db
+
+logger = logging.getLogger("sokohub.jobs")
+
+DEFAULT_QUEUE = "default"
+# Default per-queue concurrency, summed over every worker process
+JOB_QUEUES = {"payments": 4, "notifications": 2, "housekeeping": 1, DEFAULT_QUEUE: 2}
+RETRY_BACKOFF = 5.0  # seconds, doubled on every attempt
+RETRY_BACKOFF_MAX = 3600.0
+JOB_TIMEOUT = timedelta(minutes=15)
+STALE_JOB_CHECK_INTERVAL = timedelta(minutes=1)
+FINISHED_JOB_RETENTION = timedelta(days=7)
+JOB_BUCKETS = (0.05, 0.25, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0)
+
+jobs = Job.__table__
+schedules = JobSchedule.__table__
+
+
+class GiveUp(Exception):
+    # Raised by a task to fail its job straight away instead of retrying
+    pass
+
+
+class Task:
+    def __init__(self, fn, name, queue, max_attempts, every, timeout):
+        self.fn = fn
+        self.name = name
+        self.queue = queue
+        self.max_attempts = max_attempts
+        self.every = every
+        self.timeout = timeout
+
+
+TASKS = {}
+
+
+def task(name, queue=DEFAULT_QUEUE, max_attempts=5, every=None, timeout=None):
+    # every=timedelta(...) also runs the task on that schedule, without a payload
+    # timeout=timedelta(...) for tasks that can legitimately run past JOB_TIMEOUT
+    def register(fn):
+        TASKS[name] = Task(fn, name, queue, max_attempts, every, timeout)
+        return fn
+    return register
+
+
+def enqueue(session, name, payload=None, run_at=None):
+    # Joins the caller's transaction, so the job only exists if the work that asked for it commits
+    spec = TASKS[name]
+    return session.execute(
+        insert(jobs).values(
+            queue=spec.queue,
+            task=name,
+            payload=payload or {},
+            status="queued",
+            attempts=0,
+            max_attempts=spec.max_attempts,
+            run_at=run_at or datetime.utcnow(),
+            created_at=datetime.utcnow(),
+        ).returning(jobs.c.id)
+    ).scalar()
+
+
+def enqueue_many(session, name, payloads):
+    # One multi-row insert for a batch of the same task, in the caller's transaction like enqueue()
+    if not payloads:
+        return
+    spec = TASKS[name]
+    now = datetime.utcnow()
+    session.execute(insert(jobs), [{
+        "queue": spec.queue,
+        "task": name,
+        "payload": payload,
+        "status": "queued",
+        "attempts": 0,
+        "max_attempts": spec.max_attempts,
+        "run_at": now,
+        "created_at": now,
+    } for payload in payloads])
+
+
+def queued_jobs(session, queue):
+    return session.execute(
+        select(func.count()).where(jobs.c.queue == queue).where(jobs.c.status == "queued")
+    ).scalar()
+
+
+def queue_lock_key(queue):
+    return zlib.crc32(f"jobs:{queue}".encode())
+
+
+def stale_cutoff(now, timeout=JOB_TIMEOUT):
+    # Running jobs started before this have lost their worker, per task for tasks with their own timeout
+    cutoffs = {spec.name: now - spec.timeout for spec in TASKS.values() if spec.timeout}
+    if not cutoffs:
+        return now - timeout
+    return case(cutoffs, value=jobs.c.task, else_=now - timeout)
+
+
+def claim_jobs(session, queue, limit, concurrency, worker):
+    now = datetime.utcnow()
+    postgres = session.get_bind().dialect.name == "postgresql"
+    if postgres:
+        # Claims on one queue take turns so the running count below stays true across workers
+        session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": queue_lock_key(queue)})
+
+    # A job running past its timeout has lost its worker and doesn't hold a slot any more
+    running = session.execute(
+        select(func.count()).where(jobs.c.queue == queue).where(jobs.c.status == "running")
+        .where(jobs.c.started_at >= stale_cutoff(now))
+    ).scalar()
+    limit = min(limit, concurrency - running)
+    if limit <= 0:
+        session.commit()
+        return []
+
+    ready = (
+        select(jobs.c.id)
+        .where(jobs.c.queue == queue)
+        .where(jobs.c.status == "queued")
+        .where(jobs.c.run_at <= now)
+        .order_by(jobs.c.run_at, jobs.c.id)
+        .limit(limit)
+    )
+    if postgres:
+        ready = ready.with_for_update(skip_locked=True)
+
+    claimed = session.execute(
+        update(jobs)
+        .where(jobs.c.id.in_(ready.scalar_subquery()))
+        .where(jobs.c.status == "queued")
+        .values(status="running", attempts=jobs.c.attempts + 1, locked_by=worker, started_at=now)
+        .returning(jobs.c.id, jobs.c.queue, jobs.c.task, jobs.c.payload, jobs.c.attempts,
+                   jobs.c.max_attempts, jobs.c.run_at, jobs.c.started_at, jobs.c.locked_by)
+    ).all()
+    session.commit()
+    return claimed
+
+
+def retry_delay(attempts):
+    # Full jitter, like the Daraja client, so failed jobs don't come back in lockstep
+    return random.uniform(0, min(RETRY_BACKOFF * 2 ** (attempts - 1), RETRY_BACKOFF_MAX))
+
+
+def finish_job(session, job, error=None, retry=False):
+    now = datetime.utcnow()
+    if error is None:
+        values = {"status": "done", "finished_at": now, "last_error": None}
+    elif retry:
+        values = {"status": "queued", "run_at": now + timedelta(seconds=retry_delay(job.attempts)),
+                  "locked_by": None, "last_error": error}
+    else:
+        values = {"status": "failed", "finished_at": now, "last_error": error}
+    # Only the run that claimed it, a run that was requeued as stale and claimed again isn't ours to finish
+    finished = session.execute(
+        update(jobs).where(jobs.c.id == job.id).where(jobs.c.status == "running")
+        .where(jobs.c.locked_by == job.locked_by).where(jobs.c.attempts == job.attempts)
+        .values(**values)
+    ).rowcount
+    session.commit()
+    if not finished:
+        logger.warning("Job %s (%s) attempt %d finished after it was requeued as stale",
+                       job.id, job.task, job.attempts)
+    return bool(finished)
+
+
+def run_job(app, job):
+    with app.app_context():
+        job_wait.observe((job.queue,), max((job.started_at - job.run_at).total_seconds(), 0))
+        started = time.perf_counter()
+        outcome = "done"
+        try:
+            spec = TASKS.get(job.task)
+            if spec is None:
+                raise GiveUp(f"Unknown task {job.task}")
+            spec.fn(db.session, **(job.payload or {}))
+            db.session.commit()
+            finish_job(db.session, job)
+        except Exception as exc:
+            db.session.rollback()
+            retry = not isinstance(exc, GiveUp) and job.attempts < job.max_attempts
+            outcome = "retry" if retry else "failed"
+            logger.warning("Job %s (%s) attempt %d failed: %r", job.id, job.task, job.attempts, exc,
+                           exc_info=not isinstance(exc, GiveUp))
+            finish_job(db.session, job, repr(exc), retry)
+        finally:
+            job_duration.observe((job.queue, job.task, outcome), time.perf_counter() - started)
+
+
+def ensure_schedules(session):
+    now = datetime.utcnow()
+    rows = [{"name": spec.name, "next_run_at": now} for spec in TASKS.values() if spec.every]
+    if not rows:
+        return
+    dialect = session.get_bind().dialect.name
+    upsert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    session.execute(upsert(schedules).on_conflict_do_nothing(index_elements=["name"]), rows)
+    session.commit()
+
+
+def run_due_schedules(session):
+    now = datetime.utcnow()
+    due = select(schedules.c.name).where(schedules.c.next_run_at <= now)
+    if session.get_bind().dialect.name == "postgresql":
+        # Only one worker enqueues each due run
+        due = due.with_for_update(skip_locked=True)
+
+    updates = []
+    for name in session.execute(due).scalars():
+        spec = TASKS.get(name)
+        if spec is None or spec.every is None:
+            continue
+        enqueue(session, name)
+        updates.append({"s_name": name, "s_next_run_at": now + spec.every})
+    if updates:
+        session.execute(
+            update(schedules).where(schedules.c.name == bindparam("s_name"))
+            .values(next_run_at=bindparam("s_next_run_at")),
+            updates
+        )
+    session.commit()
+    return len(updates)
+
+
+def requeue_stale_jobs(session, timeout=JOB_TIMEOUT):
+    # Jobs whose worker died mid-run, the attempt they were on counts
+    stale = (jobs.c.status == "running") & (jobs.c.started_at < stale_cutoff(datetime.utcnow(), timeout))
+    failed = session.execute(
+        update(jobs).where(stale).where(jobs.c.attempts >= jobs.c.max_attempts)
+        .values(status="failed", finished_at=datetime.utcnow(), last_error="Timed out")
+    ).rowcount
+    requeued = session.execute(
+        update(jobs).where(stale).values(status="queued", locked_by=None, last_error="Timed out")
+    ).rowcount
+    session.commit()
+    return requeued, failed
+
+
+def purge_finished_jobs(session, older_than=FINISHED_JOB_RETENTION):
+    purged = session.execute(
+        delete(jobs)
+        .where(or_(jobs.c.status == "done", jobs.c.status == "failed"))
+        .where(jobs.c.finished_at < datetime.utcnow() - older_than)
+    ).rowcount
+    session.commit()
+    return purged
+
+
+def queue_depth():
+    rows = db.session.execute(
+        select(jobs.c.queue, jobs.c.status, func.count())
+        .where(or_(jobs.c.status == "queued", jobs.c.status == "running"))
+        .group_by(jobs.c.queue, jobs.c.status)
+    )
+    return {(queue, status): count for queue, status, count in rows}
+
+
+def queue_lag():
+    now = datetime.utcnow()
+    rows = db.session.execute(
+        select(jobs.c.queue, func.min(jobs.c.run_at))
+        .where(jobs.c.status == "queued")
+        .where(jobs.c.run_at <= now)
+        .group_by(jobs.c.queue)
+    )
+    return {(queue,): round(max((now - oldest).total_seconds(), 0), 3) for queue, oldest in rows}
+
+
+job_wait = metrics.register(Histogram(
+    "sokohub_job_wait_seconds", "Time a job was ready before a worker started it.", JOB_BUCKETS, ("queue",)))
+job_duration = metrics.register(Histogram(
+    "sokohub_job_duration_seconds", "Time spent running a job.", JOB_BUCKETS, ("queue", "task", "outcome")))
+metrics.register(Gauge(
+    "sokohub_job_queue_depth", "Jobs waiting or running.", queue_depth, ("queue", "status")))
+metrics.register(Gauge(
+    "sokohub_job_queue_lag_seconds", "Age of the oldest job that is ready to run.", queue_lag, ("queue",)))
+
+
+class Worker:
+    # Polls each queue for as many jobs as it has free threads for that queue
+    def __init__(self, app, queues, poll_interval=1.0):
+        self.app = app
+        self.queues = queues
+        self.poll_interval = poll_interval
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.executors = {
+            queue: ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"job-{queue}")
+            for queue, concurrency in queues.items()
+        }
+        self.in_flight = {queue: set() for queue in queues}
+        self.stopping = threading.Event()
+        self.next_stale_check = datetime.utcnow()
+
+    def poll(self):
+        claimed = 0
+        with self.app.app_context():
+            # Not a scheduled job, a stale job on the queue it ran on would keep it waiting
+            if datetime.utcnow() >= self.next_stale_check:
+                requeue_stale_jobs(db.session)
+                self.next_stale_check = datetime.utcnow() + STALE_JOB_CHECK_INTERVAL
+            run_due_schedules(db.session)
+            for queue, concurrency in self.queues.items():
+                running = self.in_flight[queue]
+                running.difference_update([future for future in running if future.done()])
+                free = concurrency - len(running)
+                if free <= 0:
+                    continue
+                for job in claim_jobs(db.session, queue, free, concurrency, self.name):
+                    running.add(self.executors[queue].submit(run_job, self.app, job))
+                    claimed += 1
+        return claimed
+
+    def run(self):
+        with self.app.app_context():
+            ensure_schedules(db.session)
+        logger.info("Worker %s polling %s", self.name, self.queues)
+        while not self.stopping.is_set():
+            try:
+                claimed = self.poll()
+            except Exception:
+                logger.exception("Worker %s failed to poll", self.name)
+                claimed = 0
+            if not claimed:
+                self.stopping.wait(self.poll_interval)
+        # Let running jobs finish, anything not started stays queued for the next worker
+        for executor in self.executors.values():
+            executor.shutdown(wait=True)
+
+    def stop(self, *args):
+        self.stopping.set()
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve_metrics(app, port):
+    # Worker processes don't serve the API, this exposes their job metrics on their own port
+    def metrics_app(environ, start_response):
+        with app.app_context():
+            body = metrics.render().encode()
+        start_response("200 OK", [("Content-Type", "text/plain; version=0.0.4")])
+        return [body]
+
+    server = make_server("0.0.0.0", port, metrics_app, handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="job-metrics").start()
+
+
+def worker_main(app, queues, poll_interval, metrics_port=None):
+    # Pooled connections opened before a fork belong to the parent
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    if metrics_port:
+        serve_metrics(app, metrics_port)
+
+    worker = Worker(app, queues, poll_interval)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run()
+
+
+def run_workers(app, queues, processes=1, poll_interval=1.0, metrics_port=None):
+    if processes == 1:
+        worker_main(app, queues, poll_interval, metrics_port)
+        return
+
+    context = multiprocessing.get_context("fork")
+    children = [
+        context.Process(target=worker_main, name=f"job-worker-{i}",
+                        args=(app, queues, poll_interval, metrics_port + i if metrics_port else None))
+        for i in range(processes)
+    ]
+    for child in children:
+        child.start()
+
+    def forward(signum, frame):
+        for child in children:
+            if child.is_alive():
+                os.kill(child.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for child in children:
+        child.join()
@@ -0,0 +1,234 @@
+from collections import Counter as StatementCounter
+import bisect
+import logging
+import threading
+import time
+
+from flask import Response, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("sokohub.metrics")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.labels = labels
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), series):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{format_labels(names, labels + (bound,))} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {series[-1]}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    # Read at scrape time, collect() returns {label values: value}
+    def __init__(self, name, help, collect, labels=()):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.labels = labels
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.collect()
+        except Exception:
+            # One broken collector shouldn't take the rest of the scrape down with it
+            logger.exception("Collecting %s failed", self.name)
+            return lines
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Metrics:
+    # Per-process request and SQL instrumentation, exposed as Prometheus text on /metrics
+    def __init__(self):
+        route = ("method", "route", "status")
+        self.request_latency = Histogram(
+            "sokohub_request_duration_seconds", "Time spent handling a request.", LATENCY_BUCKETS, route)
+        self.request_statements = Histogram(
+            "sokohub_request_sql_statements", "SQL statements executed per request.", COUNT_BUCKETS, route)
+        self.request_sql_time = Histogram(
+            "sokohub_request_sql_duration_seconds", "Time spent in SQL per request.", LATENCY_BUCKETS, route)
+        self.request_rows = Histogram(
+            "sokohub_request_sql_rows", "Rows reported by the database per request.", COUNT_BUCKETS, route)
+        self.slow_queries = Counter(
+            "sokohub_slow_queries_total", "Statements slower than SLOW_QUERY_MS.", ("route",))
+        self.n_plus_one = Counter(
+            "sokohub_n_plus_one_total", "Requests that repeated one statement N_PLUS_ONE_THRESHOLD times or more.",
+            ("route",))
+        self.collectors = [
+            self.request_latency, self.request_statements, self.request_sql_time,
+            self.request_rows, self.slow_queries, self.n_plus_one,
+        ]
+        self.slow_query_seconds = 0.2
+        self.n_plus_one_threshold = 10
+        self._listening = False
+
+    def register(self, collector):
+        self.collectors.append(collector)
+        return collector
+
+    def init_app(self, app):
+        self.slow_query_seconds = app.config.get("SLOW_QUERY_MS", 200) / 1000
+        self.n_plus_one_threshold = app.config.get("N_PLUS_ONE_THRESHOLD", 10)
+        app.extensions["metrics"] = self
+        # Off means no hooks at all, not hooks that return early, so the two can be benchmarked
+        if not app.config.get("METRICS_ENABLED", True):
+            self._listen(False)
+            return
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule("/metrics", "metrics", self.render_response)
+        self._listen(True)
+
+    def _listen(self, on):
+        # The cursor events are per process, the last app set up decides
+        if on == self._listening:
+            return
+        for name in ("before_cursor_execute", "after_cursor_execute", "handle_error"):
+            (event.listen if on else event.remove)(Engine, name, getattr(self, f"_{name}"))
+        self._listening = on
+
+    def _before_request(self):
+        g.sql_stats = {"count": 0, "time": 0.0, "rows": 0, "statements": StatementCounter()}
+        g.request_started = time.perf_counter()
+
+    def _after_request(self, response):
+        if g.get("request_started") is None:
+            return response
+        g.response_status = response.status_code
+        # A streamed body can still run SQL (stream_with_context keeps g.sql_stats current while it
+        # does), so it's observed once the server closes it. Event streams stay open as long as the
+        # client listens, their latency is the time to the headers like any other response.
+        if response.is_streamed and response.mimetype != "text/event-stream":
+            observation = self._observation(g.pop("request_started"), response.status_code)
+            response.call_on_close(lambda: self._observe(*observation))
+        return response
+
+    def _teardown_request(self, exc):
+        # Here rather than in after_request so requests that raised are counted too. Streamed
+        # bodies were handed to call_on_close, their request_started is gone.
+        started = g.pop("request_started", None)
+        if started is not None:
+            self._observe(*self._observation(started, g.get("response_status", 500)))
+
+    def _observation(self, started, status):
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        return (request.method, route, status), started, g.sql_stats
+
+    def _observe(self, labels, started, stats):
+        method, route, _ = labels
+        self.request_latency.observe(labels, time.perf_counter() - started)
+        self.request_statements.observe(labels, stats["count"])
+        self.request_sql_time.observe(labels, stats["time"])
+        self.request_rows.observe(labels, stats["rows"])
+
+        if stats["statements"]:
+            statement, repeats = stats["statements"].most_common(1)[0]
+            if repeats >= self.n_plus_one_threshold:
+                self.n_plus_one.inc((route,))
+                logger.warning("Possible N+1 on %s %s: statement ran %d times: %s",
+                               method, route, repeats, statement)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        self._record(statement, parameters, executemany, elapsed, max(cursor.rowcount, 0))
+
+    def _handle_error(self, context):
+        # A statement that raised never reaches after_cursor_execute, its start time would stay
+        # on the connection and be taken for the next statement's. This runs before a lost
+        # connection is invalidated, so its info is still there.
+        if context.is_pre_ping or context.connection is None or context.execution_context is None:
+            return
+        started = context.connection.info.get("query_started")
+        if started:
+            self._record(context.statement, context.parameters, context.execution_context.executemany,
+                         time.perf_counter() - started.pop(), 0)
+
+    def _record(self, statement, parameters, executemany, elapsed, rows):
+        stats = g.get("sql_stats") if has_app_context() else None
+        route = request.url_rule.rule if stats is not None and request.url_rule else "-"
+        if stats is not None:
+            stats["count"] += 1
+            stats["time"] += elapsed
+            stats["rows"] += rows
+            stats["statements"][statement] += 1
+
+        if elapsed >= self.slow_query_seconds:
+            self.slow_queries.inc((route,))
+            # Bound values can hold phone numbers and M-Pesa codes, only their count is logged
+            count = len(parameters) if isinstance(parameters, (list, tuple, dict)) else 0
+            logger.warning("Slow query on %s took %.1fms (%s, %d parameters redacted): %s",
+                           route, elapsed * 1000, "executemany" if executemany else "execute", count, statement)
+
+    def render(self):
+        lines = []
+        for collector in self.collectors:
+            lines.extend(collector.render())
+        return "\n".join(lines) + "\n"
+
+    def render_response(self):
+        return Response(self.render(), mimetype="text/plain; version=0.0.4")
+
+
+metrics = Metrics()
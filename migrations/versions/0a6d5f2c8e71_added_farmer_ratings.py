@@ -0,0 +1,55 @@
+"""added farmer ratings
+
+Revision ID: 0a6d5f2c8e71
+Revises: f31b8e6a20c9
+Create Date: 2025-05-26 16:03:29.551846
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0a6d5f2c8e71'
+down_revision: Union[str, None] = 'f31b8e6a20c9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('farmer_ratings',
+    sa.Column('farmer_id', sa.Integer(), nullable=False),
+    sa.Column('rating_count', sa.Integer(), nullable=False),
+    sa.Column('rating_sum', sa.Integer(), nullable=False),
+    sa.Column('rating_avg', sa.Numeric(precision=3, scale=2), nullable=False),
+    sa.Column('rating_1', sa.Integer(), nullable=False),
+    sa.Column('rating_2', sa.Integer(), nullable=False),
+    sa.Column('rating_3', sa.Integer(), nullable=False),
+    sa.Column('rating_4', sa.Integer(), nullable=False),
+    sa.Column('rating_5', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.TIMESTAMP(), nullable=True),
+    sa.ForeignKeyConstraint(['farmer_id'], ['farmers.id'], ),
+    sa.PrimaryKeyConstraint('farmer_id')
+    )
+    op.create_index('ix_farmer_ratings_avg', 'farmer_ratings', [sa.text('rating_avg DESC'), 'farmer_id'])
+
+    # Seed from the reviews written so far
+    op.execute("""
+        INSERT INTO farmer_ratings (farmer_id, rating_count, rating_sum, rating_avg,
+                                    rating_1, rating_2, rating_3, rating_4, rating_5, updated_at)
+        SELECT farmer_id, count(*), sum(rating), avg(rating),
+               count(*) FILTER (WHERE rating = 1), count(*) FILTER (WHERE rating = 2),
+               count(*) FILTER (WHERE rating = 3), count(*) FILTER (WHERE rating = 4),
+               count(*) FILTER (WHERE rating = 5), now()
+        FROM reviews
+        GROUP BY farmer_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_farmer_ratings_avg', table_name='farmer_ratings')
+    op.drop_table('farmer_ratings')
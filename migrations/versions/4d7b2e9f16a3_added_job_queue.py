@@ -0,0 +1,57 @@
+"""added job queue
+
+Revision ID: 4d7b2e9f16a3
+Revises: c58f1e7a93d2
+Create Date: 2025-06-16 14:38:05.217934
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4d7b2e9f16a3'
+down_revision: Union[str, None] = 'c58f1e7a93d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('jobs',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('queue', sa.String(length=50), nullable=False),
+    sa.Column('task', sa.String(length=100), nullable=False),
+    sa.Column('payload', sa.JSON(), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('max_attempts', sa.Integer(), nullable=False),
+    sa.Column('run_at', sa.TIMESTAMP(), nullable=False),
+    sa.Column('locked_by', sa.String(length=100), nullable=True),
+    sa.Column('started_at', sa.TIMESTAMP(), nullable=True),
+    sa.Column('finished_at', sa.TIMESTAMP(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.TIMESTAMP(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_jobs_ready', 'jobs', ['queue', 'run_at', 'id'],
+                    postgresql_where=sa.text("status = 'queued'"))
+    op.create_index('ix_jobs_running', 'jobs', ['queue', 'started_at'],
+                    postgresql_where=sa.text("status = 'running'"))
+    op.create_index('ix_jobs_finished_at', 'jobs', ['finished_at'])
+    op.create_table('job_schedules',
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('next_run_at', sa.TIMESTAMP(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('job_schedules')
+    op.drop_index('ix_jobs_finished_at', table_name='jobs')
+    op.drop_index('ix_jobs_running', table_name='jobs')
+    op.drop_index('ix_jobs_ready', table_name='jobs')
+    op.drop_table('jobs')
@@ -0,0 +1,50 @@
+"""added query indexes
+
+Revision ID: 5c8e2a91d4b7
+Revises: a36584d62f0c
+Create Date: 2025-04-22 09:14:37.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c8e2a91d4b7'
+down_revision: Union[str, None] = 'a36584d62f0c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # GET /api/produce, newest first with keyset on (created_at, id)
+    op.create_index('ix_produce_created_at_id', 'produce',
+                    [sa.text('created_at DESC'), sa.text('id DESC')])
+
+    # GET /api/produce?category=... and SELECT DISTINCT category
+    op.create_index('ix_produce_category_created_at_id', 'produce',
+                    ['category', sa.text('created_at DESC'), sa.text('id DESC')])
+
+    # GET /api/orders, a vendor's orders newest first
+    op.create_index('ix_orders_vendor_created_at_id', 'orders',
+                    ['vendor_id', sa.text('created_at DESC'), sa.text('id DESC')])
+
+    # GET /api/orders?status=..., compared as lower(order_status)
+    op.create_index('ix_orders_vendor_status_created_at', 'orders',
+                    ['vendor_id', sa.text('lower(order_status)'), sa.text('created_at DESC')])
+
+    # Sweeping stale pending orders only needs the pending ones
+    op.create_index('ix_orders_pending_created_at', 'orders', ['created_at'],
+                    postgresql_where=sa.text("order_status = 'Pending'"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_orders_pending_created_at', table_name='orders')
+    op.drop_index('ix_orders_vendor_status_created_at', table_name='orders')
+    op.drop_index('ix_orders_vendor_created_at_id', table_name='orders')
+    op.drop_index('ix_produce_category_created_at_id', table_name='produce')
+    op.drop_index('ix_produce_created_at_id', table_name='produce')
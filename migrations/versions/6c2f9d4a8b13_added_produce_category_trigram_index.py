@@ -0,0 +1,30 @@
+"""added produce category trigram index
+
+Revision ID: 6c2f9d4a8b13
+Revises: e4a7c2d91b58
+Create Date: 2025-07-16 14:08:52.910274
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6c2f9d4a8b13'
+down_revision: Union[str, None] = 'e4a7c2d91b58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # The search's typo fallback matches category as well as name
+    op.create_index('ix_produce_category_trgm', 'produce', ['category'], postgresql_using='gin',
+                    postgresql_ops={'category': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_produce_category_trgm', table_name='produce')
@@ -0,0 +1,57 @@
+"""reconciled payments and callback inbox
+
+Revision ID: 8d41f07b2c63
+Revises: 5c8e2a91d4b7
+Create Date: 2025-04-28 15:32:08.904113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d41f07b2c63'
+down_revision: Union[str, None] = '5c8e2a91d4b7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Payments are initiated per farmer, not always against an order
+    op.alter_column('payments', 'order_id',
+               existing_type=sa.INTEGER(),
+               nullable=True)
+    op.add_column('payments', sa.Column('farmer_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('payments_farmer_id_fkey', 'payments', 'farmers', ['farmer_id'], ['id'])
+    op.add_column('payments', sa.Column('merchant_request_id', sa.String(length=100), nullable=True))
+    op.create_index('ix_payments_merchant_request_id', 'payments', ['merchant_request_id'], unique=True)
+
+    op.create_table('mpesa_callbacks',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('merchant_request_id', sa.String(length=100), nullable=False),
+    sa.Column('result_code', sa.Integer(), nullable=True),
+    sa.Column('mpesa_code', sa.String(length=50), nullable=True),
+    sa.Column('payload', sa.JSON(), nullable=True),
+    sa.Column('processed_at', sa.TIMESTAMP(), nullable=True),
+    sa.Column('created_at', sa.TIMESTAMP(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('merchant_request_id')
+    )
+    op.create_index('ix_mpesa_callbacks_unprocessed', 'mpesa_callbacks', ['id'],
+                    postgresql_where=sa.text("processed_at IS NULL"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_mpesa_callbacks_unprocessed', table_name='mpesa_callbacks')
+    op.drop_table('mpesa_callbacks')
+    op.drop_index('ix_payments_merchant_request_id', table_name='payments')
+    op.drop_column('payments', 'merchant_request_id')
+    op.drop_constraint('payments_farmer_id_fkey', 'payments', type_='foreignkey')
+    op.drop_column('payments', 'farmer_id')
+    op.alter_column('payments', 'order_id',
+               existing_type=sa.INTEGER(),
+               nullable=False)
@@ -0,0 +1,74 @@
+"""added change notifications
+
+Revision ID: 9e3f6b1d2a47
+Revises: 4d7b2e9f16a3
+Create Date: 2025-06-23 10:12:44.506128
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e3f6b1d2a47'
+down_revision: Union[str, None] = '4d7b2e9f16a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # NOTIFY is delivered on commit, so listeners only ever hear about committed rows
+    op.execute("""
+        CREATE FUNCTION orders_notify() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('sokohub_orders', json_build_object(
+                'id', NEW.id,
+                'vendor_id', NEW.vendor_id,
+                'farmer_id', NEW.farmer_id,
+                'order_status', NEW.order_status,
+                'deposit_paid', NEW.deposit_paid)::text);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER orders_notify_insert
+        AFTER INSERT ON orders
+        FOR EACH ROW EXECUTE FUNCTION orders_notify()
+    """)
+    op.execute("""
+        CREATE TRIGGER orders_notify_update
+        AFTER UPDATE OF order_status, deposit_paid ON orders
+        FOR EACH ROW WHEN (OLD.order_status IS DISTINCT FROM NEW.order_status
+                           OR OLD.deposit_paid IS DISTINCT FROM NEW.deposit_paid)
+        EXECUTE FUNCTION orders_notify()
+    """)
+
+    op.execute("""
+        CREATE FUNCTION produce_notify() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('sokohub_produce', json_build_object(
+                'id', NEW.id,
+                'quantity', NEW.quantity)::text);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER produce_notify_update
+        AFTER UPDATE OF quantity ON produce
+        FOR EACH ROW WHEN (OLD.quantity IS DISTINCT FROM NEW.quantity)
+        EXECUTE FUNCTION produce_notify()
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER produce_notify_update ON produce")
+    op.execute("DROP FUNCTION produce_notify()")
+    op.execute("DROP TRIGGER orders_notify_update ON orders")
+    op.execute("DROP TRIGGER orders_notify_insert ON orders")
+    op.execute("DROP FUNCTION orders_notify()")
@@ -0,0 +1,31 @@
+"""added stock reservation to orders
+
+Revision ID: b27e6c0f9a14
+Revises: 8d41f07b2c63
+Create Date: 2025-05-06 10:21:53.117620
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b27e6c0f9a14'
+down_revision: Union[str, None] = '8d41f07b2c63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('orders', sa.Column('reserved_until', sa.TIMESTAMP(), nullable=True))
+    op.create_index('ix_orders_pending_reserved_until', 'orders', ['reserved_until'],
+                    postgresql_where=sa.text("order_status = 'Pending'"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_orders_pending_reserved_until', table_name='orders')
+    op.drop_column('orders', 'reserved_until')
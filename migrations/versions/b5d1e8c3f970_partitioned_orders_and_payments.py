@@ -0,0 +1,140 @@
+"""partitioned orders and payments
+
+Revision ID: b5d1e8c3f970
+Revises: 9e3f6b1d2a47
+Create Date: 2025-06-30 09:21:37.640512
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5d1e8c3f970'
+down_revision: Union[str, None] = '9e3f6b1d2a47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONTHS_AHEAD = 3  # flask maintain-partitions keeps this many months ready from here on
+
+ORDER_INDEXES = """
+    CREATE INDEX ix_orders_vendor_created_at_id ON orders (vendor_id, created_at DESC, id DESC);
+    CREATE INDEX ix_orders_vendor_status_created_at ON orders (vendor_id, lower(order_status), created_at DESC);
+    CREATE INDEX ix_orders_pending_created_at ON orders (created_at) WHERE order_status = 'Pending';
+    CREATE INDEX ix_orders_pending_reserved_until ON orders (reserved_until) WHERE order_status = 'Pending';
+"""
+
+ORDER_TRIGGERS = """
+    CREATE TRIGGER orders_notify_insert
+    AFTER INSERT ON orders
+    FOR EACH ROW EXECUTE FUNCTION orders_notify();
+    CREATE TRIGGER orders_notify_update
+    AFTER UPDATE OF order_status, deposit_paid ON orders
+    FOR EACH ROW WHEN (OLD.order_status IS DISTINCT FROM NEW.order_status
+                       OR OLD.deposit_paid IS DISTINCT FROM NEW.deposit_paid)
+    EXECUTE FUNCTION orders_notify();
+"""
+
+# payments.order_id can't reference orders' (id, created_at) key, so inserts and updates
+# check it here instead. Deleting an order isn't checked: orders only go when a month is
+# archived, and their payments then point at the archive, which the old key would have refused.
+PAYMENT_ORDER_CHECK = """
+    CREATE FUNCTION payments_order_exists() RETURNS trigger AS $$
+    BEGIN
+        IF NEW.order_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM orders WHERE id = NEW.order_id) THEN
+            RAISE EXCEPTION 'order % does not exist', NEW.order_id USING ERRCODE = 'foreign_key_violation';
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    CREATE TRIGGER payments_order_exists
+    BEFORE INSERT OR UPDATE OF order_id ON payments
+    FOR EACH ROW EXECUTE FUNCTION payments_order_exists();
+"""
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def rebuild(table, partitioned):
+    # Copy table into a new one of the other kind and swap it in under the same name,
+    # keeping the id sequence. Keys, indexes and triggers are added after the copy.
+    op.execute(f"UPDATE {table} SET created_at = now() AT TIME ZONE 'utc' WHERE created_at IS NULL")
+    if partitioned:
+        op.execute(f"CREATE TABLE {table}_new (LIKE {table} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)")
+        op.execute(f"ALTER TABLE {table}_new ALTER COLUMN created_at SET NOT NULL")
+
+        oldest = op.get_bind().execute(sa.text(f"SELECT min(created_at) FROM {table}")).scalar()
+        today = date.today()
+        month = date((oldest or today).year, (oldest or today).month, 1)
+        last = add_months(date(today.year, today.month, 1), MONTHS_AHEAD)
+        while month <= last:
+            op.execute(f"CREATE TABLE {table}_{month:%Y_%m} PARTITION OF {table}_new "
+                       f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')")
+            month = add_months(month, 1)
+        # Catches rows no monthly partition covers yet, rather than failing the insert
+        op.execute(f"CREATE TABLE {table}_default PARTITION OF {table}_new DEFAULT")
+    else:
+        op.execute(f"CREATE TABLE {table}_new (LIKE {table} INCLUDING DEFAULTS)")
+
+    op.execute(f"INSERT INTO {table}_new SELECT * FROM {table}")
+    op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY NONE")
+    op.execute(f"DROP TABLE {table}")
+    op.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Maintenance window work: both tables are copied whole, plan for it on big tables.
+    # A partitioned table's keys must include created_at, so payments.order_id is checked
+    # by a trigger and merchant_request_id is unique per created_at rather than outright.
+    op.drop_constraint('payments_order_id_fkey', 'payments', type_='foreignkey')
+
+    rebuild('orders', partitioned=True)
+    op.execute("ALTER TABLE orders ADD CONSTRAINT orders_pkey PRIMARY KEY (id, created_at)")
+    op.create_foreign_key('orders_vendor_id_fkey', 'orders', 'vendors', ['vendor_id'], ['id'])
+    op.create_foreign_key('orders_farmer_id_fkey', 'orders', 'farmers', ['farmer_id'], ['id'])
+    op.create_foreign_key('orders_produce_id_fkey', 'orders', 'produce', ['produce_id'], ['id'])
+    op.execute(ORDER_INDEXES)
+    op.execute(ORDER_TRIGGERS)
+
+    rebuild('payments', partitioned=True)
+    op.execute("ALTER TABLE payments ADD CONSTRAINT payments_pkey PRIMARY KEY (id, created_at)")
+    op.create_foreign_key('payments_vendor_id_fkey', 'payments', 'vendors', ['vendor_id'], ['id'])
+    op.create_foreign_key('payments_farmer_id_fkey', 'payments', 'farmers', ['farmer_id'], ['id'])
+    # Still the callback lookup index, it leads with merchant_request_id
+    op.create_index('ix_payments_merchant_request_id', 'payments', ['merchant_request_id', 'created_at'], unique=True)
+    op.execute(PAYMENT_ORDER_CHECK)
+
+    op.execute("ANALYZE orders")
+    op.execute("ANALYZE payments")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Only what is still attached comes back, archived months stay in their files
+    op.execute("DROP TRIGGER payments_order_exists ON payments")
+    op.execute("DROP FUNCTION payments_order_exists()")
+    rebuild('payments', partitioned=False)
+    op.execute("ALTER TABLE payments ADD CONSTRAINT payments_pkey PRIMARY KEY (id)")
+    op.create_foreign_key('payments_vendor_id_fkey', 'payments', 'vendors', ['vendor_id'], ['id'])
+    op.create_foreign_key('payments_farmer_id_fkey', 'payments', 'farmers', ['farmer_id'], ['id'])
+    op.create_index('ix_payments_merchant_request_id', 'payments', ['merchant_request_id'], unique=True)
+
+    rebuild('orders', partitioned=False)
+    op.execute("ALTER TABLE orders ADD CONSTRAINT orders_pkey PRIMARY KEY (id)")
+    op.create_foreign_key('orders_vendor_id_fkey', 'orders', 'vendors', ['vendor_id'], ['id'])
+    op.create_foreign_key('orders_farmer_id_fkey', 'orders', 'farmers', ['farmer_id'], ['id'])
+    op.create_foreign_key('orders_produce_id_fkey', 'orders', 'produce', ['produce_id'], ['id'])
+    op.execute(ORDER_INDEXES)
+    op.execute(ORDER_TRIGGERS)
+    op.alter_column('orders', 'created_at', existing_type=sa.TIMESTAMP(), nullable=True)
+    op.alter_column('payments', 'created_at', existing_type=sa.TIMESTAMP(), nullable=True)
+
+    op.create_foreign_key('payments_order_id_fkey', 'payments', 'orders', ['order_id'], ['id'])
@@ -0,0 +1,51 @@
+"""added farmer coordinates
+
+Revision ID: c58f1e7a93d2
+Revises: 7e2c94b1a5d0
+Create Date: 2025-06-09 10:21:47.903516
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c58f1e7a93d2'
+down_revision: Union[str, None] = '7e2c94b1a5d0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def postgis_available() -> bool:
+    return op.get_bind().execute(
+        sa.text("SELECT 1 FROM pg_available_extensions WHERE name = 'postgis'")
+    ).first() is not None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('farmers', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('farmers', sa.Column('longitude', sa.Float(), nullable=True))
+    op.add_column('farmers', sa.Column('geohash', sa.String(length=12, collation='C'), nullable=True))
+    op.create_index('ix_farmers_geohash', 'farmers', ['geohash'])
+    op.create_index('ix_produce_farmer_id', 'produce', ['farmer_id'])
+
+    # Without PostGIS the API answers nearby queries from the geohash index alone
+    if postgis_available():
+        op.execute("CREATE EXTENSION IF NOT EXISTS postgis")
+        op.execute("""
+            CREATE INDEX ix_farmers_geography ON farmers
+            USING gist (geography(ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)))
+        """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP INDEX IF EXISTS ix_farmers_geography")
+    op.drop_index('ix_produce_farmer_id', table_name='produce')
+    op.drop_index('ix_farmers_geohash', table_name='farmers')
+    op.drop_column('farmers', 'geohash')
+    op.drop_column('farmers', 'longitude')
+    op.drop_column('farmers', 'latitude')
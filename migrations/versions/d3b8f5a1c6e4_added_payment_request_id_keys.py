@@ -0,0 +1,72 @@
+"""added payment request id keys
+
+Revision ID: d3b8f5a1c6e4
+Revises: 6c2f9d4a8b13
+Create Date: 2025-07-21 10:17:43.508216
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3b8f5a1c6e4'
+down_revision: Union[str, None] = '6c2f9d4a8b13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# A unique index on partitioned payments has to include created_at, so each MerchantRequestID
+# is claimed in this plain table instead, whose primary key makes a second claim fail
+PAYMENT_REQUEST_KEYS = """
+    CREATE FUNCTION payments_request_id_key() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP <> 'INSERT' AND OLD.merchant_request_id IS NOT NULL THEN
+            IF TG_OP = 'UPDATE' AND OLD.merchant_request_id IS NOT DISTINCT FROM NEW.merchant_request_id THEN
+                RETURN NULL;
+            END IF;
+            DELETE FROM payment_request_ids
+            WHERE merchant_request_id = OLD.merchant_request_id AND payment_id = OLD.id;
+        END IF;
+        IF TG_OP <> 'DELETE' AND NEW.merchant_request_id IS NOT NULL THEN
+            INSERT INTO payment_request_ids (merchant_request_id, payment_id, created_at)
+            VALUES (NEW.merchant_request_id, NEW.id, NEW.created_at);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    CREATE TRIGGER payments_request_id_key
+    AFTER INSERT OR UPDATE OF merchant_request_id OR DELETE ON payments
+    FOR EACH ROW EXECUTE FUNCTION payments_request_id_key();
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('payment_request_ids',
+    sa.Column('merchant_request_id', sa.String(length=100), nullable=False),
+    sa.Column('payment_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(), nullable=False),
+    sa.PrimaryKeyConstraint('merchant_request_id')
+    )
+    # Ids repeated while only (merchant_request_id, created_at) was unique keep their first payment
+    op.execute("""
+        INSERT INTO payment_request_ids (merchant_request_id, payment_id, created_at)
+        SELECT DISTINCT ON (merchant_request_id) merchant_request_id, id, created_at
+        FROM payments WHERE merchant_request_id IS NOT NULL
+        ORDER BY merchant_request_id, created_at, id
+    """)
+    op.execute(PAYMENT_REQUEST_KEYS)
+    # Only the callback lookup index now, uniqueness is the key table's job
+    op.drop_index('ix_payments_merchant_request_id', table_name='payments')
+    op.create_index('ix_payments_merchant_request_id', 'payments', ['merchant_request_id', 'created_at'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_payments_merchant_request_id', table_name='payments')
+    op.create_index('ix_payments_merchant_request_id', 'payments', ['merchant_request_id', 'created_at'], unique=True)
+    op.execute("DROP TRIGGER payments_request_id_key ON payments")
+    op.execute("DROP FUNCTION payments_request_id_key()")
+    op.drop_table('payment_request_ids')
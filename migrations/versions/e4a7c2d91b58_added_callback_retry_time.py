@@ -0,0 +1,29 @@
+"""added callback retry time
+
+Revision ID: e4a7c2d91b58
+Revises: b5d1e8c3f970
+Create Date: 2025-07-14 09:41:27.318540
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4a7c2d91b58'
+down_revision: Union[str, None] = 'b5d1e8c3f970'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Callbacks that arrive before their payment is recorded wait here instead of being dropped
+    op.add_column('mpesa_callbacks', sa.Column('retry_at', sa.TIMESTAMP(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('mpesa_callbacks', 'retry_at')
@@ -0,0 +1,80 @@
+"""added produce search vector
+
+Revision ID: f31b8e6a20c9
+Revises: e4a9c13d7f58
+Create Date: 2025-05-19 11:45:12.284377
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f31b8e6a20c9'
+down_revision: Union[str, None] = 'e4a9c13d7f58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    op.add_column('produce', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+
+    # Weighted like the API ranks it: name, then category, description, farmer location
+    op.execute("""
+        CREATE FUNCTION produce_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector :=
+                setweight(to_tsvector('simple', coalesce(NEW.name, '')), 'A') ||
+                setweight(to_tsvector('simple', coalesce(NEW.category, '')), 'B') ||
+                setweight(to_tsvector('simple', coalesce(NEW.description, '')), 'C') ||
+                setweight(to_tsvector('simple', coalesce(
+                    (SELECT location FROM farmers WHERE id = NEW.farmer_id), '')), 'D');
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER produce_search_vector
+        BEFORE INSERT OR UPDATE OF name, category, description, farmer_id ON produce
+        FOR EACH ROW EXECUTE FUNCTION produce_search_vector_update()
+    """)
+
+    # A farmer moving re-indexes their listings through the trigger above
+    op.execute("""
+        CREATE FUNCTION farmer_location_search_update() RETURNS trigger AS $$
+        BEGIN
+            UPDATE produce SET farmer_id = farmer_id WHERE farmer_id = NEW.id;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER farmer_location_search
+        AFTER UPDATE OF location ON farmers
+        FOR EACH ROW WHEN (OLD.location IS DISTINCT FROM NEW.location)
+        EXECUTE FUNCTION farmer_location_search_update()
+    """)
+
+    # Backfill existing rows
+    op.execute("UPDATE produce SET farmer_id = farmer_id")
+
+    op.create_index('ix_produce_search_vector', 'produce', ['search_vector'], postgresql_using='gin')
+    op.create_index('ix_produce_name_trgm', 'produce', ['name'], postgresql_using='gin',
+                    postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_produce_name_trgm', table_name='produce')
+    op.drop_index('ix_produce_search_vector', table_name='produce')
+    op.execute("DROP TRIGGER farmer_location_search ON farmers")
+    op.execute("DROP FUNCTION farmer_location_search_update()")
+    op.execute("DROP TRIGGER produce_search_vector ON produce")
+    op.execute("DROP FUNCTION produce_search_vector_update()")
+    op.drop_column('produce', 'search_vector')
@@ -1,7 +1,10 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from datetime import datetime
+from replicas import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 class Vendor(db.Model):
     __tablename__ = 'vendors'
@@ -23,10 +26,15 @@ class Farmer(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(100), unique=True, nullable=False)
+    password = db.Column(db.String(255))
     phone = db.Column(db.String(15), nullable=False)
     mpesa = db.Column(db.String(15), nullable=False)
     whatsapp_link = db.Column(db.String(255))
     location = db.Column(db.String(100))
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    # Prefix ranges on this find nearby farms, byte-order collation keeps them contiguous
+    geohash = db.Column(db.String(12).with_variant(db.String(12, collation='C'), 'postgresql'))
     kephis_certified = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.TIMESTAMP, default=datetime.utcnow)
 
@@ -34,6 +42,10 @@ class Farmer(db.Model):
     orders = db.relationship('Order', backref='farmer', lazy=True)
     reviews = db.relationship('Review', backref='farmer', lazy=True)
 
+    __table_args__ = (
+        db.Index('ix_farmers_geohash', geohash),
+    )
+
 
 class Produce(db.Model):  # Changed from Product to Produce
     __tablename__ = 'produce'
@@ -46,12 +58,21 @@ class Produce(db.Model):  # Changed from Product to Produce
     quality = db.Column(db.String(50), nullable=False)  # Added quality field
     farmer_id = db.Column(db.Integer, db.ForeignKey('farmers.id'), nullable=False)
     created_at = db.Column(db.TIMESTAMP, default=datetime.utcnow)
+    # Filled by a Postgres trigger from name, category, description and the farmer's location
+    search_vector = db.deferred(db.Column(db.Text().with_variant(TSVECTOR(), 'postgresql')))
 
     orders = db.relationship('Order', backref='produce', lazy=True)  # Linked to orders
 
+    __table_args__ = (
+        db.Index('ix_produce_created_at_id', created_at.desc(), id.desc()),
+        db.Index('ix_produce_category_created_at_id', category, created_at.desc(), id.desc()),
+        db.Index('ix_produce_farmer_id', farmer_id),
+    )
+
 
-class Order(db.Model):
+class Order(db.Model):  # Partitioned by month on created_at in Postgres, see partitions.py
     __tablename__ = 'orders'
+    # The table's key is (id, created_at) there, id alone stays unique through its sequence
     id = db.Column(db.Integer, primary_key=True)
     vendor_id = db.Column(db.Integer, db.ForeignKey('vendors.id'), nullable=False)
     farmer_id = db.Column(db.Integer, db.ForeignKey('farmers.id'), nullable=False)
@@ -61,19 +82,69 @@ class Order(db.Model):
     deposit_paid = db.Column(db.Boolean, default=False)
     order_status = db.Column(db.String(20), default="Pending")  # Default "Pending"
     mpesa_code = db.Column(db.String(50))
-    created_at = db.Column(db.TIMESTAMP, default=datetime.utcnow)
+    reserved_until = db.Column(db.TIMESTAMP)  # Stock goes back to the produce if still unpaid by then
+    created_at = db.Column(db.TIMESTAMP, nullable=False, default=datetime.utcnow)  # Partition key
+
+    __table_args__ = (
+        db.Index('ix_orders_vendor_created_at_id', vendor_id, created_at.desc(), id.desc()),
+        db.Index('ix_orders_vendor_status_created_at', vendor_id, db.func.lower(order_status), created_at.desc()),
+        db.Index('ix_orders_pending_created_at', created_at,
+                 postgresql_where=db.text("order_status = 'Pending'")),
+        db.Index('ix_orders_pending_reserved_until', reserved_until,
+                 postgresql_where=db.text("order_status = 'Pending'")),
+    )
 
 
-class Payment(db.Model):
+class Payment(db.Model):  # Partitioned by month on created_at in Postgres, like orders
     __tablename__ = 'payments'
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
+    order_id = db.Column(db.Integer)  # Checked by a trigger in Postgres, orders' key includes created_at
     vendor_id = db.Column(db.Integer, db.ForeignKey('vendors.id'), nullable=False)
+    farmer_id = db.Column(db.Integer, db.ForeignKey('farmers.id'))
     amount = db.Column(db.Numeric(10,2), nullable=False)
+    # From the STK push response, unique per Safaricom. A partitioned index has to include
+    # created_at, so in Postgres a trigger claims each one in payment_request_ids instead
+    merchant_request_id = db.Column(db.String(100))
     mpesa_code = db.Column(db.String(50))
     payment_status = db.Column(db.String(20))
+    created_at = db.Column(db.TIMESTAMP, nullable=False, default=datetime.utcnow)  # Partition key
+
+    __table_args__ = (
+        # Callback lookups also bound created_at, which keeps them to the recent partitions
+        db.Index('ix_payments_merchant_request_id', merchant_request_id, created_at),
+    )
+
+
+# SQLite's payments aren't partitioned, a plain unique index does what the key table does in Postgres
+event.listen(Payment.__table__, "after_create", DDL(
+    "CREATE UNIQUE INDEX uq_payments_merchant_request_id ON payments (merchant_request_id)"
+).execute_if(dialect="sqlite"))
+
+
+class PaymentRequestId(db.Model):  # One row per MerchantRequestID, kept by a trigger on payments in Postgres
+    __tablename__ = 'payment_request_ids'
+    merchant_request_id = db.Column(db.String(100), primary_key=True)
+    payment_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.TIMESTAMP, nullable=False)  # The payment's, locating its partition
+
+
+class MpesaCallback(db.Model):  # Append-only inbox, applied to payments in batches
+    __tablename__ = 'mpesa_callbacks'
+    id = db.Column(db.Integer, primary_key=True)
+    merchant_request_id = db.Column(db.String(100), unique=True, nullable=False)  # Safaricom retries collapse here
+    result_code = db.Column(db.Integer)
+    mpesa_code = db.Column(db.String(50))
+    payload = db.Column(db.JSON)
+    processed_at = db.Column(db.TIMESTAMP)
+    retry_at = db.Column(db.TIMESTAMP)  # Set while the callback's payment hasn't been recorded yet
     created_at = db.Column(db.TIMESTAMP, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_mpesa_callbacks_unprocessed', id,
+                 postgresql_where=db.text("processed_at IS NULL"),
+                 sqlite_where=db.text("processed_at IS NULL")),
+    )
+
 
 class Review(db.Model):
     __tablename__ = 'reviews'
@@ -83,3 +154,82 @@ class Review(db.Model):
     rating = db.Column(db.Integer, nullable=False)
     comment = db.Column(db.Text)
     created_at = db.Column(db.TIMESTAMP, default=datetime.utcnow)
+
+
+class FarmerRating(db.Model):  # Kept in step with reviews, read instead of aggregating them
+    __tablename__ = 'farmer_ratings'
+    farmer_id = db.Column(db.Integer, db.ForeignKey('farmers.id'), primary_key=True)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    rating_avg = db.Column(db.Numeric(3,2), nullable=False, default=0)
+    rating_1 = db.Column(db.Integer, nullable=False, default=0)
+    rating_2 = db.Column(db.Integer, nullable=False, default=0)
+    rating_3 = db.Column(db.Integer, nullable=False, default=0)
+    rating_4 = db.Column(db.Integer, nullable=False, default=0)
+    rating_5 = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.TIMESTAMP, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_farmer_ratings_avg', rating_avg.desc(), farmer_id),
+    )
+
+
+class DailySales(db.Model):  # Order rollup, one row per day, farmer and category
+    __tablename__ = 'daily_sales'
+    day = db.Column(db.Date, primary_key=True)
+    farmer_id = db.Column(db.Integer, primary_key=True)
+    category = db.Column(db.String(100), primary_key=True)  # '' when the produce has none
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    gmv = db.Column(db.Numeric(14,2), nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_daily_sales_farmer_day', farmer_id, day),
+    )
+
+
+class DailyPayments(db.Model):  # Payment rollup, one row per day and status
+    __tablename__ = 'daily_payments'
+    day = db.Column(db.Date, primary_key=True)
+    payment_status = db.Column(db.String(20), primary_key=True)
+    payment_count = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Numeric(14,2), nullable=False, default=0)
+
+
+class AnalyticsWatermark(db.Model):  # How far each rollup has been refreshed
+    __tablename__ = 'analytics_watermarks'
+    name = db.Column(db.String(50), primary_key=True)
+    high_water = db.Column(db.TIMESTAMP, nullable=False)
+
+
+class Job(db.Model):  # Background work, claimed by workers with FOR UPDATE SKIP LOCKED
+    __tablename__ = 'jobs'
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    queue = db.Column(db.String(50), nullable=False)
+    task = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.JSON)
+    status = db.Column(db.String(20), nullable=False, default="queued")  # queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.TIMESTAMP, nullable=False, default=datetime.utcnow)  # Not picked up before this
+    locked_by = db.Column(db.String(100))
+    started_at = db.Column(db.TIMESTAMP)
+    finished_at = db.Column(db.TIMESTAMP)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.TIMESTAMP, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_jobs_ready', queue, run_at, id,
+                 postgresql_where=db.text("status = 'queued'"),
+                 sqlite_where=db.text("status = 'queued'")),
+        db.Index('ix_jobs_running', queue, started_at,
+                 postgresql_where=db.text("status = 'running'"),
+                 sqlite_where=db.text("status = 'running'")),
+        db.Index('ix_jobs_finished_at', finished_at),
+    )
+
+
+class JobSchedule(db.Model):  # When each periodic task is next due
+    __tablename__ = 'job_schedules'
+    name = db.Column(db.String(100), primary_key=True)
+    next_run_at = db.Column(db.TIMESTAMP, nullable=False)
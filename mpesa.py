@@ -1,52 +1,254 @@
-
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3.exceptions import NewConnectionError
 from datetime import datetime
+import asyncio
 import base64
 import os
+import random
+import threading
+import time
 
 # Replace these with your actual Daraja credentials
 CONSUMER_KEY = os.getenv("fZ6gwtAISRCnrfFAlhFZHg2lzFINzE9brKvS012B8NrANz7c")
 CONSUMER_SECRET = os.getenv("Rt0pF1mcv2ie1fS5dQmACdFqlbHlOiqdPIVFEPNM8ntOKeji5RBn9HQXPt9AwJiZ")
 BUSINESS_SHORTCODE = "174379"  #  test shortcode
-PASSKEY = os.getenv("bfb279f9aa9bdbcf158e97dd71a467cd2e0c893059b10f78e6b72ada1ed2c919")  
+PASSKEY = os.getenv("bfb279f9aa9bdbcf158e97dd71a467cd2e0c893059b10f78e6b72ada1ed2c919")
 
-# URLs
-BASE_URL = "https://sandbox.safaricom.co.ke"
-TOKEN_URL = f"{BASE_URL}/oauth/v1/generate?grant_type=client_credentials"
-STK_URL = f"{BASE_URL}/mpesa/stkpush/v1/processrequest"
+# URLs, DARAJA_BASE_URL can point at a local fake Daraja server
+BASE_URL = os.getenv("DARAJA_BASE_URL", "https://sandbox.safaricom.co.ke")
+TOKEN_PATH = "/oauth/v1/generate?grant_type=client_credentials"
+STK_PATH = "/mpesa/stkpush/v1/processrequest"
 CALLBACK_URL = "https://yourdomain.com/api/mpesa/callback"  # replace with your actual backend callback
 
+# Refresh the token this many seconds before Daraja says it expires
+TOKEN_REFRESH_MARGIN = 60
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (3.05, 15)
+# Daraja turned these away without acting on them, so even the STK push is retried. A 502 or
+# 504 may come after the gateway passed the push on, only idempotent calls retry other 5xx.
+REJECTED_STATUSES = {429, 503}
+
+
+class DarajaError(Exception):
+    # maybe_sent: the STK push may have reached Daraja, sending it again could prompt the buyer twice
+    def __init__(self, message, maybe_sent=False):
+        super().__init__(message)
+        self.maybe_sent = maybe_sent
+
+
+def connect_failed(exc):
+    # requests raises ConnectionError both when no connection was made and when one dropped mid-request
+    reason = getattr(exc.args[0], "reason", None) if exc.args else None
+    return isinstance(exc, requests.ConnectTimeout) or isinstance(reason, NewConnectionError)
+
+
+class BaseDarajaClient:
+    # Settings, token bookkeeping and the STK payload, the subclasses own the HTTP side
+    def __init__(self, base_url=BASE_URL, consumer_key=CONSUMER_KEY, consumer_secret=CONSUMER_SECRET,
+                 shortcode=BUSINESS_SHORTCODE, passkey=PASSKEY, callback_url=CALLBACK_URL,
+                 timeout=DEFAULT_TIMEOUT, retries=3, backoff=0.5):
+        self.base_url = base_url.rstrip("/")
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.shortcode = shortcode
+        self.passkey = passkey
+        self.callback_url = callback_url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._token = None
+        self._token_expires_at = 0
+
+    def retryable(self, status_code, idempotent):
+        return status_code in REJECTED_STATUSES or (idempotent and status_code >= 500)
+
+    def read_json(self, response, idempotent):
+        try:
+            return response.json()
+        except ValueError as exc:
+            # e.g. an HTML error page from a proxy in front of Daraja
+            raise DarajaError(
+                f"Daraja answered {response.status_code} without JSON",
+                maybe_sent=not idempotent and response.status_code not in REJECTED_STATUSES,
+            ) from exc
+
+    def retry_delay(self, attempt):
+        # Full jitter so a burst of failing workers doesn't retry in lockstep
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    def cached_token(self):
+        if self._token and time.monotonic() < self._token_expires_at:
+            return self._token
+        return None
+
+    def store_token(self, data):
+        if "access_token" not in data:
+            raise DarajaError(f"Token request failed: {data}")
+        expires_in = int(data.get("expires_in", 3599))
+        self._token = data["access_token"]
+        self._token_expires_at = time.monotonic() + max(expires_in - TOKEN_REFRESH_MARGIN, 0)
+        return self._token
+
+    def stk_payload(self, phone_number, amount, farmer_number):
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        password_str = f"{self.shortcode}{self.passkey}{timestamp}"
+        password = base64.b64encode(password_str.encode()).decode()
+
+        return {
+            "BusinessShortCode": self.shortcode,
+            "Password": password,
+            "Timestamp": timestamp,
+            "TransactionType": "CustomerPayBillOnline",  # Still works with Pochi
+            "Amount": amount,
+            "PartyA": phone_number,  # vendor phone number
+            "PartyB": farmer_number,  # farmer's Pochi number (MSISDN format)
+            "PhoneNumber": phone_number,
+            "CallBackURL": self.callback_url,
+            "AccountReference": "SokoHubOrder",
+            "TransactionDesc": "Payment for produce"
+        }
+
+
+class DarajaClient(BaseDarajaClient):
+    def __init__(self, pool_size=10, **settings):
+        super().__init__(**settings)
+
+        # One keep-alive pool shared by every request from this process
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._token_lock = threading.Lock()
+
+    def _sleep_before_retry(self, attempt):
+        time.sleep(self.retry_delay(attempt))
+
+    def _request(self, method, path, idempotent, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            try:
+                response = self.session.request(method, self.base_url + path, **kwargs)
+            except requests.ConnectionError as exc:
+                # Includes ConnectTimeout. A POST is only retried when no connection was made.
+                maybe_sent = not idempotent and not connect_failed(exc)
+                if last_attempt or maybe_sent:
+                    raise DarajaError(str(exc), maybe_sent=maybe_sent) from exc
+            except requests.Timeout as exc:
+                # A read timeout on a POST may have reached Daraja, don't prompt the buyer twice
+                if last_attempt or not idempotent:
+                    raise DarajaError(str(exc), maybe_sent=not idempotent) from exc
+            else:
+                if not self.retryable(response.status_code, idempotent) or last_attempt:
+                    return response
+            self._sleep_before_retry(attempt)
+
+    def access_token(self):
+        with self._token_lock:
+            token = self.cached_token()
+            if token:
+                return token
+
+            response = self._request(
+                "GET", TOKEN_PATH, idempotent=True,
+                auth=HTTPBasicAuth(self.consumer_key, self.consumer_secret)
+            )
+            return self.store_token(self.read_json(response, idempotent=True))
+
+    def invalidate_token(self):
+        with self._token_lock:
+            self._token = None
+
+    def stk_push(self, phone_number, amount, farmer_number):
+        payload = self.stk_payload(phone_number, amount, farmer_number)
+
+        for _ in range(2):
+            headers = {
+                "Authorization": f"Bearer {self.access_token()}",
+                "Content-Type": "application/json"
+            }
+            response = self._request("POST", STK_PATH, idempotent=False, json=payload, headers=headers)
+            # Token revoked early on Daraja's side, fetch a new one and try once more
+            if response.status_code != 401:
+                break
+            self.invalidate_token()
+
+        return self.read_json(response, idempotent=False)
+
+
+class AsyncDarajaClient(BaseDarajaClient):
+    # The same exchange on httpx for the ASGI app, create and aclose() it inside the event loop
+    def __init__(self, pool_size=100, **settings):
+        import httpx
+
+        super().__init__(**settings)
+        self.httpx = httpx
+        connect, read = self.timeout
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read, connect=connect),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+        self._token_lock = asyncio.Lock()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def _request(self, method, path, idempotent, **kwargs):
+        httpx = self.httpx
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            try:
+                response = await self.client.request(method, self.base_url + path, **kwargs)
+            except httpx.TransportError as exc:
+                # As with requests, a POST is only retried when no connection was made
+                maybe_sent = not idempotent and not isinstance(
+                    exc, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+                if last_attempt or maybe_sent:
+                    raise DarajaError(str(exc), maybe_sent=maybe_sent) from exc
+            else:
+                if not self.retryable(response.status_code, idempotent) or last_attempt:
+                    return response
+            await asyncio.sleep(self.retry_delay(attempt))
+
+    async def access_token(self):
+        async with self._token_lock:
+            token = self.cached_token()
+            if token:
+                return token
+            response = await self._request(
+                "GET", TOKEN_PATH, idempotent=True, auth=(self.consumer_key or "", self.consumer_secret or "")
+            )
+            return self.store_token(self.read_json(response, idempotent=True))
+
+    async def invalidate_token(self):
+        async with self._token_lock:
+            self._token = None
+
+    async def stk_push(self, phone_number, amount, farmer_number):
+        payload = self.stk_payload(phone_number, amount, farmer_number)
+
+        for _ in range(2):
+            headers = {
+                "Authorization": f"Bearer {await self.access_token()}",
+                "Content-Type": "application/json"
+            }
+            response = await self._request("POST", STK_PATH, idempotent=False, json=payload, headers=headers)
+            # Token revoked early on Daraja's side, fetch a new one and try once more
+            if response.status_code != 401:
+                break
+            await self.invalidate_token()
+
+        return self.read_json(response, idempotent=False)
+
+
+daraja = DarajaClient()
+
+
 def get_access_token():
-    response = requests.get(
-        TOKEN_URL,
-        auth=HTTPBasicAuth(CONSUMER_KEY, CONSUMER_SECRET)
-    )
-    return response.json().get('access_token')
+    return daraja.access_token()
+
 
 def lipa_na_mpesa_pochi(phone_number, amount, farmer_number):
-    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-    password_str = f"{BUSINESS_SHORTCODE}{PASSKEY}{timestamp}"
-    password = base64.b64encode(password_str.encode()).decode()
-
-    headers = {
-        "Authorization": f"Bearer {get_access_token()}",
-        "Content-Type": "application/json"
-    }
-
-    payload = {
-        "BusinessShortCode": BUSINESS_SHORTCODE,
-        "Password": password,
-        "Timestamp": timestamp,
-        "TransactionType": "CustomerPayBillOnline",  # Still works with Pochi
-        "Amount": amount,
-        "PartyA": phone_number,  # vendor phone number
-        "PartyB": farmer_number,  # farmer's Pochi number (MSISDN format)
-        "PhoneNumber": phone_number,
-        "CallBackURL": CALLBACK_URL,
-        "AccountReference": "SokoHubOrder",
-        "TransactionDesc": "Payment for produce"
-    }
-
-    response = requests.post(STK_URL, json=payload, headers=headers)
-    return response.json()
+    return daraja.stk_push(phone_number, amount, farmer_number)
@@ -0,0 +1,133 @@
+from datetime import date, datetime
+import gzip
+import logging
+import os
+
+from sqlalchemy import text
+
+logger = logging.getLogger("sokohub.partitions")
+
+# Range partitioned by month on created_at since migration b5d1e8c3f970, Postgres only
+PARTITIONED_TABLES = ("orders", "payments")
+PARTITION_LOCK_KEY = 72163402
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_{month:%Y_%m}"
+
+
+def partition_month(table, name):
+    # orders_2025_06 -> date(2025, 6, 1), None for anything else (e.g. orders_default)
+    try:
+        return datetime.strptime(name[len(table) + 1:], "%Y_%m").date()
+    except ValueError:
+        return None
+
+
+def monthly_tables(connection, table):
+    # {month: attached} for table's monthly partitions, including any a failed archive run left detached
+    rows = connection.execute(text("""
+        SELECT relname, relispartition FROM pg_class
+        WHERE relkind = 'r' AND relnamespace = current_schema()::text::regnamespace AND relname LIKE :pattern
+    """), {"pattern": f"{table}\\_%"})
+    found = {}
+    for name, attached in rows:
+        month = partition_month(table, name)
+        if month is not None:
+            found[month] = attached
+    return found
+
+
+def create_partition(connection, table, month):
+    name = partition_name(table, month)
+    bounds = f"FROM ('{month}') TO ('{add_months(month, 1)}')"
+    # Rows that arrived before their month had a partition sit in the default one and
+    # have to move out first, Postgres refuses the new partition otherwise
+    moved = connection.execute(text(
+        f"SELECT count(*) FROM {table}_default WHERE created_at >= :start AND created_at < :end"
+    ), {"start": month, "end": add_months(month, 1)}).scalar()
+    if not moved:
+        connection.execute(text(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES {bounds}"))
+        return
+    logger.warning("Moving %s rows of %s out of %s_default", moved, name, table)
+    connection.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)"))
+    connection.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {table}_default WHERE created_at >= :start AND created_at < :end RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """), {"start": month, "end": add_months(month, 1)})
+    connection.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES {bounds}"))
+
+
+def archive_partition(connection, name, archive_dir):
+    # gzip'd CSV with a header row, loaded back with COPY ... FROM ... WITH (FORMAT csv, HEADER)
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    expected = connection.execute(text(f"SELECT count(*) FROM {name}")).scalar()
+    cursor = connection.connection.driver_connection.cursor()
+    try:
+        with gzip.open(path + ".part", "wb") as archive:
+            cursor.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", archive)
+            copied = cursor.rowcount
+    finally:
+        cursor.close()
+    # On disk before the table is dropped
+    with open(path + ".part", "rb") as archive:
+        os.fsync(archive.fileno())
+    if copied != expected:
+        raise RuntimeError(f"Archived {copied} of {expected} rows from {name}, keeping the table")
+    os.replace(path + ".part", path)
+    return path
+
+
+def maintain_partitions(session, months_ahead=3, retain_months=24, archive_dir="archive", today=None):
+    # Creates the partitions for this month and months_ahead more, then detaches the ones
+    # older than retain_months (0 keeps everything), writes each to archive_dir and drops it.
+    # Returns the partitions created and the archive files written.
+    engine = session.get_bind()
+    if engine.dialect.name != "postgresql":
+        return [], []
+    today = today or datetime.utcnow().date()
+    this_month = date(today.year, today.month, 1)
+    created, archived = [], []
+
+    # Its own connection, as it commits step by step and holds a lock across them
+    with engine.connect() as connection:
+        if not connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": PARTITION_LOCK_KEY}).scalar():
+            logger.info("Partition maintenance already running elsewhere")
+            return created, archived
+        try:
+            for table in PARTITIONED_TABLES:
+                existing = monthly_tables(connection, table)
+                for count in range(months_ahead + 1):
+                    month = add_months(this_month, count)
+                    if month not in existing:
+                        create_partition(connection, table, month)
+                        connection.commit()
+                        created.append(partition_name(table, month))
+
+                if not retain_months:
+                    continue
+                cutoff = add_months(this_month, -retain_months)
+                for month, attached in sorted(existing.items()):
+                    if month >= cutoff:
+                        continue
+                    name = partition_name(table, month)
+                    # Detached first so queries stop seeing the month before its rows go
+                    if attached:
+                        connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+                        connection.commit()
+                    archived.append(archive_partition(connection, name, archive_dir))
+                    connection.execute(text(f"DROP TABLE {name}"))
+                    connection.commit()
+        finally:
+            connection.rollback()
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": PARTITION_LOCK_KEY})
+            connection.commit()
+    return created, archived
@@ -0,0 +1,107 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+import os
+import threading
+
+import bcrypt
+
+
+class HasherBusy(Exception):
+    pass
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def _check(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+
+def hash_rounds(hashed):
+    # $2b$12$<salt+hash>
+    try:
+        return int(hashed.split("$")[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    # bcrypt runs in worker processes so a login burst can't hold the GIL or the
+    # request threads, and only max_pending hashes may wait for a worker at once
+    def __init__(self, rounds=12, workers=2, max_pending=32, timeout=10):
+        self.configure(rounds, workers, max_pending, timeout)
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+
+    def configure(self, rounds, workers, max_pending, timeout):
+        self.rounds = rounds
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def init_app(self, app):
+        self.configure(
+            app.config.get("BCRYPT_LOG_ROUNDS", 12),
+            app.config.get("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)),
+            app.config.get("PASSWORD_HASH_MAX_PENDING", 32),
+            app.config.get("PASSWORD_HASH_TIMEOUT", 10),
+        )
+        app.extensions["passwords"] = self
+
+    def _executor(self):
+        # Started lazily so each forked server worker gets its own pool
+        with self._pool_lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            return self._executor().submit(fn, *args).result(timeout=self.timeout)
+        except TimeoutError:
+            raise HasherBusy()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(_hash, password.encode("utf-8"), self.rounds)
+
+    def verify(self, hashed, password):
+        if not hashed:
+            return False
+        return self._run(_check, password.encode("utf-8"), hashed.encode("utf-8"))
+
+    def needs_rehash(self, hashed):
+        rounds = hash_rounds(hashed)
+        return rounds is not None and rounds < self.rounds
+
+
+class LoginAttemptLimiter:
+    # Counts failed logins per email in the cache's state store, which page caching can't
+    # evict, once an email runs out of attempts we answer without spending a bcrypt check on it
+    def __init__(self, cache, max_failures=5, window=300):
+        self.cache = cache
+        self.max_failures = max_failures
+        self.window = window
+
+    def _key(self, email):
+        return f"login-failures:{(email or '').strip().lower()}"
+
+    def blocked(self, email):
+        return (self.cache.state.get(self._key(email)) or 0) >= self.max_failures
+
+    def failed(self, email):
+        # Atomic, so concurrent wrong guesses can't overwrite each other's count
+        self.cache.state.incr(self._key(email), self.window)
+
+    def succeeded(self, email):
+        self.cache.state.delete(self._key(email))
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,164 @@
+from datetime import datetime, timedelta
+import time
+
+from sqlalchemy import String, bindparam, column, insert, or_, select, update, values
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from models import Order, Payment, MpesaCallback
+
+CALLBACK_BATCH_SIZE = 500
+# STK pushes expire within minutes, so a callback's payment is always recent. Bounding the
+# lookups by it keeps them to the latest monthly partitions instead of every one.
+CALLBACK_WINDOW = timedelta(days=7)
+# A callback can beat its payment's row (the push is recorded after Daraja answers), so one
+# without a payment is looked at again this often until CALLBACK_WINDOW has passed
+CALLBACK_RETRY_INTERVAL = timedelta(seconds=30)
+
+orders = Order.__table__
+payments = Payment.__table__
+callbacks = MpesaCallback.__table__
+
+
+def callback_status(result_code):
+    return "Completed" if result_code == 0 else "Failed"
+
+
+def record_callback(session, merchant_request_id, result_code, mpesa_code, payload):
+    # One INSERT per callback, a Safaricom retry of the same request is dropped by the unique index
+    row = {
+        "merchant_request_id": merchant_request_id,
+        "result_code": result_code,
+        "mpesa_code": mpesa_code,
+        "payload": payload,
+        "created_at": datetime.utcnow(),
+    }
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        stmt = postgresql.insert(callbacks).on_conflict_do_nothing(index_elements=["merchant_request_id"])
+    elif dialect == "sqlite":
+        stmt = sqlite.insert(callbacks).on_conflict_do_nothing(index_elements=["merchant_request_id"])
+    else:
+        stmt = insert(callbacks)
+
+    try:
+        session.execute(stmt, row)
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+
+
+def record_payment(session, vendor_id, farmer_id, order_id, amount, response):
+    payment = Payment(
+        vendor_id=vendor_id,
+        farmer_id=farmer_id,
+        order_id=order_id,
+        amount=amount,
+        payment_status="Pending",  # Moved on by the M-Pesa callback
+        merchant_request_id=response.get("MerchantRequestID")
+    )
+    session.add(payment)
+    session.commit()
+    return payment
+
+
+def queue_payment(session, vendor_id, farmer_id, order_id, amount):
+    # Written with the stk_push job, so a retry of the job can tell whether its push already went out
+    payment = Payment(
+        vendor_id=vendor_id,
+        farmer_id=farmer_id,
+        order_id=order_id,
+        amount=amount,
+        payment_status="Queued",
+    )
+    session.add(payment)
+    session.flush()
+    return payment
+
+
+def apply_callbacks(session, batch_size=CALLBACK_BATCH_SIZE):
+    postgres = session.get_bind().dialect.name == "postgresql"
+
+    query = (
+        select(callbacks.c.id, callbacks.c.merchant_request_id, callbacks.c.result_code, callbacks.c.mpesa_code,
+               callbacks.c.created_at)
+        .where(callbacks.c.processed_at.is_(None))
+        .where(or_(callbacks.c.retry_at.is_(None), callbacks.c.retry_at <= datetime.utcnow()))
+        .order_by(callbacks.c.id)
+        .limit(batch_size)
+    )
+    if postgres:
+        # Several workers can drain the inbox without waiting on each other
+        query = query.with_for_update(skip_locked=True)
+
+    rows = session.execute(query).all()
+    if not rows:
+        session.commit()
+        return 0
+
+    # Only Pending payments move, so re-applying a callback is a no-op
+    now = datetime.utcnow()
+    since = now - CALLBACK_WINDOW
+    if postgres:
+        batch = values(
+            column("merchant_request_id", String),
+            column("payment_status", String),
+            column("mpesa_code", String),
+            name="batch",
+        ).data([(r.merchant_request_id, callback_status(r.result_code), r.mpesa_code) for r in rows])
+        session.execute(
+            update(payments)
+            .where(payments.c.merchant_request_id == batch.c.merchant_request_id)
+            .where(payments.c.payment_status == "Pending")
+            .where(payments.c.created_at >= since)
+            .values(payment_status=batch.c.payment_status, mpesa_code=batch.c.mpesa_code)
+        )
+    else:
+        session.execute(
+            update(payments)
+            .where(payments.c.merchant_request_id == bindparam("b_merchant_request_id"))
+            .where(payments.c.payment_status == "Pending")
+            .where(payments.c.created_at >= since)
+            .values(payment_status=bindparam("b_payment_status"), mpesa_code=bindparam("b_mpesa_code")),
+            [{
+                "b_merchant_request_id": r.merchant_request_id,
+                "b_payment_status": callback_status(r.result_code),
+                "b_mpesa_code": r.mpesa_code,
+            } for r in rows]
+        )
+
+    # Paid orders keep their stock reservation
+    session.execute(
+        update(orders)
+        .where(orders.c.id.in_(
+            select(payments.c.order_id)
+            .where(payments.c.merchant_request_id.in_([r.merchant_request_id for r in rows]))
+            .where(payments.c.payment_status == "Completed")
+            .where(payments.c.created_at >= since)
+        ))
+        .values(deposit_paid=True)
+    )
+
+    matched = set(session.execute(
+        select(payments.c.merchant_request_id)
+        .where(payments.c.merchant_request_id.in_([r.merchant_request_id for r in rows]))
+        .where(payments.c.created_at >= since)
+    ).scalars())
+    done = [r.id for r in rows if r.merchant_request_id in matched or r.created_at < since]
+    waiting = [r.id for r in rows if r.id not in done]
+    if done:
+        session.execute(update(callbacks).where(callbacks.c.id.in_(done)).values(processed_at=now))
+    if waiting:
+        session.execute(
+            update(callbacks).where(callbacks.c.id.in_(waiting)).values(retry_at=now + CALLBACK_RETRY_INTERVAL)
+        )
+    session.commit()
+    return len(rows)
+
+
+def run_callback_worker(session, batch_size=CALLBACK_BATCH_SIZE, interval=1.0):
+    while True:
+        applied = apply_callbacks(session, batch_size)
+        # Keep draining while batches come back full, otherwise wait for more
+        if applied < batch_size:
+            time.sleep(interval)
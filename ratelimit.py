@@ -0,0 +1,245 @@
+from collections import OrderedDict
+import logging
+import math
+import threading
+import time
+
+from flask import g, jsonify, request
+from flask_jwt_extended import get_jwt, verify_jwt_in_request
+
+logger = logging.getLogger("sokohub.ratelimit")
+
+# Paths that stay reachable however busy the process is
+EXEMPT_PATHS = ("/metrics",)
+
+# An EventSource that gets a 503 gives up for good instead of reconnecting, so streams skip
+# admission; past their first read they hold no connection anyway
+STREAM_PREFIX = "/api/stream/"
+
+
+TOO_MANY_REQUESTS = {"message": "Too many requests, slow down"}
+SERVER_BUSY = {"message": "Server busy, try again shortly"}
+
+
+class Limit:
+    # rate tokens per second, up to burst of them saved up
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+
+    def __repr__(self):
+        return f"Limit({self.rate}/s, burst {self.burst})"
+
+
+# Every client, keyed by IP, and every signed-in account, keyed by JWT identity
+DEFAULT_LIMITS = {
+    "ip": Limit(20, 60),
+    "identity": Limit(10, 30),
+}
+
+# Extra buckets for expensive endpoints, per identity when signed in and per IP otherwise
+ROUTE_LIMITS = {
+    "api.get_produce": Limit(10, 40),
+    "api.search_produce_route": Limit(5, 20),
+    "api.get_nearby_produce": Limit(5, 20),
+    "api.login": Limit(1, 5),
+    "api.farmer_login": Limit(1, 5),
+    "api.post_produce_bulk": Limit(0.1, 2),
+    "api.mpesa_payment": Limit(0.2, 3),
+    "api.create_order": Limit(2, 10),
+    "api.create_order_batch": Limit(1, 5),
+    "api.export_orders": Limit(0.05, 3),
+    # Streams stay open, these only stop reconnect loops
+    "api.stream_orders": Limit(0.2, 5),
+    "api.stream_produce": Limit(1, 20),
+}
+
+
+class MemoryBucketStore:
+    # Per-process buckets, the least recently used ones are dropped past max_keys
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            tokens, stamp = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - stamp) * rate)
+            if tokens >= cost:
+                tokens -= cost
+                retry_after = 0.0
+            else:
+                retry_after = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return retry_after == 0.0, retry_after
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+# Refill and take in one round trip, timed by the Redis clock so every process agrees
+TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'stamp')
+local tokens = tonumber(bucket[1]) or burst
+local stamp = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(now - stamp, 0) * rate)
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'stamp', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(retry_after)
+"""
+
+
+class RedisBucketStore:
+    # Shared buckets, works with redis.Redis or a fake that runs Lua scripts (e.g. fakeredis[lua])
+    def __init__(self, client, prefix="sokohub:ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+        self._take = client.register_script(TAKE_SCRIPT)
+
+    def take(self, key, rate, burst, cost=1):
+        retry_after = float(self._take(keys=[self.prefix + key], args=[rate, burst, cost]))
+        return retry_after == 0.0, retry_after
+
+
+class RateLimiter:
+    def __init__(self, store=None):
+        self.store = store or MemoryBucketStore()
+        self.limits = dict(DEFAULT_LIMITS)
+        self.route_limits = dict(ROUTE_LIMITS)
+        self.enabled = True
+        # Verified bearer token -> (identity, expiry), so a token is checked once here
+        # and not on every request on top of the route's own @jwt_required
+        self._identities = OrderedDict()
+        self._identities_lock = threading.Lock()
+        self.max_identities = 10000
+
+    def init_app(self, app):
+        self.enabled = app.config.get("RATELIMIT_ENABLED", True)
+        self.limits = {**DEFAULT_LIMITS, **app.config.get("RATE_LIMITS", {})}
+        self.route_limits = {**ROUTE_LIMITS, **app.config.get("ROUTE_LIMITS", {})}
+        redis_url = app.config.get("RATELIMIT_REDIS_URL")
+        if redis_url:
+            import redis
+            self.store = RedisBucketStore(redis.Redis.from_url(redis_url))
+        else:
+            self.store = MemoryBucketStore(app.config.get("RATELIMIT_MAX_KEYS", 100000))
+        if self.enabled:
+            app.before_request(self._before_request)
+        app.extensions["ratelimit"] = self
+
+    def identity(self):
+        def claims(token):
+            verify_jwt_in_request(optional=True)
+            return get_jwt()
+        return self.token_identity(request.headers.get("Authorization", ""), claims)
+
+    def token_identity(self, authorization, decode):
+        # decode(token) returns the verified claims or raises
+        scheme, _, token = authorization.partition(" ")
+        if scheme != "Bearer" or not token:
+            return None
+        with self._identities_lock:
+            cached = self._identities.get(token)
+        if cached is not None and cached[1] > time.time():
+            return cached[0]
+
+        # A bad token is the route's problem, here it just means an anonymous caller
+        try:
+            claims = decode(token)
+        except Exception:
+            return None
+        identity = claims.get("sub")
+        if identity is None:
+            return None
+        # Farmer and vendor ids overlap, without the role farmer 1 and vendor 1 would share buckets
+        if claims.get("role"):
+            identity = f"{claims['role']}:{identity}"
+        with self._identities_lock:
+            self._identities[token] = (identity, claims.get("exp", math.inf))
+            self._identities.move_to_end(token)
+            if len(self._identities) > self.max_identities:
+                self._identities.popitem(last=False)
+        return identity
+
+    def checks(self, ip, identity, endpoint):
+        ip = ip or "-"
+        yield f"ip:{ip}", self.limits["ip"]
+        if identity is not None:
+            yield f"identity:{identity}", self.limits["identity"]
+        route_limit = self.route_limits.get(endpoint)
+        if route_limit is not None:
+            caller = f"identity:{identity}" if identity is not None else f"ip:{ip}"
+            yield f"route:{endpoint}:{caller}", route_limit
+
+    def retry_after(self, ip, identity, endpoint):
+        # Seconds to wait if any bucket is empty, None to let the request through
+        for key, limit in self.checks(ip, identity, endpoint):
+            try:
+                allowed, retry_after = self.store.take(key, limit.rate, limit.burst)
+            except Exception:
+                # A shared store that is down shouldn't take the API down with it
+                logger.exception("Rate limit store failed, letting the request through")
+                return None
+            if not allowed:
+                return retry_after
+        return None
+
+    def _before_request(self):
+        if request.path in EXEMPT_PATHS:
+            return None
+        retry_after = self.retry_after(request.remote_addr, self.identity(), request.endpoint)
+        if retry_after is not None:
+            return jsonify(TOO_MANY_REQUESTS), 429, {"Retry-After": str(max(1, math.ceil(retry_after)))}
+        return None
+
+
+class ConcurrencyLimiter:
+    # Caps requests in flight per process below what the DB pool can serve, so a
+    # burst is turned away with a 503 instead of queueing on pool checkouts
+    def __init__(self):
+        self.slots = None
+        self.timeout = 0.05
+
+    def init_app(self, app):
+        limit = app.config.get("MAX_IN_FLIGHT")
+        if not limit:
+            return
+        self.slots = threading.BoundedSemaphore(limit)
+        self.timeout = app.config.get("ADMISSION_TIMEOUT", 0.05)
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        app.extensions["admission"] = self
+
+    def _before_request(self):
+        if request.path in EXEMPT_PATHS or request.path.startswith(STREAM_PREFIX):
+            return None
+        if not self.slots.acquire(timeout=self.timeout):
+            return jsonify(SERVER_BUSY), 503, {"Retry-After": "1"}
+        g.admitted = True
+        return None
+
+    def _teardown_request(self, exc):
+        # Streamed responses hold their slot until the body has been sent
+        if g.pop("admitted", False):
+            self.slots.release()
+
+
+rate_limiter = RateLimiter()
+admission = ConcurrencyLimiter()
@@ -0,0 +1,88 @@
+from datetime import datetime
+import time
+
+from sqlalchemy import case, delete, func, insert, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import FarmerRating, Review
+
+RATING_VALUES = range(1, 6)
+
+ratings = FarmerRating.__table__
+
+
+def record_rating(session, farmer_id, rating):
+    # Runs in the caller's transaction so the aggregate commits with the review
+    now = datetime.utcnow()
+    increments = {
+        "rating_count": ratings.c.rating_count + 1,
+        "rating_sum": ratings.c.rating_sum + rating,
+        "rating_avg": (ratings.c.rating_sum + rating) * 1.0 / (ratings.c.rating_count + 1),
+        f"rating_{rating}": ratings.c[f"rating_{rating}"] + 1,
+        "updated_at": now,
+    }
+    first = {
+        "farmer_id": farmer_id,
+        "rating_count": 1,
+        "rating_sum": rating,
+        "rating_avg": rating,
+        **{f"rating_{value}": int(value == rating) for value in RATING_VALUES},
+        "updated_at": now,
+    }
+
+    dialect = session.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        upsert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        session.execute(
+            upsert(ratings).values(**first)
+            .on_conflict_do_update(index_elements=[ratings.c.farmer_id], set_=increments)
+        )
+        return
+
+    result = session.execute(update(ratings).where(ratings.c.farmer_id == farmer_id).values(**increments))
+    if result.rowcount == 0:
+        session.execute(insert(ratings).values(**first))
+
+
+def reconcile_ratings(session):
+    if session.get_bind().dialect.name == "postgresql":
+        # Review inserts queue behind this until the rebuilt rows are committed
+        session.execute(text("LOCK TABLE farmer_ratings IN EXCLUSIVE MODE"))
+
+    rows = session.execute(
+        select(
+            Review.farmer_id,
+            func.count(),
+            func.sum(Review.rating),
+            *[func.sum(case((Review.rating == value, 1), else_=0)) for value in RATING_VALUES]
+        ).group_by(Review.farmer_id)
+    ).all()
+
+    now = datetime.utcnow()
+    session.execute(delete(ratings))
+    if rows:
+        session.execute(insert(ratings), [{
+            "farmer_id": farmer_id,
+            "rating_count": count,
+            "rating_sum": total,
+            "rating_avg": total / count,
+            **{f"rating_{value}": histogram[value - 1] for value in RATING_VALUES},
+            "updated_at": now,
+        } for farmer_id, count, total, *histogram in rows])
+    session.commit()
+    return len(rows)
+
+
+def run_rating_reconciler(session, interval=3600.0):
+    while True:
+        reconcile_ratings(session)
+        time.sleep(interval)
+
+
+def rating_summary(rating):
+    return {
+        "farmer_id": rating.farmer_id,
+        "average": float(rating.rating_avg),
+        "count": rating.rating_count,
+        "histogram": {str(value): getattr(rating, f"rating_{value}") for value in RATING_VALUES},
+    }
@@ -0,0 +1,57 @@
+import time
+
+from flask import current_app
+from flask_sqlalchemy.session import Session
+
+from cache import cache
+
+REPLICA_BIND = "replica"
+
+
+class RoutingSession(Session):
+    # Sends a request's reads to the replica once use_replica() has flagged the session.
+    # Flushes, and every session that was never flagged, stay on the primary.
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get("replica") and not self._flushing:
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def engine_options(uri, config):
+    options = {"pool_pre_ping": config["DB_POOL_PRE_PING"]}
+    # SQLite gets a single-connection pool from Flask-SQLAlchemy that takes no sizing
+    if not uri.startswith("sqlite"):
+        options.update(
+            pool_size=config["DB_POOL_SIZE"],
+            max_overflow=config["DB_MAX_OVERFLOW"],
+            pool_timeout=config["DB_POOL_TIMEOUT"],
+            pool_recycle=config["DB_POOL_RECYCLE"],
+        )
+    return options
+
+
+def record_write(key):
+    # Remember the write for as long as the replica may still be behind it. It's kept in the cache's
+    # state store, which create_app() insists is shared (Redis) when there is a replica, so a
+    # request handled by any worker process sees it, and which cached pages can't evict.
+    lag = current_app.config["REPLICA_MAX_LAG"]
+    cache.state.set(f"writes:{key}", int(time.time() * 1000), ttl=lag)
+
+
+def last_write(key):
+    return cache.state.get(f"writes:{key}")
+
+
+def replica_caught_up(written_at, lag):
+    # written_at is a millisecond timestamp, lag the seconds a replica may trail the primary
+    return written_at is None or time.time() * 1000 - written_at >= lag * 1000
+
+
+def use_replica(session, written_at=None):
+    # Reads that might not see the write yet stay on the primary
+    if not replica_caught_up(written_at, current_app.config["REPLICA_MAX_LAG"]):
+        return False
+    session.info["replica"] = True
+    return True
@@ -0,0 +1,144 @@
+from datetime import date, datetime
+from decimal import Decimal
+import json
+
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:  # the stdlib path produces the same JSON, only slower
+    orjson = None
+
+
+def default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def dumps(value):
+        # datetimes are native to orjson, only Decimal goes through default()
+        return orjson.dumps(value, default=default)
+
+    loads = orjson.loads
+else:
+    def dumps(value):
+        return json.dumps(value, default=default, separators=(",", ":")).encode()
+
+    loads = json.loads
+
+
+class FastJSONProvider(JSONProvider):
+    # Backs jsonify() and request.get_json() with the same encoder the schemas use
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return json.dumps(obj, default=default, **kwargs)
+        return dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return json.loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype="application/json")
+
+
+def to_float(value):
+    return None if value is None else float(value)
+
+
+class Field:
+    def __init__(self, key, source=None, convert=None):
+        self.key = key
+        self.source = source or key
+        self.convert = convert
+
+
+class Schema:
+    # Declares the JSON shape of a resource. For each column layout it meets, it
+    # generates one function that reads the row by position into a dict, so a
+    # page of rows costs a call per row rather than an attribute lookup per field.
+    def __init__(self, *fields):
+        self.fields = [field if isinstance(field, Field) else Field(field) for field in fields]
+        self._encoders = {}
+
+    def extend(self, *fields):
+        return Schema(*self.fields, *fields)
+
+    def encoder(self, columns):
+        columns = tuple(columns)
+        encode = self._encoders.get(columns)
+        if encode is None:
+            encode = self._encoders[columns] = self._compile(columns)
+        return encode
+
+    def _compile(self, columns):
+        namespace = {}
+        items = []
+        for i, field in enumerate(self.fields):
+            if field.source not in columns:
+                raise KeyError(f"Result has no column {field.source!r} for field {field.key!r}")
+            value = f"row[{columns.index(field.source)}]"
+            if field.convert is not None:
+                namespace[f"convert_{i}"] = field.convert
+                value = f"convert_{i}({value})"
+            items.append(f"{field.key!r}: {value}")
+        exec("def encode(row):\n    return {" + ", ".join(items) + "}\n", namespace)
+        return namespace["encode"]
+
+    def dump(self, row):
+        return self.encoder(row._fields)(row)
+
+    def dump_all(self, rows):
+        if not rows:
+            return []
+        encode = self.encoder(rows[0]._fields)
+        return [encode(row) for row in rows]
+
+
+PRODUCE_LISTING = Schema(
+    "id",
+    "name",
+    Field("price", "unit_price", to_float),
+    "quantity",
+    "category",
+    "farmer_id",
+    "location",
+)
+
+TOP_RATED_PRODUCE = PRODUCE_LISTING.extend(
+    Field("farmer_rating", "rating_avg", to_float),
+    Field("farmer_rating_count", "rating_count"),
+)
+
+PRODUCE_DETAIL = Schema(
+    "id",
+    "name",
+    "quantity",
+    Field("price", "unit_price", to_float),
+    "quality",
+    Field("farmer", "farmer_name"),
+    "location",
+    "farmer_name",
+    "whatsapp_link",
+)
+
+NEARBY_PRODUCE = PRODUCE_LISTING.extend(
+    Field("distance_km", convert=lambda km: round(float(km), 3)),
+)
+
+VENDOR_ORDER = Schema(
+    "id",
+    Field("produce", "produce_name", lambda name: name or "Unknown"),
+    "quantity",
+    Field("total_price", convert=to_float),
+    "deposit_paid",
+    "order_status",
+    "mpesa_code",
+    "created_at",
+)
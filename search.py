@@ -0,0 +1,191 @@
+from bisect import bisect_left
+from collections import defaultdict
+import re
+import threading
+
+from sqlalchemy import func, literal_column, or_, select
+
+from cache import cache
+from models import Farmer, Produce
+
+SEARCH_PAGE_DEFAULT = 20
+SEARCH_PAGE_MAX = 100
+# pg_trgm's default similarity threshold
+TRIGRAM_THRESHOLD = 0.3
+# Same weights ts_rank gives to setweight A/B/C/D
+FIELD_WEIGHTS = {"name": 1.0, "category": 0.4, "description": 0.2, "location": 0.1}
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+# Bumped when a searchable field changes, unlike "produce" which every sale moves
+SEARCH_NAMESPACE = "produce_search"
+
+RESULT_COLUMNS = (
+    Produce.id,
+    Produce.name,
+    Produce.unit_price,
+    Produce.quantity,
+    Produce.category,
+    Produce.farmer_id,
+    Farmer.location,
+)
+
+
+def to_result(row, rank):
+    return {
+        "id": row.id,
+        "name": row.name,
+        "price": float(row.unit_price),
+        "quantity": row.quantity,
+        "category": row.category,
+        "farmer_id": row.farmer_id,
+        "location": row.location,
+        "rank": round(float(rank), 4),
+    }
+
+
+def tokenize(value):
+    return WORD_RE.findall((value or "").lower())
+
+
+def trigrams(value):
+    # Mirrors pg_trgm: each word padded with two spaces in front and one behind
+    grams = set()
+    for word in tokenize(value):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def prefix_query(q):
+    # Every word must match as a prefix, so "tomato" finds "Tomatoes". Built from our own
+    # tokens, nothing in q is read as tsquery syntax.
+    return " & ".join(f"{token}:*" for token in tokenize(q))
+
+
+def similarity(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class PostgresSearch:
+    # Backed by the trigger-maintained produce.search_vector and its GIN index, falling back
+    # to the trigram indexes on name and category when nothing matches. The 'simple' config
+    # is deliberate: listings mix English and Swahili names, which an English stemmer mangles,
+    # so prefix matching stands in for stemming.
+
+    def search(self, session, q, limit, offset):
+        terms = prefix_query(q)
+        if not terms:
+            return []
+        query = func.to_tsquery(literal_column("'simple'::regconfig"), terms)
+        rank = func.ts_rank(Produce.search_vector, query)
+        matches = Produce.search_vector.op("@@")(query)
+        rows = session.execute(
+            select(*RESULT_COLUMNS, rank.label("rank"))
+            .join(Farmer, Produce.farmer_id == Farmer.id)
+            .where(matches)
+            .order_by(rank.desc(), Produce.id.desc())
+            .limit(limit)
+            .offset(offset)
+        ).all()
+        if rows:
+            return [to_result(row, row.rank) for row in rows]
+        # A page past the last match stays empty, only a query with no matches at all falls back
+        if offset and session.execute(select(Produce.id).where(matches).limit(1)).first() is not None:
+            return []
+
+        score = func.greatest(func.similarity(Produce.name, q), func.similarity(Produce.category, q))
+        rows = session.execute(
+            select(*RESULT_COLUMNS, score.label("rank"))
+            .join(Farmer, Produce.farmer_id == Farmer.id)
+            .where(or_(Produce.name.op("%")(q), Produce.category.op("%")(q)))
+            .order_by(score.desc(), Produce.id.desc())
+            .limit(limit)
+            .offset(offset)
+        ).all()
+        return [to_result(row, row.rank) for row in rows]
+
+
+class MemorySearch:
+    # Inverted index for SQLite runs, rebuilt when a searchable field changes. It only
+    # ranks ids, the page's rows are read fresh so stock and prices are current.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._postings = defaultdict(dict)  # token -> {produce_id: weight}
+        self._tokens = []  # sorted, for prefix lookups
+        self._trigrams = {}  # produce_id -> (name trigrams, category trigrams)
+
+    def _rebuild(self, session):
+        version = cache.version(SEARCH_NAMESPACE)
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            postings = defaultdict(dict)
+            grams = {}
+            for row in session.execute(
+                select(Produce.id, Produce.name, Produce.category, Produce.description, Farmer.location)
+                .join(Farmer, Produce.farmer_id == Farmer.id)
+            ):
+                grams[row.id] = (trigrams(row.name), trigrams(row.category))
+                for field, weight in FIELD_WEIGHTS.items():
+                    for token in tokenize(getattr(row, field)):
+                        postings[token][row.id] = postings[token].get(row.id, 0) + weight
+            self._postings, self._tokens, self._trigrams = postings, sorted(postings), grams
+            self._version = version
+
+    def _prefix_hits(self, prefix):
+        hits = {}
+        for i in range(bisect_left(self._tokens, prefix), len(self._tokens)):
+            token = self._tokens[i]
+            if not token.startswith(prefix):
+                break
+            for pid, weight in self._postings[token].items():
+                hits[pid] = max(hits.get(pid, 0), weight)
+        return hits
+
+    def search(self, session, q, limit, offset):
+        self._rebuild(session)
+        tokens = tokenize(q)
+        if not tokens:
+            return []
+
+        # Every query word has to match, like the tsquery's &
+        scores = None
+        for token in tokens:
+            hits = self._prefix_hits(token)
+            if scores is None:
+                scores = hits
+            else:
+                scores = {pid: score + hits[pid] for pid, score in scores.items() if pid in hits}
+            if not scores:
+                break
+
+        if not scores:
+            wanted = trigrams(q)
+            scores = {}
+            for pid, (name, category) in self._trigrams.items():
+                score = max(similarity(wanted, name), similarity(wanted, category))
+                if score >= TRIGRAM_THRESHOLD:
+                    scores[pid] = score
+
+        ranked = sorted((scores or {}).items(), key=lambda item: (-item[1], -item[0]))[offset:offset + limit]
+        rows = {row.id: row for row in session.execute(
+            select(*RESULT_COLUMNS)
+            .join(Farmer, Produce.farmer_id == Farmer.id)
+            .where(Produce.id.in_([pid for pid, _ in ranked]))
+        )}
+        return [to_result(rows[pid], score) for pid, score in ranked if pid in rows]
+
+
+postgres_search = PostgresSearch()
+memory_search = MemorySearch()
+
+
+def search_produce(session, q, limit=SEARCH_PAGE_DEFAULT, offset=0):
+    if session.get_bind().dialect.name == "postgresql":
+        return postgres_search.search(session, q, limit, offset)
+    return memory_search.search(session, q, limit, offset)
@@ -0,0 +1,108 @@
+from datetime import timedelta
+import logging
+
+from flask import current_app
+import requests
+
+from analytics import refresh_analytics
+from inventory import RELEASE_BATCH_SIZE, release_expired_reservations
+from jobs import GiveUp, purge_finished_jobs, task
+from models import Farmer, Order, Payment, Produce
+from mpesa import DarajaError, lipa_na_mpesa_pochi
+from partitions import maintain_partitions
+from ratings import reconcile_ratings
+
+logger = logging.getLogger("sokohub.tasks")
+
+NOTIFY_TIMEOUT = (3.05, 10)
+notify_session = requests.Session()
+
+
+@task("stk_push", queue="payments", max_attempts=3)
+def stk_push(session, payment_id, amount, phone_number, farmer_number):
+    payment = session.get(Payment, payment_id)
+    if payment is None:
+        raise GiveUp(f"Payment {payment_id} not found")
+    if payment.payment_status == "Sending":
+        # An earlier attempt stopped between the push and recording it, the buyer may have the prompt
+        raise GiveUp(f"STK push for payment {payment_id} may already have been sent")
+    if payment.payment_status != "Queued":
+        # Pushed and recorded, only finishing the job failed
+        return
+    payment.payment_status = "Sending"
+    session.commit()
+
+    try:
+        response = lipa_na_mpesa_pochi(phone_number, amount, farmer_number)
+    except DarajaError as exc:
+        # The push may have reached the buyer's phone, sending it again could charge them twice
+        if exc.maybe_sent:
+            raise GiveUp(str(exc)) from exc
+        payment.payment_status = "Queued"
+        session.commit()
+        raise
+    if response.get("ResponseCode") != "0":
+        payment.payment_status = "Failed"
+        session.commit()
+        raise GiveUp(f"STK push rejected: {response}")
+
+    payment.merchant_request_id = response.get("MerchantRequestID")
+    payment.payment_status = "Pending"  # Moved on by the M-Pesa callback
+    session.commit()
+
+
+@task("notify_farmer_order", queue="notifications")
+def notify_farmer_order(session, order_id=None, order_ids=None):
+    # order_ids is a checkout's orders for one farmer, sent as a single message
+    order_ids = order_ids or [order_id]
+    rows = session.query(
+        Order.id, Order.quantity, Order.total_price, Produce.name, Farmer.phone, Farmer.whatsapp_link
+    ).join(Produce, Order.produce_id == Produce.id) \
+     .join(Farmer, Order.farmer_id == Farmer.id) \
+     .filter(Order.id.in_(order_ids)).order_by(Order.id).all()
+    if not rows:
+        raise GiveUp(f"Orders {order_ids} not found")
+
+    row = rows[0]
+    message = "\n".join(f"New SokoHub order #{r.id}: {r.quantity} x {r.name}, KES {r.total_price}" for r in rows)
+    webhook = current_app.config.get("NOTIFY_WEBHOOK_URL")
+    if not webhook:
+        logger.info("No NOTIFY_WEBHOOK_URL set, not sending to %s: %s", row.phone, message)
+        return
+
+    # A non-2xx answer raises, the job is retried with backoff
+    notify_session.post(webhook, json={
+        "phone": row.phone,
+        "whatsapp_link": row.whatsapp_link,
+        "message": message,
+    }, timeout=NOTIFY_TIMEOUT).raise_for_status()
+
+
+@task("release_reservations", queue="housekeeping", every=timedelta(minutes=1))
+def release_reservations(session):
+    while release_expired_reservations(session) >= RELEASE_BATCH_SIZE:
+        pass
+
+
+# The first run backfills every day since launch
+@task("refresh_analytics", queue="housekeeping", every=timedelta(minutes=5), timeout=timedelta(hours=2))
+def refresh_daily_analytics(session):
+    refresh_analytics(session, reservation_ttl=current_app.config["RESERVATION_TTL"])
+
+
+@task("reconcile_ratings", queue="housekeeping", every=timedelta(hours=1))
+def reconcile_farmer_ratings(session):
+    reconcile_ratings(session)
+
+
+@task("purge_finished_jobs", queue="housekeeping", every=timedelta(hours=6))
+def purge_finished(session):
+    purge_finished_jobs(session)
+
+
+# Creating and archiving partitions copies whole months of rows
+@task("maintain_partitions", queue="housekeeping", every=timedelta(days=1), timeout=timedelta(hours=6))
+def maintain_table_partitions(session):
+    config = current_app.config
+    maintain_partitions(session, config["PARTITION_MONTHS_AHEAD"], config["PARTITION_RETAIN_MONTHS"],
+                        config["PARTITION_ARCHIVE_DIR"])
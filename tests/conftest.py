@@ -0,0 +1,190 @@
+# python -m pytest runs against a throwaway SQLite file per test. Set TEST_POSTGRES_URL to a
+# Postgres server (e.g. postgresql+psycopg2://postgres@localhost/postgres) to also run the tests
+# parametrized over "postgresql": each gets its own database copied from one built by the migrations.
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import os
+import uuid
+
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+
+from app import create_app
+from models import db, Farmer, Order, Produce, Vendor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+TEMPLATE_DATABASE = "sokohub_test_template"
+PASSWORD = "test-password"
+
+
+def migrate(url, revision="head", downgrade=False):
+    # No alembic.ini, its logging setup would turn off the app's loggers for the rest of the run
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config()
+    config.set_main_option("script_location", os.path.join(ROOT, "migrations"))
+    config.set_main_option("sqlalchemy.url", url.replace("%", "%%"))
+    (command.downgrade if downgrade else command.upgrade)(config, revision)
+
+
+def database_url(name):
+    return make_url(POSTGRES_URL).set(database=name).render_as_string(hide_password=False)
+
+
+@contextmanager
+def server_connection():
+    engine = create_engine(POSTGRES_URL, isolation_level="AUTOCOMMIT")
+    try:
+        with engine.connect() as connection:
+            yield connection
+    finally:
+        engine.dispose()
+
+
+@pytest.fixture(scope="session")
+def postgres_template():
+    if not POSTGRES_URL:
+        pytest.skip("TEST_POSTGRES_URL is not set")
+    with server_connection() as connection:
+        connection.execute(text(f"DROP DATABASE IF EXISTS {TEMPLATE_DATABASE}"))
+        connection.execute(text(f"CREATE DATABASE {TEMPLATE_DATABASE}"))
+    migrate(database_url(TEMPLATE_DATABASE))
+    yield TEMPLATE_DATABASE
+    with server_connection() as connection:
+        connection.execute(text(f"DROP DATABASE IF EXISTS {TEMPLATE_DATABASE}"))
+
+
+@pytest.fixture
+def postgres_database(request):
+    # A migrated database of its own, dropped after the test
+    template = request.getfixturevalue("postgres_template")
+    name = f"sokohub_test_{uuid.uuid4().hex[:12]}"
+    with server_connection() as connection:
+        connection.execute(text(f"CREATE DATABASE {name} TEMPLATE {template}"))
+    yield database_url(name)
+    with server_connection() as connection:
+        connection.execute(text(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)"))
+
+
+def make_app(database_url, **config):
+    return create_app({
+        "SQLALCHEMY_DATABASE_URI": database_url,
+        "TESTING": True,
+        "JWT_SECRET_KEY": "sokohub-test-secret-at-least-32-bytes",
+        "RATELIMIT_ENABLED": False,
+        "MAX_IN_FLIGHT": 0,
+        "BCRYPT_LOG_ROUNDS": 4,
+        "PASSWORD_HASH_WORKERS": 0,
+        **config,
+    })
+
+
+@pytest.fixture
+def app(request, tmp_path):
+    # SQLite unless a test asks for @pytest.mark.parametrize("app", ["sqlite", "postgresql"], indirect=True)
+    if getattr(request, "param", "sqlite") == "postgresql":
+        app = make_app(request.getfixturevalue("postgres_database"))
+    else:
+        app = make_app(f"sqlite:///{tmp_path / 'sokohub.db'}")
+        with app.app_context():
+            # Only the default bind, db keeps the metadata of binds earlier apps configured
+            db.create_all(bind_key=None)
+    yield app
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth(app):
+    def headers(identity, role="vendor", **claims):
+        with app.app_context():
+            token = create_access_token(identity=str(identity), additional_claims={"role": role, **claims})
+        return {"Authorization": f"Bearer {token}"}
+    return headers
+
+
+@pytest.fixture
+def seeded(app):
+    # Two farmers with three produce listings between them and two vendors, all signing in with PASSWORD
+    from passwords import hasher
+
+    with app.app_context():
+        password = hasher.hash(PASSWORD)
+        farmers = [
+            Farmer(name="Wanjiku", email="wanjiku@example.com", password=password, phone="254700000001",
+                   mpesa="254700000001", location="Nakuru"),
+            Farmer(name="Otieno", email="otieno@example.com", password=password, phone="254700000002",
+                   mpesa="254700000002", location="Kisumu"),
+        ]
+        vendors = [
+            Vendor(name="Mama Mboga", email="mboga@example.com", password=password, phone="254711000001"),
+            Vendor(name="Soko Fresh", email="fresh@example.com", password=password, phone="254711000002"),
+        ]
+        db.session.add_all(farmers + vendors)
+        db.session.flush()
+        produce = [
+            Produce(name="Tomatoes", category="vegetables", unit_price=80, quantity=500, quality="A",
+                    farmer_id=farmers[0].id),
+            Produce(name="Sukuma wiki", category="vegetables", unit_price=30, quantity=1000, quality="A",
+                    farmer_id=farmers[0].id),
+            Produce(name="Mangoes", category="fruit", unit_price=20, quantity=300, quality="B",
+                    farmer_id=farmers[1].id),
+        ]
+        db.session.add_all(produce)
+        db.session.commit()
+        return {
+            "farmer_ids": [farmer.id for farmer in farmers],
+            "vendor_ids": [vendor.id for vendor in vendors],
+            "produce_ids": [item.id for item in produce],
+        }
+
+
+@pytest.fixture
+def add_orders(app, seeded):
+    # add_orders(vendor_id, count) inserts count orders a minute apart, cycling through the produce
+    def add(vendor_id, count, start=None, **values):
+        start = start or datetime.utcnow() - timedelta(days=1)
+        with app.app_context():
+            produce = db.session.query(Produce.id, Produce.farmer_id, Produce.unit_price).order_by(Produce.id).all()
+            rows = []
+            for i in range(count):
+                item = produce[i % len(produce)]
+                rows.append({
+                    "vendor_id": vendor_id, "farmer_id": item.farmer_id, "produce_id": item.id, "quantity": 1,
+                    "total_price": item.unit_price, "deposit_paid": False, "order_status": "Pending",
+                    "created_at": start - timedelta(minutes=i), **values,
+                })
+            if rows:
+                db.session.execute(Order.__table__.insert(), rows)
+            db.session.commit()
+    return add
+
+
+@pytest.fixture
+def count_queries(app):
+    # with count_queries() as statements: ... collects the SQL the app's engine ran inside the block
+    @contextmanager
+    def counting():
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+    return counting
@@ -0,0 +1,52 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from analytics import refresh_analytics, sales_by_day
+from inventory import release_expired_reservations
+from models import db
+from tests.conftest import PASSWORD
+
+MARKETPLACE = ["/api/analytics/gmv", "/api/analytics/categories", "/api/analytics/farmers", "/api/analytics/payments"]
+
+
+@pytest.mark.parametrize("path", MARKETPLACE)
+def test_marketplace_analytics_are_for_admins(client, seeded, auth, path):
+    vendor_id, farmer_id = seeded["vendor_ids"][0], seeded["farmer_ids"][0]
+    assert client.get(path, headers=auth(vendor_id)).status_code == 403
+    assert client.get(path, headers=auth(farmer_id, role="farmer")).status_code == 403
+    assert client.get(path, headers=auth(vendor_id, admin=True)).status_code == 200
+
+
+def test_farmers_see_only_their_own_sales(client, seeded, auth):
+    farmer_id, other_farmer_id = seeded["farmer_ids"]
+    path = f"/api/analytics/farmers/{farmer_id}"
+    assert client.get(path, headers=auth(farmer_id, role="farmer")).status_code == 200
+    assert client.get(path, headers=auth(other_farmer_id, role="farmer")).status_code == 403
+    # Vendor and farmer ids overlap, the role decides
+    assert client.get(path, headers=auth(farmer_id)).status_code == 403
+
+
+def test_admin_emails_sign_in_as_admins(app, client, seeded):
+    app.config["ADMIN_EMAILS"] = {"fresh@example.com"}
+    for email, status in (("mboga@example.com", 403), ("fresh@example.com", 200)):
+        token = client.post("/api/auth/login", json={"email": email, "password": PASSWORD}).json["access_token"]
+        assert client.get("/api/analytics/gmv", headers={"Authorization": f"Bearer {token}"}).status_code == status
+
+
+def test_an_order_expiring_after_its_day_closed_leaves_the_rollup(app, seeded, add_orders):
+    placed = datetime(2026, 3, 10, 23, 50)
+    add_orders(seeded["vendor_ids"][0], 2, start=placed, reserved_until=placed + timedelta(minutes=30))
+    add_orders(seeded["vendor_ids"][1], 1, start=placed, deposit_paid=True, order_status="Paid")
+
+    def march_10_orders(now):
+        with app.app_context():
+            refresh_analytics(db.session, now=now)
+            return [day["orders"] for day in sales_by_day(db.session, date(2026, 3, 10), date(2026, 3, 10))]
+
+    # Rolled up a few minutes after midnight, while both Pending orders still hold their stock
+    assert march_10_orders(datetime(2026, 3, 11, 0, 10)) == [3]
+
+    with app.app_context():
+        assert release_expired_reservations(db.session, now=datetime(2026, 3, 11, 0, 25)) == 2
+    assert march_10_orders(datetime(2026, 3, 11, 0, 30)) == [1]
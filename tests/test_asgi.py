@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+# The async serving mode's own dependencies
+for module in ("quart", "aiosqlite", "httpx", "greenlet"):
+    pytest.importorskip(module)
+
+from asgi import create_asgi_app
+from tests.conftest import make_app
+
+
+@pytest.fixture
+def asgi(app, seeded):
+    # The async app over the same database as the sync one, with its own copy of the sync app
+    return create_asgi_app(make_app(app.config["SQLALCHEMY_DATABASE_URI"]).config)
+
+
+def fetch(dispatcher, *requests):
+    # Runs the requests through the async app with its startup and shutdown hooks
+    async def run():
+        async with dispatcher.async_app.test_app() as test_app:
+            client = test_app.test_client()
+            responses = []
+            for path, headers in requests:
+                response = await client.get(path, headers=headers)
+                responses.append((response.status_code, await response.get_json(), response.headers))
+            return responses
+    return asyncio.run(run())
+
+
+def test_async_routes_answer_like_the_sync_app(asgi, client, auth, seeded, add_orders):
+    vendor_id = seeded["vendor_ids"][0]
+    add_orders(vendor_id, 3)
+    headers = auth(vendor_id)
+    requests = [
+        ("/api/produce?category=vegetables", {}),
+        ("/api/produce?limit=2", {}),
+        (f"/api/produce/{seeded['produce_ids'][2]}", {}),
+        (f"/api/produce?ids={seeded['produce_ids'][2]},999,{seeded['produce_ids'][0]}", {}),
+        ("/api/produce?ids=1,99999999999999999999999", {}),
+        ("/api/produce/99999999999999999999999", {}),
+        ("/api/orders?limit=2", headers),
+        ("/api/orders", {}),
+    ]
+
+    for (path, request_headers), (status, body, response_headers) in zip(requests, fetch(asgi, *requests)):
+        expected = client.get(path, headers=request_headers)
+        assert status == expected.status_code, path
+        assert body == expected.get_json(), path
+        assert response_headers.get("X-Next-Cursor") == expected.headers.get("X-Next-Cursor"), path
+
+
+def test_routes_the_async_app_lacks_go_to_the_sync_app(asgi):
+    assert asgi.serves({"type": "http", "path": "/api/produce", "method": "GET"})
+    assert asgi.serves({"type": "http", "path": "/api/orders", "method": "GET"})
+    assert asgi.serves({"type": "lifespan"})
+    assert not asgi.serves({"type": "http", "path": "/api/produce/categories", "method": "GET"})
+    assert not asgi.serves({"type": "http", "path": "/api/orders", "method": "POST"})
@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import cache
+from tests.conftest import PASSWORD
+
+
+def test_login_token_works_on_protected_routes(client, seeded):
+    response = client.post("/api/auth/login", json={"email": "mboga@example.com", "password": PASSWORD})
+    assert response.status_code == 200
+    headers = {"Authorization": f"Bearer {response.json['access_token']}"}
+    assert client.get("/api/orders", headers=headers).status_code == 200
+    order = client.post("/api/orders", json={"produce_id": seeded["produce_ids"][0], "quantity": 2}, headers=headers)
+    assert order.status_code == 201
+
+
+def test_concurrent_failed_logins_are_all_counted(app, seeded):
+    limiter = app.extensions["login_attempts"]
+
+    def guess(_):
+        return app.test_client().post("/api/auth/login", json={"email": "mboga@example.com", "password": "wrong"})
+
+    with ThreadPoolExecutor(8) as pool:
+        statuses = [response.status_code for response in pool.map(guess, range(limiter.max_failures))]
+
+    assert statuses == [401] * limiter.max_failures
+    assert limiter.blocked("mboga@example.com")
+    response = app.test_client().post("/api/auth/login", json={"email": "mboga@example.com", "password": PASSWORD})
+    assert response.status_code == 429
+
+
+def test_a_lockout_survives_the_page_cache_filling_up(client, seeded, monkeypatch):
+    limiter = client.application.extensions["login_attempts"]
+    for _ in range(limiter.max_failures):
+        client.post("/api/auth/login", json={"email": "mboga@example.com", "password": "wrong"})
+    assert client.post("/api/auth/login", json={"email": "mboga@example.com", "password": "wrong"}).status_code == 429
+
+    # Anonymous listing pages, each its own cache entry, well past what the cache holds
+    monkeypatch.setattr(cache.backend, "max_entries", 32)
+    for limit in range(1, 2 * cache.backend.max_entries):
+        assert client.get(f"/api/produce?limit={limit}").status_code == 200
+    assert len(cache.backend._entries) == cache.backend.max_entries
+
+    assert client.post("/api/auth/login", json={"email": "mboga@example.com", "password": "wrong"}).status_code == 429
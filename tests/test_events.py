@@ -0,0 +1,86 @@
+import pytest
+
+import events
+from events import STREAM_QUEUE_SIZE, ChangeFeed, Hub, Subscription, order_topics, produce_topic, sse, sse_stream
+from models import db
+
+
+def order(order_id, vendor_id, farmer_id, status="Pending"):
+    return {"event": "order", "id": order_id, "vendor_id": vendor_id, "farmer_id": farmer_id,
+            "order_status": status, "deposit_paid": False}
+
+
+def received(subscription):
+    delivered = []
+    while not subscription.events.empty():
+        delivered.append(subscription.events.get_nowait())
+    return delivered
+
+
+def test_publish_reaches_only_the_subscriptions_on_the_event_topics():
+    hub = Hub()
+    vendor = Subscription(order_topics(vendor_id=1))
+    farmer = Subscription(order_topics(farmer_id=7))
+    other_vendor = Subscription(order_topics(vendor_id=2))
+    stock = Subscription([produce_topic(3)])
+    both = Subscription(order_topics(vendor_id=1, farmer_id=7))
+    for subscription in (vendor, farmer, other_vendor, stock, both):
+        hub.subscribe(subscription)
+
+    placed = order(10, vendor_id=1, farmer_id=7)
+    restocked = {"event": "produce", "id": 3, "quantity": 40}
+    hub.publish(placed)
+    hub.publish(restocked)
+    hub.publish({"event": "produce", "id": 4, "quantity": 0})
+
+    assert received(vendor) == [placed]
+    assert received(farmer) == [placed]
+    assert received(other_vendor) == []
+    assert received(stock) == [restocked]
+    # Once, though it matches both of its topics
+    assert received(both) == [placed]
+
+    hub.unsubscribe(vendor)
+    hub.unsubscribe(other_vendor)
+    moved = order(11, vendor_id=1, farmer_id=8)
+    hub.publish(moved)
+    assert received(vendor) == []
+    assert received(both) == [moved]
+    assert len(hub) == 3
+    # A topic nobody is on any more isn't watched
+    assert "orders:vendor:2" not in hub.topics()
+
+
+@pytest.fixture
+def feed():
+    feed = ChangeFeed()
+    yield feed
+    if feed.listener is not None:
+        feed.listener.stop()
+
+
+def test_a_lagged_stream_is_told_to_resync_and_then_carries_on(app, feed, monkeypatch):
+    monkeypatch.setattr(events, "STREAM_HEARTBEAT", 0.01)
+    with app.app_context():
+        engine = db.engine
+    topics = order_topics(vendor_id=1)
+    stream = sse_stream(feed, engine, topics)
+    assert next(stream) == f"retry: {events.STREAM_RETRY_MS}\n\n"
+    assert len(feed.hub) == 1
+
+    # Nothing happening, the client still hears from the server
+    assert next(stream) == ": ping\n\n"
+
+    # More events than the stream can hold while its client isn't reading
+    for order_id in range(STREAM_QUEUE_SIZE + 5):
+        feed.hub.publish(order(order_id, vendor_id=1, farmer_id=7))
+    assert next(stream) == sse(events.RESYNC)
+
+    # The backlog is dropped, not replayed after the resync
+    latest = order(500, vendor_id=1, farmer_id=7, status="Delivered")
+    feed.hub.publish(latest)
+    assert next(stream) == sse(latest)
+    assert next(stream) == ": ping\n\n"
+
+    stream.close()
+    assert len(feed.hub) == 0
@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+import gc
+import json
+import os
+import zlib
+
+import pytest
+
+from models import db, Order
+
+# TEST_EXPORT_ORDERS=1000000 for the full-size check, the default keeps the suite quick
+EXPORT_ORDERS = int(os.getenv("TEST_EXPORT_ORDERS", 100000))
+# Far below what holding every row would take, a dict per order alone is several hundred bytes
+RSS_GROWTH_MAX_MB = 16
+
+
+def peak_rss_mb():
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+
+
+def reset_peak_rss():
+    # Linux only: writing 5 starts VmHWM again from the current RSS
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pytest.skip("Peak RSS can't be reset here")
+
+
+@pytest.fixture
+def history(app, seeded):
+    # EXPORT_ORDERS orders for the first vendor, a tenth of that for the second
+    vendor_ids = seeded["vendor_ids"]
+    counts = {vendor_ids[0]: EXPORT_ORDERS, vendor_ids[1]: EXPORT_ORDERS // 10}
+    start = datetime.utcnow() - timedelta(days=1)
+    with app.app_context():
+        for vendor_id, count in counts.items():
+            for offset in range(0, count, 10000):
+                db.session.execute(Order.__table__.insert(), [{
+                    "vendor_id": vendor_id, "farmer_id": seeded["farmer_ids"][0], "produce_id": seeded["produce_ids"][0],
+                    "quantity": 1, "total_price": 80, "deposit_paid": False, "order_status": "Pending",
+                    "created_at": start - timedelta(seconds=i),
+                } for i in range(offset, min(offset + 10000, count))])
+            db.session.commit()
+    return counts
+
+
+def export(client, headers, export_format, gzip):
+    # Reads the response as it streams, keeping only the line count and the last line
+    response = client.get(f"/api/orders/export?format={export_format}", buffered=False,
+                          headers={**headers, "Accept-Encoding": "gzip" if gzip else "identity"})
+    assert response.status_code == 200
+    assert response.headers.get("Content-Encoding") == ("gzip" if gzip else None)
+    decompress = zlib.decompressobj(31) if gzip else None
+    lines, tail = 0, b""
+    for chunk in response.iter_encoded():
+        data = tail + (decompress.decompress(chunk) if decompress else chunk)
+        lines += data.count(b"\n")
+        tail = data.rsplit(b"\n", 1)[-1]
+    response.close()
+    return lines, tail
+
+
+@pytest.mark.parametrize("app", ["sqlite", "postgresql"], indirect=True)
+@pytest.mark.parametrize("export_format, gzip", [("csv", False), ("ndjson", True)])
+def test_export_memory_stays_flat_as_history_grows(client, auth, history, export_format, gzip):
+    (big_vendor, big), (small_vendor, small) = history.items()
+    header = export_format == "csv"
+
+    gc.collect()
+    reset_peak_rss()
+    assert export(client, auth(small_vendor), export_format, gzip)[0] == small + header
+    small_peak = peak_rss_mb()
+
+    gc.collect()
+    reset_peak_rss()
+    assert export(client, auth(big_vendor), export_format, gzip)[0] == big + header
+    big_peak = peak_rss_mb()
+
+    assert big_peak - small_peak < RSS_GROWTH_MAX_MB, (small_peak, big_peak)
+
+
+def test_export_rows_match_the_order_list(client, seeded, add_orders, auth):
+    vendor_id = seeded["vendor_ids"][0]
+    add_orders(vendor_id, 5)
+    headers = auth(vendor_id)
+    listed = client.get("/api/orders", headers=headers).json
+
+    response = client.get("/api/orders/export?format=ndjson", headers=headers)
+    assert [json.loads(line) for line in response.data.splitlines()] == listed
+
+    response = client.get("/api/orders/export?format=csv", headers=headers)
+    rows = response.data.decode().splitlines()
+    assert rows[0] == "id,produce,quantity,total_price,deposit_paid,order_status,mpesa_code,created_at"
+    assert [int(row.split(",")[0]) for row in rows[1:]] == [order["id"] for order in listed]
+
+
+def test_export_is_for_vendors_only(client, seeded, add_orders, auth):
+    # Farmer and vendor ids both start at 1, the farmer must not get the vendor's orders
+    vendor_id = seeded["vendor_ids"][0]
+    add_orders(vendor_id, 3)
+    farmer_id = seeded["farmer_ids"][0]
+    assert farmer_id == vendor_id
+
+    response = client.get("/api/orders/export?format=ndjson", headers=auth(farmer_id, role="farmer"))
+    assert response.status_code == 403
+    assert client.get("/api/orders/export?format=ndjson", headers=auth(vendor_id)).status_code == 200
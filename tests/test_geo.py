@@ -0,0 +1,57 @@
+import random
+
+import pytest
+
+from geo import PLACES, encode_geohash
+from models import db, Farmer, Produce
+
+pytestmark = pytest.mark.parametrize("app", ["sqlite", "postgresql"], indirect=True)
+
+
+@pytest.fixture
+def located(app, seeded):
+    with app.app_context():
+        for farmer_id, place in zip(seeded["farmer_ids"], ("nakuru", "kisumu")):
+            farmer = db.session.get(Farmer, farmer_id)
+            farmer.latitude, farmer.longitude = PLACES[place]
+        db.session.commit()
+    return seeded
+
+
+def nearby(client, place, radius):
+    lat, lng = PLACES[place]
+    response = client.get("/api/produce/nearby", query_string={"lat": lat + 0.05, "lng": lng, "radius": radius})
+    assert response.status_code == 200
+    return response.json["results"]
+
+
+def test_nearby_produce_is_ordered_by_distance(client, located):
+    results = nearby(client, "nakuru", 25)
+    assert [item["name"] for item in results] == ["Tomatoes", "Sukuma wiki"]
+    assert 5.5 < results[0]["distance_km"] < 5.6
+    assert [item["name"] for item in nearby(client, "kisumu", 25)] == ["Mangoes"]
+    assert nearby(client, "nakuru", 5) == []
+
+
+def test_many_farms_in_range(app, client, located):
+    # Passing a distance per farm back as parameters would need more than SQLite's default 32766
+    rng = random.Random(5)
+    lat, lng = PLACES["nakuru"]
+    farms = []
+    for i in range(20000):
+        farm_lat, farm_lng = lat + rng.uniform(-0.15, 0.15), lng + rng.uniform(-0.15, 0.15)
+        farms.append({"name": f"Farm {i}", "email": f"farm{i}@example.com", "phone": "254700000000",
+                      "mpesa": "254700000000", "latitude": farm_lat, "longitude": farm_lng,
+                      "geohash": encode_geohash(farm_lat, farm_lng)})
+    with app.app_context():
+        db.session.execute(Farmer.__table__.insert(), farms)
+        first = db.session.query(Farmer.id).filter_by(email="farm0@example.com").scalar()
+        db.session.execute(Produce.__table__.insert(), [
+            {"name": "Onions", "unit_price": 50, "quantity": 10, "quality": "A", "farmer_id": farmer_id}
+            for farmer_id in range(first, first + 300)])
+        db.session.commit()
+
+    results = nearby(client, "nakuru", 50)
+    assert len(results) == 50
+    distances = [item["distance_km"] for item in results]
+    assert distances == sorted(distances)
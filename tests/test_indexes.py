@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+import random
+
+import pytest
+from sqlalchemy import select, text
+
+from app import produce_listing_query, vendor_orders_query
+from models import db, Farmer, Order, Payment, Produce, Vendor
+
+CATEGORIES = ["vegetables", "fruit", "cereals", "legumes", "tubers", "dairy", "poultry", "herbs"]
+# Most orders end up delivered, so filtering on any other status is selective
+STATUSES = {"Pending": 10, "Paid": 5, "Delivered": 80, "Expired": 5}
+VENDORS, FARMERS, PRODUCE, ORDERS = 50, 20, 2000, 20000
+
+pytestmark = pytest.mark.parametrize("app", ["sqlite", "postgresql"], indirect=True)
+
+
+@pytest.fixture
+def catalogue(app):
+    # Enough rows that a sequential scan loses to the indexes on Postgres too
+    rng = random.Random(3)
+    now = datetime.utcnow()
+    with app.app_context():
+        session = db.session
+        session.execute(Vendor.__table__.insert(), [
+            {"name": f"Vendor {i}", "email": f"vendor{i}@example.com", "phone": "254711000000", "password": "-"}
+            for i in range(VENDORS)])
+        session.execute(Farmer.__table__.insert(), [
+            {"name": f"Farmer {i}", "email": f"farmer{i}@example.com", "phone": "254700000000",
+             "mpesa": "254700000000"} for i in range(FARMERS)])
+        session.execute(Produce.__table__.insert(), [
+            {"name": f"Produce {i}", "category": rng.choice(CATEGORIES), "unit_price": 50, "quantity": 100,
+             "quality": "A", "farmer_id": rng.randint(1, FARMERS), "created_at": now - timedelta(minutes=i)}
+            for i in range(PRODUCE)])
+        session.execute(Order.__table__.insert(), [
+            {"vendor_id": rng.randint(1, VENDORS), "farmer_id": rng.randint(1, FARMERS),
+             "produce_id": rng.randint(1, PRODUCE), "quantity": 1, "total_price": 50,
+             "order_status": rng.choices(list(STATUSES), list(STATUSES.values()))[0],
+             "created_at": now - timedelta(minutes=i)}
+            for i in range(ORDERS)])
+        session.execute(Payment.__table__.insert(), [
+            {"vendor_id": rng.randint(1, VENDORS), "amount": 50, "payment_status": "Pending",
+             "merchant_request_id": f"29115-{i}", "created_at": now - timedelta(minutes=i)}
+            for i in range(ORDERS)])
+        session.commit()
+        if session.get_bind().dialect.name == "postgresql":
+            with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                connection.execute(text("VACUUM ANALYZE"))
+        else:
+            session.execute(text("ANALYZE"))
+            session.commit()
+
+
+def indexes_used(connection, statement):
+    # (table, index) pairs the plan reads, a partition's index reported as its parent's
+    compiled = statement.compile(dialect=connection.dialect)
+    if connection.dialect.name == "sqlite":
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+        details = [row[3] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)]
+        # e.g. SEARCH orders USING INDEX ix_orders_vendor_created_at_id (vendor_id=?)
+        return {(detail.split()[1], detail.split(" INDEX ")[1].split()[0]) for detail in details if " INDEX " in detail}
+
+    plan = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+    used = set()
+    nodes = [plan[0]["Plan"]]
+    while nodes:
+        node = nodes.pop()
+        if "Index Name" in node:
+            used.add(tuple(connection.execute(text("""
+                SELECT index.indrelid::regclass::text, index.indexrelid::regclass::text FROM pg_index index
+                WHERE index.indexrelid = coalesce((SELECT inhparent FROM pg_inherits WHERE inhrelid = CAST(:name AS regclass)),
+                                                  CAST(:name AS regclass))
+            """), {"name": node["Index Name"]}).one()))
+        nodes.extend(node.get("Plans", []))
+    return used
+
+
+@pytest.mark.parametrize("name, statement, table, index", [
+    ("produce listing", lambda: produce_listing_query(None, None, 100), "produce", "ix_produce_created_at_id"),
+    ("produce listing, next page",
+     lambda: produce_listing_query(None, (datetime.utcnow() - timedelta(hours=10), 1400), 100),
+     "produce", "ix_produce_created_at_id"),
+    ("produce by category", lambda: produce_listing_query("fruit", None, 100),
+     "produce", "ix_produce_category_created_at_id"),
+    ("vendor orders", lambda: vendor_orders_query(7, 100), "orders", "ix_orders_vendor_created_at_id"),
+    ("vendor orders by status", lambda: vendor_orders_query(7, 100, status="paid"),
+     "orders", "ix_orders_vendor_status_created_at"),
+    ("vendor orders, next page",
+     lambda: vendor_orders_query(7, 100, cursor=(datetime.utcnow() - timedelta(days=3), 4000)),
+     "orders", "ix_orders_vendor_created_at_id"),
+    ("callback payment lookup", lambda: select(Payment.id).where(Payment.merchant_request_id == "29115-42"),
+     "payments", "ix_payments_merchant_request_id"),
+])
+def test_hot_queries_use_their_index(app, catalogue, name, statement, table, index):
+    with app.app_context():
+        with db.engine.connect() as connection:
+            used = indexes_used(connection, statement())
+            if connection.dialect.name == "postgresql":
+                assert (table, index) in used, name
+            else:
+                # SQLite keeps no value statistics and may pick another index of the table that
+                # already returns rows in order, it just mustn't scan the whole table
+                assert table in {used_table for used_table, _ in used}, name
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert, select
+
+from jobs import JOB_TIMEOUT, TASKS, Worker, claim_jobs, finish_job, jobs, requeue_stale_jobs
+from models import db
+
+
+def add_job(session, queue, status, started_at=None, task="purge_finished_jobs"):
+    now = datetime.utcnow()
+    return session.execute(insert(jobs).values(
+        queue=queue, task=task, payload={}, status=status, attempts=1 if started_at else 0,
+        max_attempts=5, run_at=now, started_at=started_at, created_at=now,
+    ).returning(jobs.c.id)).scalar()
+
+
+@pytest.mark.parametrize("app", ["sqlite", "postgresql"], indirect=True)
+def test_job_left_running_by_a_dead_worker_does_not_block_its_queue(app):
+    with app.app_context():
+        session = db.session
+        stale = add_job(session, "housekeeping", "running", started_at=datetime.utcnow() - JOB_TIMEOUT * 2)
+        ready = add_job(session, "housekeeping", "queued")
+        session.commit()
+
+        # Its slot is free straight away, before anything requeues it
+        assert [job.id for job in claim_jobs(session, "housekeeping", 1, 1, "test")] == [ready]
+        assert claim_jobs(session, "housekeeping", 1, 1, "test") == []
+
+        # The worker requeues it on its own, not through the housekeeping queue it's stuck on
+        Worker(app, {}).poll()
+        assert session.execute(select(jobs.c.status).where(jobs.c.id == stale)).scalar() == "queued"
+
+
+@pytest.mark.parametrize("app", ["sqlite", "postgresql"], indirect=True)
+def test_a_run_requeued_as_stale_is_not_finished_by_the_run_it_replaced(app):
+    with app.app_context():
+        session = db.session
+        job_id = add_job(session, "housekeeping", "queued")
+        session.commit()
+        [first] = claim_jobs(session, "housekeeping", 1, 1, "worker-1")
+
+        # The first run outlives its timeout, another worker picks the job up again
+        session.execute(jobs.update().where(jobs.c.id == job_id)
+                        .values(started_at=datetime.utcnow() - JOB_TIMEOUT * 2))
+        session.commit()
+        assert requeue_stale_jobs(session) == (1, 0)
+        [second] = claim_jobs(session, "housekeeping", 1, 1, "worker-2")
+
+        assert finish_job(session, first, "Boom", retry=True) is False
+        row = session.execute(select(jobs.c.status, jobs.c.locked_by).where(jobs.c.id == job_id)).one()
+        assert tuple(row) == ("running", "worker-2")
+
+        assert finish_job(session, second) is True
+        assert session.execute(select(jobs.c.status).where(jobs.c.id == job_id)).scalar() == "done"
+
+
+@pytest.mark.parametrize("app", ["sqlite", "postgresql"], indirect=True)
+def test_a_long_task_is_stale_only_after_its_own_timeout(app):
+    timeout = TASKS["maintain_partitions"].timeout
+    assert timeout > JOB_TIMEOUT * 2
+    with app.app_context():
+        session = db.session
+        slow = add_job(session, "housekeeping", "running", started_at=datetime.utcnow() - JOB_TIMEOUT * 2,
+                       task="maintain_partitions")
+        session.commit()
+
+        # Still holds its slot and isn't requeued
+        assert claim_jobs(session, "housekeeping", 1, 1, "test") == []
+        assert requeue_stale_jobs(session) == (0, 0)
+
+        session.execute(jobs.update().where(jobs.c.id == slow)
+                        .values(started_at=datetime.utcnow() - timeout - timedelta(minutes=1)))
+        session.commit()
+        assert requeue_stale_jobs(session) == (1, 0)
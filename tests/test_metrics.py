@@ -0,0 +1,123 @@
+import logging
+import re
+
+from flask import Response, jsonify, stream_with_context
+import pytest
+from sqlalchemy import select, text
+from sqlalchemy.exc import OperationalError
+
+from metrics import metrics
+from models import db, Produce
+
+
+@pytest.fixture
+def app(app):
+    # Routes whose SQL the tests control, added before the app serves its first request
+    def repeat(times):
+        for produce_id in range(times):
+            db.session.execute(select(Produce.name).where(Produce.id == produce_id)).all()
+        return jsonify(times)
+
+    def streamed():
+        def rows():
+            for produce_id in range(3):
+                yield f"{db.session.execute(select(Produce.id).where(Produce.id == produce_id)).scalar()}\n"
+        return Response(stream_with_context(rows()), mimetype="text/plain")
+
+    def failing_statement():
+        try:
+            db.session.execute(text("SELECT * FROM nowhere"))
+        except OperationalError:
+            db.session.rollback()
+        return jsonify(db.session.execute(select(Produce.id)).scalars().all())
+
+    def broken():
+        raise RuntimeError("broken view")
+
+    app.add_url_rule("/test/repeat/<int:times>", view_func=repeat)
+    app.add_url_rule("/test/streamed", view_func=streamed)
+    app.add_url_rule("/test/failing-statement", view_func=failing_statement)
+    app.add_url_rule("/test/broken", view_func=broken)
+    return app
+
+
+def sample(client, name, **labels):
+    # The value of one series on /metrics, 0 if it hasn't been observed yet
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    wanted = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    match = re.search(rf"^{name}{{{re.escape(wanted)}}} (\S+)$", response.text, re.MULTILINE)
+    return float(match.group(1)) if match else 0
+
+
+def test_metrics_show_requests_and_their_statements(client, seeded):
+    labels = {"method": "GET", "route": "/api/produce/categories", "status": 200}
+    before = sample(client, "sokohub_request_duration_seconds_count", **labels)
+    statements_before = sample(client, "sokohub_request_sql_statements_sum", **labels)
+
+    assert client.get("/api/produce/categories").status_code == 200
+    assert client.get("/api/produce/categories").status_code == 200
+
+    text = client.get("/metrics").text
+    assert "# TYPE sokohub_request_duration_seconds histogram" in text
+    assert "# TYPE sokohub_n_plus_one_total counter" in text
+    assert sample(client, "sokohub_request_duration_seconds_count", **labels) == before + 2
+    # The second request is served from the cache
+    assert sample(client, "sokohub_request_sql_statements_sum", **labels) == statements_before + 1
+
+
+def test_a_statement_repeated_past_the_threshold_is_flagged(client, seeded, caplog):
+    route = {"route": "/test/repeat/<int:times>"}
+    before = sample(client, "sokohub_n_plus_one_total", **route)
+
+    with caplog.at_level(logging.WARNING, logger="sokohub.metrics"):
+        client.get(f"/test/repeat/{metrics.n_plus_one_threshold - 1}")
+        assert sample(client, "sokohub_n_plus_one_total", **route) == before
+        client.get(f"/test/repeat/{metrics.n_plus_one_threshold}")
+    assert sample(client, "sokohub_n_plus_one_total", **route) == before + 1
+    [record] = caplog.records
+    assert record.getMessage().startswith(
+        f"Possible N+1 on GET /test/repeat/<int:times>: statement ran {metrics.n_plus_one_threshold} times")
+
+
+def test_sql_run_while_the_body_streams_is_counted(client, seeded):
+    labels = {"method": "GET", "route": "/test/streamed", "status": 200}
+    before = sample(client, "sokohub_request_sql_statements_sum", **labels)
+
+    response = client.get("/test/streamed")
+    assert response.text.splitlines() == ["None", "1", "2"]
+    response.close()
+    assert sample(client, "sokohub_request_sql_statements_sum", **labels) == before + 3
+
+
+def test_a_failed_statement_is_counted_and_leaves_no_timer_behind(app, client, seeded):
+    labels = {"method": "GET", "route": "/test/failing-statement", "status": 200}
+    before = sample(client, "sokohub_request_sql_statements_sum", **labels)
+    assert client.get("/test/failing-statement").json == seeded["produce_ids"]
+    assert sample(client, "sokohub_request_sql_statements_sum", **labels) == before + 2
+
+    with app.app_context():
+        with db.engine.connect() as connection:
+            with pytest.raises(OperationalError):
+                connection.execute(text("SELECT * FROM nowhere"))
+            assert connection.info["query_started"] == []
+
+
+def test_a_request_that_raised_is_counted_as_a_500(client):
+    labels = {"method": "GET", "route": "/test/broken", "status": 500}
+    before = sample(client, "sokohub_request_duration_seconds_count", **labels)
+    with pytest.raises(RuntimeError):
+        client.get("/test/broken")
+    assert sample(client, "sokohub_request_duration_seconds_count", **labels) == before + 1
+
+
+def test_metrics_can_be_turned_off(tmp_path):
+    from tests.conftest import make_app
+
+    app = make_app(f"sqlite:///{tmp_path / 'off.db'}", METRICS_ENABLED=False)
+    try:
+        assert app.test_client().get("/metrics").status_code == 404
+        assert not metrics._listening
+    finally:
+        # Back on for the apps the other tests make
+        metrics._listen(True)
@@ -0,0 +1,55 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import IntegrityError
+
+from tests.conftest import migrate
+
+BEFORE_PARTITIONING = "9e3f6b1d2a47"
+
+
+def insert_payment(connection, **values):
+    connection.execute(text("""
+        INSERT INTO payments (vendor_id, amount, payment_status, merchant_request_id, order_id, created_at)
+        VALUES (1, 100, 'Pending', :merchant_request_id, :order_id, :created_at)
+    """), {"merchant_request_id": "29115-1", "order_id": None, "created_at": datetime(2025, 7, 1), **values})
+
+
+def relkind(connection, table):
+    return connection.execute(text("SELECT relkind FROM pg_class WHERE oid = CAST(:table AS regclass)"),
+                              {"table": table}).scalar()
+
+
+def test_partitioning_migrates_down_and_up_again(postgres_database):
+    engine = create_engine(postgres_database)
+    try:
+        with engine.begin() as connection:
+            connection.execute(text("""
+                INSERT INTO vendors (id, name, email, phone, password)
+                VALUES (1, 'Mama Mboga', 'mboga@example.com', '254711000001', '-')
+            """))
+            insert_payment(connection)
+
+        # What the partitioned tables can't hold as keys is still enforced, a repeated
+        # MerchantRequestID in another month included
+        for values in ({}, {"created_at": datetime(2025, 8, 15)},
+                       {"merchant_request_id": "29115-2", "order_id": 42}):
+            with pytest.raises(IntegrityError), engine.begin() as connection:
+                insert_payment(connection, **values)
+
+        migrate(postgres_database, BEFORE_PARTITIONING, downgrade=True)
+        with engine.begin() as connection:
+            assert (relkind(connection, "orders"), relkind(connection, "payments")) == ("r", "r")
+            assert connection.execute(text("SELECT count(*) FROM payments")).scalar() == 1
+        with pytest.raises(IntegrityError), engine.begin() as connection:
+            insert_payment(connection, merchant_request_id="29115-2", order_id=42)
+
+        migrate(postgres_database)
+        with engine.begin() as connection:
+            assert (relkind(connection, "orders"), relkind(connection, "payments")) == ("p", "p")
+            assert connection.execute(text("SELECT count(*) FROM payments")).scalar() == 1
+        with pytest.raises(IntegrityError), engine.begin() as connection:
+            insert_payment(connection, created_at=datetime(2025, 8, 15))
+    finally:
+        engine.dispose()
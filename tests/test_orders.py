@@ -0,0 +1,50 @@
+import pytest
+
+
+@pytest.mark.parametrize("app", ["sqlite", "postgresql"], indirect=True)
+def test_order_list_statements_do_not_grow_with_orders(client, seeded, add_orders, auth, count_queries):
+    vendor_id = seeded["vendor_ids"][0]
+    headers = auth(vendor_id)
+
+    counts = {}
+    added = 0
+    for total in (3, 300):
+        add_orders(vendor_id, total - added)
+        added = total
+        with count_queries() as statements:
+            response = client.get("/api/orders?limit=500", headers=headers)
+        assert response.status_code == 200
+        assert len(response.json) == total
+        counts[total] = len(statements)
+
+    assert counts[3] == counts[300]
+
+
+def test_order_list_pages_cover_every_order_once(client, seeded, add_orders, auth):
+    vendor_id, other_vendor_id = seeded["vendor_ids"]
+    add_orders(vendor_id, 25)
+    add_orders(other_vendor_id, 5)
+    headers = auth(vendor_id)
+
+    seen = []
+    path = "/api/orders?limit=10"
+    while path:
+        response = client.get(path, headers=headers)
+        assert response.status_code == 200
+        seen.extend(order["id"] for order in response.json)
+        cursor = response.headers.get("X-Next-Cursor")
+        path = f"/api/orders?limit=10&cursor={cursor}" if cursor else None
+
+    assert len(seen) == len(set(seen)) == 25
+    assert {order["produce"] for order in client.get("/api/orders", headers=headers).json} == \
+        {"Tomatoes", "Sukuma wiki", "Mangoes"}
+
+
+def test_order_list_filters_by_status(client, seeded, add_orders, auth):
+    vendor_id = seeded["vendor_ids"][0]
+    add_orders(vendor_id, 4)
+    add_orders(vendor_id, 2, order_status="Paid")
+
+    response = client.get("/api/orders?status=paid", headers=auth(vendor_id))
+    assert response.status_code == 200
+    assert [order["order_status"] for order in response.json] == ["Paid", "Paid"]
@@ -0,0 +1,214 @@
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+
+import pytest
+import requests
+from sqlalchemy.exc import IntegrityError
+
+from jobs import GiveUp
+from models import db, MpesaCallback, Payment
+from mpesa import DarajaClient, DarajaError
+from payments import CALLBACK_WINDOW, apply_callbacks, record_callback
+import tasks
+
+
+@pytest.fixture
+def daraja():
+    # A Daraja that answers each STK push with the next (status, body) in replies
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.reply(200, {"access_token": "token", "expires_in": "3599"})
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            server.pushes += 1
+            self.reply(*server.replies.pop(0))
+
+        def reply(self, status, body):
+            data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.replies = []
+    server.pushes = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.client = DarajaClient(base_url=f"http://127.0.0.1:{server.server_port}", consumer_key="key",
+                                 consumer_secret="secret", backoff=0)
+    yield server
+    server.shutdown()
+
+
+ACCEPTED = {"ResponseCode": "0", "MerchantRequestID": "29115-1", "CheckoutRequestID": "ws_CO_1"}
+
+
+def test_stk_push_retries_statuses_daraja_turned_away(daraja):
+    daraja.replies = [(429, {}), (503, {}), (200, ACCEPTED)]
+    assert daraja.client.stk_push("254711000001", 100, "254700000001") == ACCEPTED
+    assert daraja.pushes == 3
+
+
+@pytest.mark.parametrize("status", [500, 502, 504])
+def test_stk_push_is_not_resent_after_other_server_errors(daraja, status):
+    daraja.replies = [(status, "<html>Bad Gateway</html>"), (200, ACCEPTED)]
+    with pytest.raises(DarajaError) as raised:
+        daraja.client.stk_push("254711000001", 100, "254700000001")
+    assert raised.value.maybe_sent
+    assert daraja.pushes == 1
+
+
+def test_non_json_token_answer_is_a_daraja_error(daraja):
+    daraja.RequestHandlerClass.do_GET = lambda handler: handler.reply(200, "<html>Maintenance</html>")
+    with pytest.raises(DarajaError) as raised:
+        daraja.client.access_token()
+    assert not raised.value.maybe_sent
+
+
+def test_refused_connection_is_retried_then_not_sent():
+    client = DarajaClient(base_url="http://127.0.0.1:1", backoff=0, retries=1)
+    client._token, client._token_expires_at = "token", float("inf")
+    with pytest.raises(DarajaError) as raised:
+        client.stk_push("254711000001", 100, "254700000001")
+    assert not raised.value.maybe_sent
+    assert isinstance(raised.value.__cause__, requests.ConnectionError)
+
+
+@pytest.fixture
+def queued_payment(app, seeded):
+    with app.app_context():
+        payment = Payment(vendor_id=seeded["vendor_ids"][0], farmer_id=seeded["farmer_ids"][0], amount=100,
+                          payment_status="Queued")
+        db.session.add(payment)
+        db.session.commit()
+        return {"payment_id": payment.id, "amount": 100, "phone_number": "254711000001",
+                "farmer_number": "254700000001"}
+
+
+@pytest.fixture
+def pushes(monkeypatch):
+    # Each call to the task's lipa_na_mpesa_pochi takes the next outcome, an exception is raised
+    outcomes = []
+
+    def push(phone_number, amount, farmer_number):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(tasks, "lipa_na_mpesa_pochi", push)
+    return outcomes
+
+
+def payment_status(payment_id):
+    db.session.expire_all()
+    return db.session.get(Payment, payment_id).payment_status
+
+
+def test_stk_push_job_records_the_push(app, queued_payment, pushes):
+    pushes.append(ACCEPTED)
+    with app.app_context():
+        tasks.stk_push(db.session, **queued_payment)
+        payment = db.session.get(Payment, queued_payment["payment_id"])
+        assert (payment.payment_status, payment.merchant_request_id) == ("Pending", "29115-1")
+
+        # A rerun, e.g. after finishing the job failed, doesn't push again
+        tasks.stk_push(db.session, **queued_payment)
+    assert pushes == []
+
+
+def test_stk_push_job_retries_only_pushes_that_were_not_sent(app, queued_payment, pushes):
+    pushes.extend([DarajaError("refused"), DarajaError("read timed out", maybe_sent=True)])
+    with app.app_context():
+        with pytest.raises(DarajaError):
+            tasks.stk_push(db.session, **queued_payment)
+        assert payment_status(queued_payment["payment_id"]) == "Queued"
+
+        with pytest.raises(GiveUp):
+            tasks.stk_push(db.session, **queued_payment)
+        assert payment_status(queued_payment["payment_id"]) == "Sending"
+
+
+def test_stk_push_job_is_not_resent_when_recording_it_failed(app, queued_payment, pushes, monkeypatch):
+    pushes.extend([ACCEPTED, ACCEPTED])
+    with app.app_context():
+        commit = db.session.commit
+        commits = []
+
+        def failing_commit():
+            commits.append(1)
+            if len(commits) == 2:
+                raise RuntimeError("database went away")
+            commit()
+
+        with monkeypatch.context() as patch, pytest.raises(RuntimeError):
+            patch.setattr(db.session, "commit", failing_commit)
+            tasks.stk_push(db.session, **queued_payment)
+        db.session.rollback()
+
+        with pytest.raises(GiveUp):
+            tasks.stk_push(db.session, **queued_payment)
+    assert pushes == [ACCEPTED]
+
+
+@pytest.mark.parametrize("app", ["sqlite", "postgresql"], indirect=True)
+def test_callback_waits_for_its_payment(app, seeded):
+    with app.app_context():
+        session = db.session
+        record_callback(session, "29115-early", 0, "QK1", {})
+        record_callback(session, "29115-stale", 0, "QK2", {})
+        session.query(MpesaCallback).filter_by(merchant_request_id="29115-stale").update(
+            {"created_at": datetime.utcnow() - CALLBACK_WINDOW - timedelta(minutes=1)})
+        session.commit()
+
+        assert apply_callbacks(session) == 2
+        # The stale one is given up on, the early one waits and isn't picked up again straight away
+        assert {c.merchant_request_id: c.processed_at is not None for c in session.query(MpesaCallback)} == \
+            {"29115-early": False, "29115-stale": True}
+        assert apply_callbacks(session) == 0
+
+        payment = Payment(vendor_id=seeded["vendor_ids"][0], amount=100, payment_status="Pending",
+                          merchant_request_id="29115-early")
+        session.add(payment)
+        session.query(MpesaCallback).update({"retry_at": datetime.utcnow()})
+        session.commit()
+
+        assert apply_callbacks(session) == 1
+        session.expire_all()
+        assert (payment.payment_status, payment.mpesa_code) == ("Completed", "QK1")
+        assert session.query(MpesaCallback).filter(MpesaCallback.processed_at.is_(None)).count() == 0
+
+
+@pytest.mark.parametrize("app", ["sqlite", "postgresql"], indirect=True)
+def test_a_merchant_request_id_belongs_to_one_payment(app, seeded):
+    vendor_id = seeded["vendor_ids"][0]
+    with app.app_context():
+        session = db.session
+        session.add(Payment(vendor_id=vendor_id, amount=100, payment_status="Pending",
+                            merchant_request_id="29115-1", created_at=datetime(2025, 7, 1)))
+        queued = Payment(vendor_id=vendor_id, amount=100, payment_status="Queued", created_at=datetime(2025, 8, 15))
+        session.add(queued)
+        session.commit()
+
+        # Not even in another month, where a partitioned table's own index can't see it
+        session.add(Payment(vendor_id=vendor_id, amount=100, payment_status="Pending",
+                            merchant_request_id="29115-1", created_at=datetime(2025, 8, 15)))
+        with pytest.raises(IntegrityError):
+            session.commit()
+        session.rollback()
+
+        # Nor by a queued payment's push being recorded under it later
+        queued.merchant_request_id = "29115-1"
+        with pytest.raises(IntegrityError):
+            session.commit()
+        session.rollback()
+
+        queued.merchant_request_id = "29115-2"
+        session.commit()
+        assert session.query(Payment).filter(Payment.merchant_request_id.isnot(None)).count() == 2
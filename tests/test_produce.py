@@ -0,0 +1,239 @@
+from datetime import datetime, timedelta
+import json
+
+import pytest
+from sqlalchemy import insert
+
+from cache import RedisBackend, cache
+from models import db, Produce
+
+
+def test_post_produce(client, seeded, auth):
+    response = client.post("/api/farmer/produce", headers=auth(seeded["farmer_ids"][0], role="farmer"), json={
+        "name": "Avocado", "category": "fruit", "quantity": 40, "price": 15, "quality": "A"})
+    assert response.status_code == 201
+    with client.application.app_context():
+        produce = db.session.get(Produce, response.json["produce_id"])
+        assert (produce.unit_price, produce.category) == (15, "fruit")
+    assert "Avocado" in {item["name"] for item in client.get("/api/produce").json}
+
+
+def test_bulk_quantities_must_be_whole_numbers(client, seeded, auth):
+    rows = [{"name": "Maize", "quantity": quantity, "price": 40, "quality": "B"}
+            for quantity in (12, "12", 1.5, "1.5", True)]
+    response = client.post("/api/farmer/produce/bulk", headers=auth(seeded["farmer_ids"][0], role="farmer"),
+                           data="".join(json.dumps(row) + "\n" for row in rows), content_type="application/x-ndjson")
+    assert response.status_code == 201
+    assert [("id" in result, result.get("errors")) for result in response.json["results"]] == [
+        (True, None), (True, None),
+        (False, ["quantity must be a whole number"]),
+        (False, ["quantity must be a whole number"]),
+        (False, ["quantity must be a whole number"]),
+    ]
+
+
+@pytest.mark.parametrize("app", ["sqlite", "postgresql"], indirect=True)
+def test_bulk_rows_with_fields_the_columns_cannot_hold_are_rejected(client, seeded, auth):
+    base = {"name": "Maize", "quantity": 5, "price": 40, "quality": "B"}
+    rows = [{**base, "category": "cereals", "description": "Dry"}, {**base, "category": "c" * 101},
+            {**base, "category": 7}, {**base, "description": ["dry"]}, {**base, "price": "100000000"},
+            {**base, "quantity": 2147483648}, {**base, "name": "n" * 101}, {**base, "name": 7},
+            {**base, "quality": "q" * 51}, {**base, "quality": {"grade": "B"}}]
+    response = client.post("/api/farmer/produce/bulk", headers=auth(seeded["farmer_ids"][0], role="farmer"),
+                           data="".join(json.dumps(row) + "\n" for row in rows), content_type="application/x-ndjson")
+    assert response.status_code == 201
+    assert [("id" in result, result.get("errors")) for result in response.json["results"]] == [
+        (True, None),
+        (False, ["category can't be longer than 100 characters"]),
+        (False, ["category must be text"]),
+        (False, ["description must be text"]),
+        (False, ["price can't be more than 99999999.99"]),
+        (False, ["quantity can't be more than 2147483647"]),
+        (False, ["name can't be longer than 100 characters"]),
+        (False, ["name must be text"]),
+        (False, ["quality can't be longer than 50 characters"]),
+        (False, ["quality must be text"]),
+    ]
+
+
+def test_bulk_upload_that_is_not_utf8_stops_with_a_row_error(client, seeded, auth):
+    body = b"name,quantity,price,quality\nMaize,5,40,B\nMa\xffize,5,40,B\n"
+    response = client.post("/api/farmer/produce/bulk", headers=auth(seeded["farmer_ids"][0], role="farmer"),
+                           data=body, content_type="text/csv")
+    assert response.status_code == 400
+    assert response.json["results"] == [{"row": 1, "errors": ["Upload is not valid UTF-8, stopped here"]}]
+
+
+@pytest.mark.parametrize("role", ["vendor", None])
+def test_bulk_upload_is_for_farmers_only(client, seeded, auth, role):
+    headers = auth(seeded["farmer_ids"][0], role=role)
+    response = client.post("/api/farmer/produce/bulk", headers=headers, content_type="application/x-ndjson",
+                           data=json.dumps({"name": "Maize", "quantity": 5, "price": 40, "quality": "B"}) + "\n")
+    assert response.status_code == 403
+    with client.application.app_context():
+        assert db.session.query(Produce).filter_by(name="Maize").count() == 0
+
+
+def produce_pages(client, query=""):
+    # Follows X-Next-Cursor from the first page, returning the ids on each page
+    pages = []
+    path = f"/api/produce?limit=2{query}"
+    while path:
+        response = client.get(path)
+        assert response.status_code == 200
+        pages.append([item["id"] for item in response.json])
+        cursor = response.headers.get("X-Next-Cursor")
+        path = f"/api/produce?limit=2{query}&cursor={cursor}" if cursor else None
+    return pages
+
+
+def test_produce_pages_cover_every_listing_once_newest_first(app, client, seeded):
+    with app.app_context():
+        for offset, produce_id in enumerate(seeded["produce_ids"]):
+            db.session.get(Produce, produce_id).created_at = datetime(2026, 1, 1) + timedelta(hours=offset)
+        # Two listings posted in the same instant are told apart by id
+        db.session.get(Produce, seeded["produce_ids"][1]).created_at = datetime(2026, 1, 1)
+        db.session.commit()
+    tomatoes, sukuma, mangoes = seeded["produce_ids"]
+
+    assert produce_pages(client) == [[mangoes, sukuma], [tomatoes]]
+    # A full last page still carries a cursor, the page after it is empty
+    assert produce_pages(client, "&category=vegetables") == [[sukuma, tomatoes], []]
+
+
+def test_produce_page_with_a_bad_cursor_is_a_400(client, seeded):
+    assert client.get("/api/produce?cursor=not-a-cursor").status_code == 400
+
+
+class FakeRedis:
+    # The handful of redis.Redis calls RedisBackend makes, over a dict. Expiry isn't modelled.
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value.encode()
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, 0)) + 1).encode()
+        return int(self.data[key])
+
+    def expire(self, key, ttl, nx=False):
+        return True
+
+    def scan_iter(self, pattern):
+        return [key for key in list(self.data) if key.startswith(pattern.rstrip("*"))]
+
+    def pipeline(self):
+        redis, calls = self, []
+
+        class Pipeline:
+            def __getattr__(self, name):
+                return lambda *args, **kwargs: calls.append((name, args, kwargs))
+
+            def execute(self):
+                return [getattr(redis, name)(*args, **kwargs) for name, args, kwargs in calls]
+        return Pipeline()
+
+
+@pytest.fixture(params=["memory", "redis"])
+def cache_backend(request, app):
+    # The app's own MemoryBackend, or RedisBackend over FakeRedis in its place
+    if request.param == "redis":
+        cache.backend = RedisBackend(FakeRedis())
+    return request.param
+
+
+def post_produce(client, auth, farmer_id, **fields):
+    response = client.post("/api/farmer/produce", headers=auth(farmer_id, role="farmer"), json={
+        "name": "Avocado", "category": "fruit", "quantity": 40, "price": 15, "quality": "A", **fields})
+    assert response.status_code == 201
+
+
+def test_categories_are_not_modified_until_produce_is_posted(client, seeded, auth, cache_backend):
+    response = client.get("/api/produce/categories")
+    assert response.status_code == 200
+    etag, last_modified = response.headers["ETag"], response.headers["Last-Modified"]
+    assert sorted(response.json) == ["fruit", "vegetables"]
+
+    assert client.get("/api/produce/categories", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/api/produce/categories", headers={"If-Modified-Since": last_modified}).status_code == 304
+
+    post_produce(client, auth, seeded["farmer_ids"][0], category="herbs")
+    response = client.get("/api/produce/categories", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert sorted(response.json) == ["fruit", "herbs", "vegetables"]
+
+
+def test_category_page_is_not_modified_until_that_category_changes(client, seeded, auth, cache_backend):
+    response = client.get("/api/produce?category=fruit")
+    etag = response.headers["ETag"]
+    assert [item["name"] for item in response.json] == ["Mangoes"]
+    assert client.get("/api/produce?category=fruit", headers={"If-None-Match": etag}).status_code == 304
+
+    # A sale of vegetables leaves the fruit page cached
+    response = client.post("/api/orders", headers=auth(seeded["vendor_ids"][0]),
+                           json={"produce_id": seeded["produce_ids"][0], "quantity": 5})
+    assert response.status_code == 201
+    assert client.get("/api/produce?category=fruit", headers={"If-None-Match": etag}).status_code == 304
+
+    post_produce(client, auth, seeded["farmer_ids"][1])
+    response = client.get("/api/produce?category=fruit", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert [item["name"] for item in response.json] == ["Avocado", "Mangoes"]
+
+
+def test_redis_backend_keeps_values_and_counts_under_its_prefix():
+    client = FakeRedis()
+    backend = RedisBackend(client, prefix="test:")
+    backend.set("page", {"items": [1, 2]})
+    assert backend.get("page") == {"items": [1, 2]}
+    assert [backend.incr("hits", 60) for _ in range(3)] == [1, 2, 3]
+    assert set(client.data) == {"test:page", "test:hits"}
+
+    backend.delete("page")
+    assert backend.get("page") is None
+    backend.clear()
+    assert client.data == {}
+
+
+def test_produce_batch_keeps_the_order_asked_and_skips_unknown_ids(client, seeded):
+    tomatoes, sukuma, mangoes = seeded["produce_ids"]
+    response = client.get(f"/api/produce?ids={mangoes},999,{tomatoes},{mangoes}")
+    assert response.status_code == 200
+    assert [item["id"] for item in response.json] == [mangoes, tomatoes]
+    assert client.get("/api/produce?ids=998,999").json == []
+
+
+@pytest.mark.parametrize("ids", ["0", "-3", "1,2147483648", "1,99999999999999999999999", "1,two", ","])
+def test_produce_batch_with_ids_that_cannot_be_listings_is_a_400(client, seeded, ids):
+    assert client.get(f"/api/produce?ids={ids}").status_code == 400
+
+
+def test_produce_detail_past_the_id_column_is_a_404(client, seeded):
+    assert client.get("/api/produce/99999999999999999999999").status_code == 404
+
+
+def test_unknown_produce_ids_leave_the_cache_alone(client, seeded):
+    tomatoes = seeded["produce_ids"][0]
+    client.get(f"/api/produce?ids={tomatoes}")
+    entries = len(cache.backend._entries)
+
+    unknown = ",".join(str(produce_id) for produce_id in range(1000, 1100))
+    assert client.get(f"/api/produce?ids={unknown}").json == []
+    assert client.get("/api/produce/1100").status_code == 404
+    assert len(cache.backend._entries) == entries
+
+    # A listing that didn't exist when it was asked for is found once it does
+    with client.application.app_context():
+        db.session.execute(insert(Produce).values(
+            id=1000, name="Avocado", category="fruit", unit_price=15, quantity=50, quality="A",
+            farmer_id=seeded["farmer_ids"][0]))
+        db.session.commit()
+    assert [item["id"] for item in client.get(f"/api/produce?ids={unknown}").json] == [1000]
@@ -0,0 +1,32 @@
+import pytest
+
+from models import db
+from ratelimit import Limit
+from tests.conftest import make_app
+
+
+@pytest.fixture
+def app(tmp_path):
+    # Behind one proxy, with room for two requests per IP and one per account
+    app = make_app(f"sqlite:///{tmp_path / 'sokohub.db'}", RATELIMIT_ENABLED=True, PROXY_FIX_X_FOR=1,
+                   RATE_LIMITS={"ip": Limit(0.001, 2), "identity": Limit(0.001, 1)})
+    with app.app_context():
+        db.create_all(bind_key=None)
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+
+def categories_status(client, address, headers=None):
+    return client.get("/api/produce/categories", headers={"X-Forwarded-For": address, **(headers or {})}).status_code
+
+
+def test_clients_behind_the_proxy_get_their_own_buckets(client):
+    assert [categories_status(client, "196.201.214.10") for _ in range(3)] == [200, 200, 429]
+    assert categories_status(client, "196.201.214.11") == 200
+
+
+def test_farmer_and_vendor_with_the_same_id_get_their_own_buckets(client, auth):
+    assert categories_status(client, "196.201.214.10", auth(1, role="vendor")) == 200
+    assert categories_status(client, "196.201.214.11", auth(1, role="vendor")) == 429
+    assert categories_status(client, "196.201.214.12", auth(1, role="farmer")) == 200
@@ -0,0 +1,19 @@
+import pytest
+
+
+@pytest.mark.parametrize("rating", [4.0, True, "4", 6, 0])
+def test_rating_must_be_a_whole_number_from_1_to_5(client, seeded, auth, rating):
+    response = client.post("/api/reviews", json={"farmer_id": seeded["farmer_ids"][0], "rating": rating},
+                           headers=auth(seeded["vendor_ids"][0]))
+    assert response.status_code == 400
+
+
+def test_reviews_add_up_in_the_farmer_rating(client, seeded, auth):
+    farmer_id = seeded["farmer_ids"][0]
+    for vendor_id, rating in zip(seeded["vendor_ids"], (5, 2)):
+        response = client.post("/api/reviews", json={"farmer_id": farmer_id, "rating": rating},
+                               headers=auth(vendor_id))
+        assert response.status_code == 201
+
+    rating = client.get(f"/api/farmers/{farmer_id}/rating").json
+    assert (rating["count"], rating["average"]) == (2, 3.5)
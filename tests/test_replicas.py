@@ -0,0 +1,89 @@
+from datetime import datetime
+import sqlite3
+import time
+
+import pytest
+
+from models import db, Order
+from replicas import REPLICA_BIND
+from tests.conftest import make_app
+
+REPLICA_MAX_LAG = 1  # seconds
+
+
+@pytest.fixture
+def app(tmp_path):
+    # Two SQLite files standing in for a primary and its replica
+    app = make_app(f"sqlite:///{tmp_path / 'primary.db'}", DATABASE_REPLICA_URL=f"sqlite:///{tmp_path / 'replica.db'}",
+                   REPLICA_MAX_LAG=REPLICA_MAX_LAG, REPLICA_SINGLE_PROCESS=True)
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+@pytest.fixture
+def replicated(app, seeded, tmp_path):
+    # Copy the seeded primary over, then give the replica one order of its own so a
+    # response shows which database answered
+    with sqlite3.connect(tmp_path / "primary.db") as source, sqlite3.connect(tmp_path / "replica.db") as target:
+        source.backup(target)
+    with app.app_context():
+        db.engines[REPLICA_BIND].dispose()
+        with db.engines[REPLICA_BIND].begin() as connection:
+            connection.execute(Order.__table__.insert().values(
+                vendor_id=seeded["vendor_ids"][0], farmer_id=seeded["farmer_ids"][0],
+                produce_id=seeded["produce_ids"][0], quantity=99, total_price=7920, order_status="Pending",
+                created_at=datetime.utcnow()))
+    return seeded
+
+
+def order_quantities(client, headers):
+    response = client.get("/api/orders", headers=headers)
+    assert response.status_code == 200
+    return [order["quantity"] for order in response.json]
+
+
+def test_a_replica_needs_a_shared_cache(tmp_path):
+    # Other workers couldn't see the writes a per-process cache records
+    with pytest.raises(ValueError, match="CACHE_REDIS_URL"):
+        make_app(f"sqlite:///{tmp_path / 'primary.db'}", DATABASE_REPLICA_URL=f"sqlite:///{tmp_path / 'replica.db'}")
+
+
+def test_vendor_reads_follow_their_own_writes(app, client, replicated, auth):
+    vendor_id, other_vendor_id = replicated["vendor_ids"]
+    headers = auth(vendor_id)
+    assert order_quantities(client, headers) == [99]
+
+    response = client.post("/api/orders", json={"produce_id": replicated["produce_ids"][0], "quantity": 2},
+                           headers=headers)
+    assert response.status_code == 201
+    with app.app_context():
+        with db.engines[REPLICA_BIND].connect() as connection:
+            assert connection.execute(Order.__table__.select().where(Order.quantity == 2)).first() is None
+
+    # Straight after the write the primary answers, everyone else still reads the replica
+    assert order_quantities(client, headers) == [2]
+    assert order_quantities(client, auth(other_vendor_id)) == []
+
+    time.sleep(REPLICA_MAX_LAG + 0.1)
+    assert order_quantities(client, headers) == [99]
+
+
+def test_listings_read_the_primary_while_stock_just_changed(app, client, replicated, auth):
+    def tomatoes_stock():
+        listing = client.get("/api/produce").json
+        return next(item["quantity"] for item in listing if item["name"] == "Tomatoes")
+
+    time.sleep(REPLICA_MAX_LAG + 0.1)
+    with app.app_context():
+        with db.engines[REPLICA_BIND].begin() as connection:
+            connection.exec_driver_sql("UPDATE produce SET quantity = 1 WHERE name = 'Tomatoes'")
+    assert tomatoes_stock() == 1
+
+    response = client.post("/api/orders", json={"produce_id": replicated["produce_ids"][0], "quantity": 5},
+                           headers=auth(replicated["vendor_ids"][1]))
+    assert response.status_code == 201
+    assert tomatoes_stock() == 495
@@ -0,0 +1,48 @@
+import pytest
+
+from models import db
+from search import memory_search
+
+pytestmark = pytest.mark.parametrize("app", ["sqlite", "postgresql"], indirect=True)
+
+
+def names(client, q):
+    response = client.get("/api/produce/search", query_string={"q": q})
+    assert response.status_code == 200
+    return [result["name"] for result in response.json["results"]]
+
+
+def test_words_match_as_prefixes(client, seeded):
+    # None of these is close enough to a name for the typo fallback
+    assert names(client, "suk") == ["Sukuma wiki"]
+    assert names(client, "toma nak") == ["Tomatoes"]
+    assert sorted(names(client, "veg")) == ["Sukuma wiki", "Tomatoes"]
+
+
+def test_typo_fallback_covers_category(client, seeded):
+    assert names(client, "tomatos") == ["Tomatoes"]
+    assert sorted(names(client, "vegetabels")) == ["Sukuma wiki", "Tomatoes"]
+
+
+def test_typo_fallback_pages_past_the_first(client, seeded):
+    def page(number):
+        response = client.get("/api/produce/search", query_string={"q": "vegetabels", "limit": 1, "page": number})
+        return [result["name"] for result in response.json["results"]]
+
+    assert sorted(page(1) + page(2)) == ["Sukuma wiki", "Tomatoes"]
+    assert page(3) == []
+
+
+def test_results_show_current_stock(app, client, seeded, auth):
+    assert names(client, "mangoes") == ["Mangoes"]
+    version = memory_search._version
+    response = client.post("/api/orders", json={"produce_id": seeded["produce_ids"][2], "quantity": 20},
+                           headers=auth(seeded["vendor_ids"][0]))
+    assert response.status_code == 201
+
+    [mangoes] = client.get("/api/produce/search?q=mangoes").json["results"]
+    assert mangoes["quantity"] == 280
+    with app.app_context():
+        if db.session.get_bind().dialect.name == "sqlite":
+            # A sale doesn't touch a searchable field, so the index isn't rebuilt
+            assert memory_search._version == version
@@ -0,0 +1,73 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import pytest
+
+from models import db, Produce
+
+BUYERS = 12
+
+
+@pytest.mark.parametrize("app", ["sqlite", "postgresql"], indirect=True)
+def test_concurrent_orders_never_oversell(app, seeded, auth):
+    # Mangoes has 300 in stock, every buyer wants 40 at once: 7 orders fit
+    produce_id = seeded["produce_ids"][2]
+    headers = auth(seeded["vendor_ids"][0])
+    start = threading.Barrier(BUYERS)
+
+    def buy(_):
+        client = app.test_client()
+        start.wait()
+        return client.post("/api/orders", json={"produce_id": produce_id, "quantity": 40}, headers=headers).status_code
+
+    with ThreadPoolExecutor(BUYERS) as pool:
+        statuses = list(pool.map(buy, range(BUYERS)))
+
+    assert sorted(statuses) == [201] * 7 + [400] * (BUYERS - 7)
+    with app.app_context():
+        assert db.session.get(Produce, produce_id).quantity == 300 - 7 * 40
+
+
+@pytest.mark.parametrize("quantity", [True, 1.5, "2", 0, -1, None])
+def test_order_quantity_must_be_a_positive_whole_number(client, seeded, auth, quantity):
+    body = {"produce_id": seeded["produce_ids"][0], "quantity": quantity}
+    if quantity is None:
+        del body["quantity"]
+    response = client.post("/api/orders", json=body, headers=auth(seeded["vendor_ids"][0]))
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("produce_id", [True, "1", 1.0, None])
+def test_order_produce_id_must_be_a_whole_number(client, seeded, auth, produce_id):
+    response = client.post("/api/orders", json={"produce_id": produce_id, "quantity": 1},
+                           headers=auth(seeded["vendor_ids"][0]))
+    assert response.status_code == 400
+    with client.application.app_context():
+        assert db.session.get(Produce, seeded["produce_ids"][0]).quantity == 500
+
+
+def test_an_order_only_evicts_the_listings_showing_its_stock(client, seeded, auth, count_queries):
+    def quantities(path):
+        return {item["name"]: item["quantity"] for item in client.get(path).json}
+
+    for path in ("/api/produce", "/api/produce?category=vegetables", "/api/produce?category=fruit",
+                 "/api/produce/categories"):
+        client.get(path)
+
+    response = client.post("/api/orders", json={"produce_id": seeded["produce_ids"][0], "quantity": 5},
+                           headers=auth(seeded["vendor_ids"][0]))
+    assert response.status_code == 201
+
+    with count_queries() as statements:
+        assert quantities("/api/produce?category=fruit") == {"Mangoes": 300}
+        assert sorted(client.get("/api/produce/categories").json) == ["fruit", "vegetables"]
+    assert statements == []
+    assert quantities("/api/produce")["Tomatoes"] == 495
+    assert quantities("/api/produce?category=vegetables")["Tomatoes"] == 495
+
+
+@pytest.mark.parametrize("item", [{"quantity": True}, {"quantity": 1.5}, {"quantity": 0}, {"produce_id": True}])
+def test_cart_items_must_be_a_produce_id_and_a_positive_whole_quantity(client, seeded, auth, item):
+    items = [{"produce_id": seeded["produce_ids"][0], "quantity": 1, **item}]
+    response = client.post("/api/orders/batch", json={"items": items}, headers=auth(seeded["vendor_ids"][0]))
+    assert response.status_code == 400